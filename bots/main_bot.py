@@ -57,8 +57,8 @@ async def error_handler(update: object, context: "telegram.ext.CallbackContext")
     if admin_contact_ids:
         for admin_id in admin_contact_ids:
             try:
-                await context.bot.send_message(
-                    chat_id=admin_id, text=message, parse_mode="HTML"
+                await message_dispatcher.send_message(
+                    context.bot, admin_id, message, priority=PRIORITY_HIGH, parse_mode="HTML"
                 )
             except Exception as e:
                 logger.error(f"Failed to send error message to admin {admin_id}: {e}")
@@ -68,9 +68,10 @@ async def error_handler(update: object, context: "telegram.ext.CallbackContext")
     # Optionally, send a generic message to the user
     if update and hasattr(update, 'effective_chat') and update.effective_chat:
         try:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="متاسفانه مشکلی در پردازش درخواست شما پیش آمده است. تیم پشتیبانی در جریان قرار گرفت."
+            await message_dispatcher.send_message(
+                context.bot,
+                update.effective_chat.id,
+                "متاسفانه مشکلی در پردازش درخواست شما پیش آمده است. تیم پشتیبانی در جریان قرار گرفت."
             )
         except Exception as e:
             logger.error(f"Failed to send error message to user: {e}")
@@ -90,15 +91,24 @@ from handlers.core import (
     registration_message_handler, # subscription_status_message_handler removed
     support_message_handler
 )
-from services.zarinpal_service import ZarinpalPaymentService
-from database.queries import DatabaseQueries
+from services.zarinpal_service import zarinpal_gateway
+from services.zarinpal_reconciler import ZarinpalReconciler, activate_zarinpal_payment, complete_verified_payment
+from services.crypto_payment_service import usdt_transfer_watcher, activate_crypto_payment
+from database.async_queries import AsyncDatabaseQueries
+from services.message_dispatcher import message_dispatcher, PRIORITY_HIGH
+from utils.price_utils import usdt_rate_provider
 from handlers.subscription.subscription_handlers import activate_or_extend_subscription
 from utils.constants.all_constants import (
     CALLBACK_BACK_TO_MAIN_MENU,
     TEXT_MAIN_MENU_STATUS,
     ZARINPAL_PAYMENT_VERIFIED_SUCCESS_AND_SUB_ACTIVATED_MESSAGE_USER,
+    ZARINPAL_GATEWAY_UNAVAILABLE_MESSAGE_USER,
+    ZARINPAL_PAYMENT_COMPLETION_DB_ERROR_MESSAGE_USER,
     ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER,
-    ZARINPAL_PAYMENT_VERIFIED_SUCCESS_PLAN_NOT_FOUND_MESSAGE_USER
+    ZARINPAL_PAYMENT_VERIFIED_SUCCESS_PLAN_NOT_FOUND_MESSAGE_USER,
+    CRYPTO_PAYMENT_CONFIRMED_MESSAGE_USER,
+    CRYPTO_PAYMENT_CONFIRMED_ACTIVATION_FAILED_MESSAGE_USER,
+    CRYPTO_PAYMENT_NEEDS_REVIEW_MESSAGE_USER
 )
 from utils.constants.all_constants import ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_ALREADY_VERIFIED_STATUS
 
@@ -129,7 +139,7 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         authority = args[0].replace('zarinpal_verify_', '')
         logger.info(f"User {user_id} returned from Zarinpal with authority: {authority}")
 
-        payment = DatabaseQueries.get_payment_by_authority(authority)
+        payment = await AsyncDatabaseQueries.get_payment_by_authority(authority)
 
         if not payment:
             logger.warning(f"No payment record found for authority: {authority}. User: {user_id}")
@@ -142,6 +152,12 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if payment['status'] == 'completed':
             logger.info(f"Payment {payment_db_id} for user {user_id} was already completed.")
+            # Activates it now if an earlier attempt failed; otherwise returns the subscription it activated
+            if not await activate_zarinpal_payment(payment_db_id, payment['user_id'], plan_id, rial_amount, payment.get('gateway_ref_id')):
+                await update.message.reply_text(
+                    ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER.format(ref_id=payment.get('gateway_ref_id'))
+                )
+                return
             await update.message.reply_text("✅ پرداخت شما قبلاً با موفقیت تایید و اشتراک شما فعال شده است.")
             # Optionally, show main menu
             await core_start_handler(update, context)
@@ -149,67 +165,64 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # Verify with Zarinpal
         await update.message.reply_text("در حال بررسی و تایید پرداخت شما... لطفاً چند لحظه صبر کنید.")
-        verification_result = ZarinpalPaymentService.verify_payment(amount=int(rial_amount), authority=authority)
+        verification_result = await zarinpal_gateway.verify_payment(amount=int(rial_amount), authority=authority)
 
         if verification_result and verification_result.get('status') in [ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_ALREADY_VERIFIED_STATUS]:
             ref_id = verification_result.get('ref_id')
             logger.info(f"Zarinpal verification successful for payment {payment_db_id}. RefID: {ref_id}")
             
-            # Update database and then re-fetch to ensure data consistency
-            update_success = DatabaseQueries.update_payment_verification_status(payment_db_id, 'completed', str(ref_id))
-
-            if update_success:
-                # Re-fetch payment details to ensure we have the latest status and ref_id
-                updated_payment_details = DatabaseQueries.get_payment_by_id(payment_db_id)
-                if updated_payment_details and updated_payment_details['status'] == 'completed':
-                    plan_info = DatabaseQueries.get_plan_by_id(plan_id)
-                    user_record = DatabaseQueries.get_user_details(user_id) # Fetch user record to get internal DB ID
-                    if plan_info and user_record:
-                        user_db_id = user_record['user_id']
-                        subscription_id = DatabaseQueries.add_subscription(
-                            user_id=user_db_id, # Use internal DB user_id
-                            plan_id=plan_id,
-                            payment_id=payment_db_id,
-                            plan_duration_days=plan_info['days'],
-                            amount_paid=rial_amount,
-                            payment_method='zarinpal'
-                        )
-                        if subscription_id:
-                            await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_AND_SUB_ACTIVATED_MESSAGE_USER.format(ref_id=ref_id, plan_name=plan_info['name']))
-                            
-                            # Send channel links and schedule for deletion
-                            channels_info_str = os.getenv('TELEGRAM_CHANNELS_INFO')
-                            if channels_info_str:
-                                try:
-                                    channels = json.loads(channels_info_str)
-                                    keyboard = [[InlineKeyboardButton(f"ورود به {channel['title']}", url=channel['link'])] for channel in channels]
-                                    keyboard.append([InlineKeyboardButton(constants.TEXT_BACK_TO_MAIN_MENU, callback_data=constants.CALLBACK_BACK_TO_MAIN_MENU)])
-                                    
-                                    reply_markup = InlineKeyboardMarkup(keyboard)
-                                    text = "🎉 عالی! اشتراک شما با موفقیت فعال شد. اکنون می‌توانید از طریق لینک‌های زیر به کانال و گروه دسترسی داشته باشید:\n\n⚠️ این لینک‌ها پس از ۵ دقیقه منقضی می‌شوند."
-                                    
-                                    # Send the message and schedule it for deletion
-                                    await send_and_schedule_deletion(update, context, text, reply_markup, 300)
-
-                                except json.JSONDecodeError:
-                                    logger.error("Failed to parse TELEGRAM_CHANNELS_INFO from .env")
-                                except Exception as e:
-                                    logger.error(f"An error occurred while sending channel links: {e}")
-                        else:
-                            await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER.format(ref_id=ref_id))
-                    else:
-                        await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_PLAN_NOT_FOUND_MESSAGE_USER.format(ref_id=ref_id))
+            # Claim the payment and activate it; a path that lost the claim gets the subscription
+            # the other path activated (add_subscription applies a payment only once)
+            claimed, subscription_id = await complete_verified_payment(payment_db_id, payment['user_id'], plan_id, rial_amount, ref_id)
+
+            if claimed is None:
+                # Database error, not a lost race: the payment stays pending for the reconciler
+                logger.error(f"Could not record completion of verified payment {payment_db_id} for user {user_id}; left pending.")
+                await update.message.reply_text(ZARINPAL_PAYMENT_COMPLETION_DB_ERROR_MESSAGE_USER.format(ref_id=ref_id))
+            elif not subscription_id:
+                # Completed but not activated: the reconciler retries the activation
+                plan_info = await AsyncDatabaseQueries.get_plan_by_id(plan_id)
+                if plan_info:
+                    await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER.format(ref_id=ref_id))
                 else:
-                    logger.error(f"Failed to verify payment update in DB for payment_id {payment_db_id}. Status is not 'completed'.")
-                    await update.message.reply_text("خطایی در به‌روزرسانی اطلاعات پرداخت رخ داد. لطفاً با پشتیبانی تماس بگیرید.")
+                    await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_PLAN_NOT_FOUND_MESSAGE_USER.format(ref_id=ref_id))
+            elif not claimed:
+                # Already completed meanwhile (e.g. by the background reconciler)
+                logger.info(f"Payment {payment_db_id} for user {user_id} was completed by another verification path.")
+                await update.message.reply_text("✅ پرداخت شما قبلاً با موفقیت تایید و اشتراک شما فعال شده است.")
+                await core_start_handler(update, context)
             else:
-                logger.error(f"Failed to execute update_payment_verification_status for payment_id {payment_db_id}.")
-                await update.message.reply_text("خطایی در ثبت اطلاعات پرداخت رخ داد. لطفاً با پشتیبانی تماس بگیرید.")
+                plan_info = await AsyncDatabaseQueries.get_plan_by_id(plan_id)
+                await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_AND_SUB_ACTIVATED_MESSAGE_USER.format(
+                    ref_id=ref_id, plan_name=plan_info['name'] if plan_info else ''))
+
+                # Send channel links and schedule for deletion
+                channels_info_str = os.getenv('TELEGRAM_CHANNELS_INFO')
+                if channels_info_str:
+                    try:
+                        channels = json.loads(channels_info_str)
+                        keyboard = [[InlineKeyboardButton(f"ورود به {channel['title']}", url=channel['link'])] for channel in channels]
+                        keyboard.append([InlineKeyboardButton(constants.TEXT_BACK_TO_MAIN_MENU, callback_data=constants.CALLBACK_BACK_TO_MAIN_MENU)])
+
+                        reply_markup = InlineKeyboardMarkup(keyboard)
+                        text = "🎉 عالی! اشتراک شما با موفقیت فعال شد. اکنون می‌توانید از طریق لینک‌های زیر به کانال و گروه دسترسی داشته باشید:\n\n⚠️ این لینک‌ها پس از ۵ دقیقه منقضی می‌شوند."
+
+                        # Send the message and schedule it for deletion
+                        await send_and_schedule_deletion(update, context, text, reply_markup, 300)
+
+                    except json.JSONDecodeError:
+                        logger.error("Failed to parse TELEGRAM_CHANNELS_INFO from .env")
+                    except Exception as e:
+                        logger.error(f"An error occurred while sending channel links: {e}")
+        elif zarinpal_gateway.is_transient(verification_result):
+            # Gateway outage: the payment stays pending_verification and can be verified later
+            logger.warning(f"Zarinpal unavailable while verifying payment {payment_db_id}: {verification_result}")
+            await update.message.reply_text(ZARINPAL_GATEWAY_UNAVAILABLE_MESSAGE_USER)
         else:
             error_code = verification_result.get('status', 'N/A')
             error_message_zarinpal = verification_result.get('error_message', 'خطای نامشخص')
             logger.error(f"Zarinpal verification failed for payment {payment_db_id}. Status: {error_code}, Message: {error_message_zarinpal}")
-            DatabaseQueries.update_payment_status(payment_db_id, 'failed', error_message=f"zarinpal_verify_err_{error_code}")
+            await AsyncDatabaseQueries.update_payment_status(payment_db_id, 'failed', error_message=f"zarinpal_verify_err_{error_code}")
             
             # Handle different error cases
             if error_code == -51:
@@ -287,6 +300,17 @@ class MainBot:
         # Initialize database
         self.db = DBConnection(config.DATABASE_NAME)
         Database.init_database()  # Changed from initialize_database to init_database
+
+        # Verifies Zarinpal payments whose users never came back through the deep link
+        self.zarinpal_reconciler = ZarinpalReconciler(
+            zarinpal_gateway,
+            batch_size=getattr(config, 'ZARINPAL_RECONCILE_BATCH', 50),
+            min_age=getattr(config, 'ZARINPAL_RECONCILE_MIN_AGE', 300),
+            max_age=getattr(config, 'ZARINPAL_RECONCILE_MAX_AGE', 3600),
+            on_activated=self.notify_reconciled_payment
+        )
+        usdt_transfer_watcher.on_paid = self.activate_paid_crypto_payment
+        usdt_transfer_watcher.on_review = self.report_crypto_payments_for_review
         
         # Setup handlers
         self.setup_handlers()
@@ -453,6 +477,11 @@ class MainBot:
         ]
         await self.application.bot.set_my_commands(commands)
         self.logger.info("Bot commands have been set.")
+        self.schedule_activity_flush()
+        self.schedule_usdt_rate_refresh()
+        self.schedule_zarinpal_reconciliation()
+        await AsyncDatabaseQueries.rebuild_pending_crypto_index()
+        self.schedule_crypto_payment_watch()
         await self.application.start()
         # Explicitly start polling via the Updater to ensure the bot receives updates.
         if self.application.updater:
@@ -462,8 +491,146 @@ class MainBot:
             self.logger.warning("Updater is not initialized for the main bot; no polling will occur.")
         self.logger.info("Main bot started")
     
+    def schedule_activity_flush(self):
+        """Periodically write buffered users.last_activity stamps"""
+        interval = getattr(config, 'USER_ACTIVITY_FLUSH_INTERVAL', 0)
+        if interval <= 0:
+            return
+        if self.application.job_queue is None:
+            self.logger.warning("JobQueue is not available; buffered user activity is only flushed on shutdown or when the buffer fills.")
+            return
+        self.application.job_queue.run_repeating(
+            self.flush_user_activity,
+            interval=interval,
+            first=interval,
+            name="flush_user_activity_job"
+        )
+        self.logger.info(f"Scheduled user activity flush every {interval} seconds.")
+
+    async def flush_user_activity(self, context: ContextTypes.DEFAULT_TYPE = None):
+        """Job callback: write buffered last_activity stamps off the event loop"""
+        await AsyncDatabaseQueries.flush_user_activity()
+
+    def schedule_usdt_rate_refresh(self):
+        """Keep the cached USDT→IRR rate warm so payment handlers never wait on Nobitex"""
+        if self.application.job_queue is None:
+            self.logger.warning("JobQueue is not available; the USDT rate is only refreshed when it is requested.")
+            return
+        self.application.job_queue.run_repeating(
+            self.refresh_usdt_rate,
+            interval=usdt_rate_provider.refresh_after or usdt_rate_provider.ttl,
+            first=0,
+            name="refresh_usdt_rate_job"
+        )
+
+    async def refresh_usdt_rate(self, context: ContextTypes.DEFAULT_TYPE = None):
+        """Job callback: refresh the USDT→IRR rate (shares any request already in flight)"""
+        await usdt_rate_provider.refresh()
+
+    def schedule_zarinpal_reconciliation(self):
+        """Periodically verify Zarinpal payments left in pending_verification"""
+        interval = getattr(config, 'ZARINPAL_RECONCILE_INTERVAL', 0)
+        if interval <= 0:
+            return
+        if self.application.job_queue is None:
+            self.logger.warning("JobQueue is not available; Zarinpal payments are only verified when users return from the gateway.")
+            return
+        self.application.job_queue.run_repeating(
+            self.reconcile_zarinpal_payments,
+            interval=interval,
+            first=interval,
+            name="reconcile_zarinpal_payments_job"
+        )
+        self.logger.info(f"Scheduled Zarinpal payment reconciliation every {interval} seconds.")
+
+    async def reconcile_zarinpal_payments(self, context: ContextTypes.DEFAULT_TYPE = None):
+        """Job callback: verify one batch of stale pending Zarinpal payments"""
+        await self.zarinpal_reconciler.run_once()
+
+    async def notify_reconciled_payment(self, payment, ref_id, subscription_id):
+        """Tell the user their payment was verified in the background"""
+        if subscription_id:
+            plan = await AsyncDatabaseQueries.get_plan_by_id(payment['plan_id'])
+            text = ZARINPAL_PAYMENT_VERIFIED_SUCCESS_AND_SUB_ACTIVATED_MESSAGE_USER.format(
+                ref_id=ref_id, plan_name=plan['name'] if plan else ''
+            )
+        else:
+            text = ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER.format(ref_id=ref_id)
+        try:
+            await message_dispatcher.send_message(self.application.bot, payment['user_id'], text, priority=PRIORITY_HIGH)
+        except Exception as e:
+            self.logger.warning(f"Could not notify user {payment['user_id']} about reconciled payment {payment['payment_id']}: {e}")
+
+    def schedule_crypto_payment_watch(self):
+        """Periodically match incoming USDT transfers against pending crypto payment requests"""
+        interval = getattr(config, 'CRYPTO_WATCH_INTERVAL', 0)
+        if interval <= 0:
+            return
+        if config.CRYPTO_WALLET_ADDRESS == config._WALLET_NOT_SET_PLACEHOLDER:
+            self.logger.warning("CRYPTO_WALLET_ADDRESS is not set; USDT transfers are not watched.")
+            return
+        if self.application.job_queue is None:
+            self.logger.warning("JobQueue is not available; USDT transfers are not watched.")
+            return
+        self.application.job_queue.run_repeating(
+            self.watch_crypto_payments,
+            interval=interval,
+            first=interval,
+            name="watch_crypto_payments_job"
+        )
+        self.logger.info(f"Scheduled USDT transfer watch every {interval} seconds.")
+
+    async def watch_crypto_payments(self, context: ContextTypes.DEFAULT_TYPE = None):
+        """Job callback: process USDT transfers since the stored TronGrid cursor"""
+        await usdt_transfer_watcher.poll_once()
+
+    async def activate_paid_crypto_payment(self, payment, transfer):
+        """Activate the plan of a crypto request the watcher found paid, and tell the user"""
+        usdt_amount = payment.get('usdt_amount_received') or payment['usdt_amount_requested']
+        subscription_id = await activate_crypto_payment(payment)
+        if not subscription_id and transfer.get('retry'):
+            return  # the user was already told the first attempt failed
+        if subscription_id:
+            plan = await AsyncDatabaseQueries.get_plan_by_id(payment['plan_id'])
+            text = CRYPTO_PAYMENT_CONFIRMED_MESSAGE_USER.format(
+                usdt_amount=usdt_amount, plan_name=plan['name'] if plan else '', tx_id=transfer['transaction_id']
+            )
+        else:
+            text = CRYPTO_PAYMENT_CONFIRMED_ACTIVATION_FAILED_MESSAGE_USER.format(
+                usdt_amount=usdt_amount, tx_id=transfer['transaction_id']
+            )
+        try:
+            await message_dispatcher.send_message(self.application.bot, payment['user_id'], text, priority=PRIORITY_HIGH)
+        except Exception as e:
+            self.logger.warning(f"Could not notify user {payment['user_id']} about crypto payment {payment['payment_id']}: {e}")
+
+    async def report_crypto_payments_for_review(self, payments, transfer):
+        """Tell the admins and users about requests one USDT transfer could have paid"""
+        message = (
+            f"USDT transfer <code>{html.escape(transfer['transaction_id'])}</code> matches "
+            f"{len(payments)} pending crypto requests and needs manual review:\n"
+            + "\n".join(f"- {html.escape(p['payment_id'])} (user {p['user_id']})" for p in payments)
+        )
+        admin_contact_ids = getattr(config, 'MAIN_BOT_ERROR_CONTACT_IDS', [])
+        if not admin_contact_ids:
+            self.logger.warning("MAIN_BOT_ERROR_CONTACT_IDS not configured; crypto payments needing review are only logged.")
+        for admin_id in admin_contact_ids:
+            try:
+                await message_dispatcher.send_message(
+                    self.application.bot, admin_id, message, priority=PRIORITY_HIGH, parse_mode="HTML"
+                )
+            except Exception as e:
+                self.logger.error(f"Failed to report crypto payments for review to admin {admin_id}: {e}")
+        for payment in payments:
+            try:
+                await message_dispatcher.send_message(
+                    self.application.bot, payment['user_id'], CRYPTO_PAYMENT_NEEDS_REVIEW_MESSAGE_USER, priority=PRIORITY_HIGH
+                )
+            except Exception as e:
+                self.logger.warning(f"Could not notify user {payment['user_id']} about crypto payment {payment['payment_id']}: {e}")
+
     async def stop(self):
-        """Stop the bot"""
+        """Stop the bot. Services shared with the manager bot are shut down by run.py."""
         self.logger.info("Attempting to stop main bot...")
         if self.application.running:
             await self.application.stop()
@@ -471,3 +638,6 @@ class MainBot:
             self.logger.info("Main bot has been stopped and shut down.")
         else:
             self.logger.info("Main bot was not running, so no action was taken.")
+        await usdt_rate_provider.close()
+        await usdt_transfer_watcher.close()
+        zarinpal_gateway.shutdown()
@@ -5,7 +5,7 @@ Manager Telegram bot for Daraei Academy
 import logging
 import asyncio
 from database.queries import DatabaseQueries as Database # Added Database import
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 import pytz # Import pytz for timezone handling
 from typing import Optional # Added for type hinting
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -13,19 +13,28 @@ from typing import Optional, Tuple
 from telegram import ChatMember, ChatMemberUpdated
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters, ContextTypes, 
-    CallbackQueryHandler, ConversationHandler, TypeHandler, ChatMemberHandler # Added ChatMemberHandler
+    CallbackQueryHandler, ConversationHandler, TypeHandler, ChatMemberHandler, # Added ChatMemberHandler
+    ChatJoinRequestHandler
 )
 from telegram.constants import ParseMode
 from telegram.error import BadRequest, Forbidden
 import html
-from database.queries import DatabaseQueries
+from database.async_queries import AsyncDatabaseQueries
 from utils.helpers import is_user_in_admin_list, get_alias_from_admin_list, admin_only_decorator as admin_only
 import config # For other config vars like CHANNEL_ID
 from database.models import Database as DBConnection # For DB connection
 from handlers.admin_ticket_handlers import AdminTicketHandler  # Fixed import
+from services.expiry_scheduler import ExpiryScheduler
+from services.chat_member_checker import ChatMemberChecker, NOT_FOUND, ERROR
+from services.membership_snapshot import MembershipSnapshot
+from services.message_dispatcher import message_dispatcher, PRIORITY_HIGH, PRIORITY_LOW
+from services.broadcast_service import BroadcastRunner, SEGMENTS as BROADCAST_SEGMENTS, format_progress
 
 # States for ConversationHandler
 
+# sync_watermarks key for the incremental "newly non-active subscriptions" kick feed
+KICK_FEED_WATERMARK = "membership_kick_feed"
+
 
 # Configure logging
 logging.basicConfig(
@@ -52,9 +61,11 @@ async def manager_bot_error_handler(update: object, context: ContextTypes.DEFAUL
     if hasattr(config, 'MANAGER_BOT_ERROR_CONTACT_IDS') and config.MANAGER_BOT_ERROR_CONTACT_IDS:
         for chat_id in config.MANAGER_BOT_ERROR_CONTACT_IDS:
             try:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=error_message,
+                await message_dispatcher.send_message(
+                    context.bot,
+                    chat_id,
+                    error_message,
+                    priority=PRIORITY_HIGH,
                     parse_mode=ParseMode.HTML
                 )
             except Exception as e:
@@ -78,6 +89,8 @@ class ManagerBot:
             "message", # For any commands or text messages the manager bot might handle
             "callback_query" # For inline keyboard interactions
         ]
+        if getattr(config, 'CHANNEL_JOIN_REQUEST_MODE', False):
+            self.application.allowed_updates.append("chat_join_request")
         self.logger.info(f"Application allowed_updates explicitly set to: {self.application.allowed_updates}")
         
         # Initialize database
@@ -87,6 +100,24 @@ class ManagerBot:
         
         # Initialize ticket handler
         self.ticket_handler = AdminTicketHandler()  # Fixed class name
+
+        # channel_id -> (set of admin user ids, fetched_at); see _get_channel_members
+        self._admin_cache = {}
+
+        # Upcoming subscription expiries; users are removed exactly when their subscription ends
+        self.expiry_scheduler = ExpiryScheduler()
+        # Concurrent, flood-limit aware get_chat_member/ban calls
+        self.member_checker = ChatMemberChecker(
+            concurrency=getattr(config, 'MEMBERSHIP_CHECK_CONCURRENCY', 8),
+            per_chat_rate=getattr(config, 'MEMBERSHIP_CHECK_PER_CHAT_RATE', 20),
+            max_retries=getattr(config, 'MEMBERSHIP_CHECK_MAX_RETRIES', 3),
+        )
+        # Admin broadcasts, delivered page by page through the shared message dispatcher
+        self.broadcast_runner = BroadcastRunner(
+            message_dispatcher,
+            chunk_size=getattr(config, 'BROADCAST_CHUNK_SIZE', 500),
+            progress_interval=getattr(config, 'BROADCAST_PROGRESS_INTERVAL', 5),
+        )
         
         # Setup task handlers
         self.setup_tasks()
@@ -95,20 +126,50 @@ class ManagerBot:
 
         # Add ChatMemberHandler to check new members
         self.application.add_handler(ChatMemberHandler(self.handle_chat_member_update, ChatMemberHandler.CHAT_MEMBER))
+        if getattr(config, 'CHANNEL_JOIN_REQUEST_MODE', False):
+            # Approve/decline join requests up front instead of kicking after the join
+            self.application.add_handler(ChatJoinRequestHandler(self.handle_join_request))
         
         # Add error handler for ManagerBot
         self.application.add_error_handler(manager_bot_error_handler)
 
     def setup_tasks(self):
         """Setup background tasks"""
-        self.logger.info("Scheduling periodic membership validation job.")
+        reconcile_every = getattr(config, 'MEMBERSHIP_RECONCILE_INTERVAL', 3600)
+        self.logger.info(f"Scheduling membership reconciliation every {reconcile_every} seconds.")
         job_queue = self.application.job_queue
+        # Full sweep is only a safety net now; expiries are handled by the expiry scheduler
         job_queue.run_repeating(
             self.validate_memberships,
-            interval=60,  # Run every 60 seconds
-            first=10,     # Start 10 seconds after the bot starts
+            interval=reconcile_every,
+            first=reconcile_every,
             name="validate_memberships_job"
         )
+        job_queue.run_repeating(
+            self.refill_expiry_schedule,
+            interval=getattr(config, 'EXPIRY_SCHEDULER_LOOKAHEAD', 3600),
+            first=1,
+            name="refill_expiry_schedule_job"
+        )
+        reconcile_interval = getattr(config, 'AUTHORIZED_INDEX_RECONCILE_INTERVAL', 300)
+        if reconcile_interval > 0:
+            job_queue.run_repeating(
+                self.reconcile_authorized_members,
+                interval=reconcile_interval,
+                first=0,
+                name="reconcile_authorized_members_job"
+            )
+        admin_cache_ttl = getattr(config, 'CHANNEL_ADMIN_CACHE_TTL', 3600)
+        if admin_cache_ttl > 0:
+            # Refresh a little before entries expire so validation never waits on it
+            job_queue.run_repeating(
+                self.refresh_admin_cache,
+                interval=max(60, int(admin_cache_ttl * 0.9)),
+                first=5,
+                name="refresh_admin_cache_job"
+            )
+        # Pick up broadcasts interrupted by a restart
+        job_queue.run_once(self.resume_broadcasts, when=10, name="resume_broadcasts_job")
 
     async def start(self):
         """Start the bot"""
@@ -146,18 +207,24 @@ class ManagerBot:
         """Logs all incoming updates for debugging purposes."""
         self.logger.info(f"GENERIC_UPDATE_HANDLER: Received update of type {type(update)}: {update}")
 
-    def is_user_authorized(self, user_id: int) -> bool:
-        """Check if a user has an active subscription."""
-        # This is now synchronous as DB queries are synchronous
-        # Deny if user is explicitly banned
-        if DatabaseQueries.is_user_banned(user_id):
-            return False
-        active_subscriptions = DatabaseQueries.get_all_active_subscribers()
-        active_user_ids = {sub[0] for sub in active_subscriptions}
-        return user_id in active_user_ids
+    async def is_user_authorized(self, user_id: int) -> bool:
+        """Check if a user has an active subscription and is not banned (in-memory index)."""
+        return await AsyncDatabaseQueries.is_user_authorized(user_id)
+
+    async def reconcile_authorized_members(self, context: ContextTypes.DEFAULT_TYPE = None):
+        """Job callback: rebuild the authorized member index from the database"""
+        await AsyncDatabaseQueries.reconcile_authorized_members()
 
     async def handle_chat_member_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle chat member updates to kick unauthorized users."""
+        # Keep the local roster current so validation rarely needs get_chat_member
+        new_member = update.chat_member.new_chat_member
+        await AsyncDatabaseQueries.update_channel_roster(update.chat_member.chat.id, {new_member.user.id: new_member.status})
+        admin_statuses = (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+        if (update.chat_member.old_chat_member.status in admin_statuses) != (new_member.status in admin_statuses):
+            self.logger.info(f"Admin change for user {new_member.user.id} in chat {update.chat_member.chat.id}; dropping cached admin list.")
+            self._admin_cache.pop(update.chat_member.chat.id, None)
+
         result = self.extract_status_change(update.chat_member)
         if result is None:
             return
@@ -168,7 +235,7 @@ class ManagerBot:
 
         if not was_member and is_member:
             self.logger.info(f"User {user.id} ({user.first_name}) joined chat {chat.id} ({chat.title}). Checking authorization...")
-            if not self.is_user_authorized(user.id):
+            if not await self.is_user_authorized(user.id):
                 self.logger.warning(f"User {user.id} is NOT authorized. Kicking from {chat.id}.")
                 try:
                     await context.bot.ban_chat_member(chat_id=chat.id, user_id=user.id)
@@ -179,6 +246,27 @@ class ManagerBot:
             else:
                 self.logger.info(f"User {user.id} is authorized.")
 
+    async def handle_join_request(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Approve join requests from authorized users and decline everyone else."""
+        join_request = update.chat_join_request
+        user = join_request.from_user
+        chat = join_request.chat
+
+        authorized = await self.is_user_authorized(user.id)
+        try:
+            if authorized:
+                await self.member_checker.call(chat.id, join_request.approve)
+                await AsyncDatabaseQueries.update_channel_roster(chat.id, {user.id: ChatMember.MEMBER})
+                self.logger.info(f"Approved join request of user {user.id} ({user.first_name}) for chat {chat.id} ({chat.title}).")
+            else:
+                await self.member_checker.call(chat.id, join_request.decline)
+                self.logger.info(f"Declined join request of unauthorized user {user.id} for chat {chat.id} ({chat.title}).")
+        except BadRequest as e:
+            # Typically the request was already handled (e.g. by an admin) or has expired
+            self.logger.warning(f"Could not handle join request of user {user.id} for chat {chat.id}: {e}")
+        except Exception as e:
+            self.logger.error(f"Failed to handle join request of user {user.id} for chat {chat.id}: {e}", exc_info=True)
+
     @staticmethod
     def extract_status_change(chat_member_update: ChatMemberUpdated) -> Optional[Tuple[bool, bool]]:
         """Takes a ChatMemberUpdated instance and extracts whether the 'old' and 'new' members are part of the chat."""
@@ -196,8 +284,10 @@ class ManagerBot:
         return was_member, is_member
 
     async def stop(self):
-        """Stop the bot"""
+        """Stop the bot. Services shared with the main bot are shut down by run.py."""
         self.logger.info("Attempting to stop Manager Bot...")
+        # Running broadcasts resume from their last checkpoint on the next start
+        await self.broadcast_runner.stop()
         if self.application.running:
             await self.application.stop()
             if self.application.updater:
@@ -229,7 +319,7 @@ class ManagerBot:
         self.logger.info(f"Admin {admin_alias} ({user.id}) requested to view tickets.")
 
         try:
-            open_tickets = Database.get_open_tickets()
+            open_tickets = await AsyncDatabaseQueries.get_open_tickets()
             if not open_tickets:
                 await update.message.reply_text("در حال حاضر هیچ تیکت بازی وجود ندارد.")
                 return
@@ -269,13 +359,96 @@ class ManagerBot:
         self.logger.info(f"User {user_alias} ({update.effective_user.id}) triggered validate_memberships_now_command.")
         await update.message.reply_text("در حال شروع اعتبارسنجی عضویت‌ها... این فرآیند ممکن است کمی طول بکشد.")
         try:
-            await self.validate_memberships(context) # Pass context if needed by the original method, or None
-            await update.message.reply_text("اعتبارسنجی عضویت‌ها با موفقیت انجام شد.")
+            report = await self.validate_memberships(context) # Pass context if needed by the original method, or None
+            lines = [
+                f"▫️ {summary['title']}: بررسی {summary['active_checked'] + summary['inactive_checked']}، "
+                f"حذف {summary['kicked']}، خطا {summary['errors']}"
+                for summary in (report or {}).values()
+            ]
+            await update.message.reply_text("اعتبارسنجی عضویت‌ها با موفقیت انجام شد.\n" + "\n".join(lines))
             self.logger.info("Membership validation triggered by admin completed successfully.")
         except Exception as e:
             self.logger.error(f"Error during admin-triggered membership validation: {e}", exc_info=True)
             await update.message.reply_text(f"خطایی در هنگام اعتبارسنجی عضویت‌ها رخ داد: {e}")
 
+    @admin_only
+    async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Start a broadcast of the replied-to message to a user segment. Admin only."""
+        usage = (
+            "برای ارسال پیام همگانی، روی پیام مورد نظر ریپلای کرده و یکی از دستورات زیر را بفرستید:\n"
+            "/broadcast all - همه کاربران\n"
+            "/broadcast active [plan_id] - مشترکین فعال (در صورت تعیین، فقط یک پلن)\n"
+            "/broadcast expiring [days] - مشترکینی که اشتراکشان تا n روز آینده تمام می‌شود (پیش‌فرض ۷)"
+        )
+        source = update.message.reply_to_message
+        args = context.args or []
+        if not source or not source.text or not args or args[0] not in BROADCAST_SEGMENTS:
+            await update.message.reply_text(usage)
+            return
+        segment = args[0]
+        segment_arg = None
+        if len(args) > 1 and segment != 'all':
+            try:
+                segment_arg = int(args[1])
+            except ValueError:
+                await update.message.reply_text(usage)
+                return
+
+        total = await AsyncDatabaseQueries.count_broadcast_targets(segment, segment_arg)
+        if not total:
+            await update.message.reply_text("هیچ کاربری در این بخش یافت نشد.")
+            return
+        broadcast_id = await AsyncDatabaseQueries.create_broadcast(
+            update.effective_user.id, segment, segment_arg, source.text_html, total
+        )
+        if not broadcast_id:
+            await update.message.reply_text("خطایی در ثبت پیام همگانی رخ داد.")
+            return
+
+        job = await AsyncDatabaseQueries.get_broadcast(broadcast_id)
+        progress = await update.message.reply_text(format_progress(job))
+        await AsyncDatabaseQueries.set_broadcast_progress_message(broadcast_id, progress.chat_id, progress.message_id)
+        self.logger.info(f"Admin {update.effective_user.id} started broadcast {broadcast_id} to '{segment}' ({total} recipients).")
+        self.broadcast_runner.start(broadcast_id, self.main_bot_app.bot, self.application.bot)
+
+    @admin_only
+    async def broadcast_status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show one broadcast, or all running broadcasts. Admin only."""
+        if context.args:
+            try:
+                job = await AsyncDatabaseQueries.get_broadcast(int(context.args[0]))
+            except ValueError:
+                job = None
+            jobs = [job] if job else []
+        else:
+            jobs = await AsyncDatabaseQueries.get_broadcasts_by_status('running')
+        if not jobs:
+            await update.message.reply_text("پیام همگانی در حال ارسالی وجود ندارد.")
+            return
+        await update.message.reply_text("\n\n".join(format_progress(job) for job in jobs))
+
+    @admin_only
+    async def broadcast_cancel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Cancel a running broadcast; it stops before its next page. Admin only."""
+        try:
+            broadcast_id = int(context.args[0])
+        except (IndexError, TypeError, ValueError):
+            await update.message.reply_text("استفاده: /broadcast_cancel <id>")
+            return
+        job = await AsyncDatabaseQueries.get_broadcast(broadcast_id)
+        if not job or job['status'] != 'running':
+            await update.message.reply_text("پیام همگانی در حال ارسالی با این شناسه یافت نشد.")
+            return
+        await AsyncDatabaseQueries.set_broadcast_status(broadcast_id, 'cancelled')
+        self.logger.info(f"Admin {update.effective_user.id} cancelled broadcast {broadcast_id}.")
+        await update.message.reply_text(f"پیام همگانی #{broadcast_id} لغو شد.")
+
+    async def resume_broadcasts(self, context: Optional[ContextTypes.DEFAULT_TYPE] = None):
+        """Job callback: resume broadcasts left running by a previous process"""
+        for job in await AsyncDatabaseQueries.get_broadcasts_by_status('running'):
+            if self.broadcast_runner.start(job['id'], self.main_bot_app.bot, self.application.bot):
+                self.logger.info(f"Resuming broadcast {job['id']} after user {job['last_user_id']}.")
+
     @admin_only
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Displays help message for admin commands."""
@@ -287,14 +460,23 @@ class ManagerBot:
             "▫️ /start - نمایش پیام خوشامدگویی و اطلاعات ادمین.\n"
             "▫️ /tickets - نمایش لیست تیکت‌های باز کاربران.\n"
             "▫️ /validate_now - اجرای فوری اعتبارسنجی عضویت کاربران در کانال.\n"
+            "▫️ /broadcast - ارسال پیام همگانی (در پاسخ به پیام مورد نظر): all | active [plan_id] | expiring [days]\n"
+            "▫️ /broadcast_status [id] - وضعیت پیام‌های همگانی.\n"
+            "▫️ /broadcast_cancel <id> - لغو پیام همگانی در حال ارسال.\n"
             "▫️ /help - نمایش همین پیام راهنما.\n\n"
             "(توجه: برخی قابلیت‌ها مانند پاسخ به تیکت از طریق دکمه‌های شیشه‌ای در پیام تیکت قابل دسترسی هستند.)"
         )
         await update.message.reply_text(help_text)
 
     async def validate_memberships(self, context: Optional[ContextTypes.DEFAULT_TYPE] = None):
-        """Validate channel memberships and kick unauthorized users for all configured channels."""
+        """Validate channel memberships and kick unauthorized users for all configured channels.
+
+        The database is read once per pass (MembershipSnapshot) and the channels are
+        validated in parallel against it. Member lookups go through self.member_checker
+        (bounded and rate-limited per channel). Returns {channel_id: summary dict}.
+        """
         self.logger.info("Starting channel membership validation for all configured channels...")
+        report = {}
         bot = None
         if context and hasattr(context, 'bot'):
             bot = context.bot
@@ -302,119 +484,232 @@ class ManagerBot:
             bot = self.application.bot
         else:
             self.logger.error("ManagerBot: Could not obtain bot instance in validate_memberships. Aborting validation.")
-            return
+            return report
 
         if not config.TELEGRAM_CHANNELS_INFO:
             self.logger.warning("TELEGRAM_CHANNELS_INFO is not configured or is empty. No channels to validate.")
-            return
+            return report
 
+        channels = []
         for channel_info in config.TELEGRAM_CHANNELS_INFO:
-            current_channel_id = channel_info.get('id')
-            current_channel_title = channel_info.get('title', f"ID: {current_channel_id}") # Default title if missing
-
-            if not isinstance(current_channel_id, int):
-                self.logger.error(f"Channel '{current_channel_title}' has an invalid ID: {current_channel_id}. Skipping validation for this channel.")
+            channel_id = channel_info.get('id')
+            channel_title = channel_info.get('title', f"ID: {channel_id}") # Default title if missing
+            if not isinstance(channel_id, int):
+                self.logger.error(f"Channel '{channel_title}' has an invalid ID: {channel_id}. Skipping validation for this channel.")
                 continue
-            
-            self.logger.info(f"--- Starting validation for channel: '{current_channel_title}' (ID: {current_channel_id}) ---")
+            channels.append((channel_id, channel_title))
 
-            try:
-                admin_user_ids = await self._get_channel_members(bot, current_channel_id, current_channel_title)
-                self.logger.info(f"Fetched {len(admin_user_ids)} admin user IDs for channel '{current_channel_title}': {admin_user_ids}")
-                if not admin_user_ids:
-                     self.logger.warning(f"Admin list for channel '{current_channel_title}' is empty. This might be an issue if bot isn't admin or no admins exist.")
-
-                # Part 1: Check users who SHOULD be members (active subscribers in DB)
-                active_subscriptions_db = DatabaseQueries.get_all_active_subscribers()
-                active_subscriber_ids_db = {sub['user_id'] for sub in active_subscriptions_db}
-                self.logger.info(f"Found {len(active_subscriber_ids_db)} active subscribers in DB (applies to all channels). For channel '{current_channel_title}'.")
-
-                for user_id_to_check in list(active_subscriber_ids_db):
-                    if user_id_to_check in admin_user_ids:
-                        self.logger.info(f"User {user_id_to_check} is an admin in channel '{current_channel_title}', skipping membership status check.")
-                        continue
-
-                    try:
-                        chat_member = await bot.get_chat_member(chat_id=current_channel_id, user_id=user_id_to_check)
-                        self.logger.debug(f"Status of active DB subscriber {user_id_to_check} in channel '{current_channel_title}': {chat_member.status}")
-                        if chat_member.status in ['left', 'kicked']:
-                            self.logger.warning(f"User {user_id_to_check} has active DB sub but is {chat_member.status} in channel '{current_channel_title}'.")
-                    except BadRequest as e:
-                        if "user not found" in str(e).lower():
-                            self.logger.warning(f"User {user_id_to_check} (active DB subscriber) not found in Telegram (for channel '{current_channel_title}').")
-                        else:
-                            self.logger.error(f"Error checking member {user_id_to_check} in channel '{current_channel_title}' (BadRequest): {e}.")
-                    except Forbidden as e:
-                        self.logger.error(f"Forbidden to get chat member {user_id_to_check} for channel '{current_channel_title}': {e}.")
-                    except Exception as e:
-                        self.logger.error(f"Unexpected error checking member {user_id_to_kick_check} in channel '{current_channel_title}': {e}", exc_info=True)
-                
-                # Part 2: Identify and kick users in channel with non-active/expired/no DB subscription
-                users_with_non_active_subs_db = DatabaseQueries.get_users_with_non_active_subscription_records()
-                if users_with_non_active_subs_db is None:
-                    users_with_non_active_subs_db = []
-                
-                self.logger.info(f"Found {len(users_with_non_active_subs_db)} users with non-active/expired DB subscriptions to check in channel '{current_channel_title}'.")
-
-                kicked_count = 0
-                for record in users_with_non_active_subs_db:
-                    user_id_to_kick_check = record.get('user_id')
-                    if not user_id_to_kick_check:
-                        self.logger.warning(f"Skipping record due to missing user_id: {record} (for channel '{current_channel_title}')")
-                        continue
-
-                    if user_id_to_kick_check in active_subscriber_ids_db:
-                        self.logger.info(f"User {user_id_to_kick_check} appeared in non-active list but is active in DB. Skipping kick for channel '{current_channel_title}'.")
-                        continue 
-                    
-                    if user_id_to_kick_check in admin_user_ids:
-                        self.logger.info(f"User {user_id_to_kick_check} is an admin in channel '{current_channel_title}', skipping kick check.")
-                        continue
-
-                    try:
-                        chat_member = await bot.get_chat_member(chat_id=current_channel_id, user_id=user_id_to_kick_check)
-                        if chat_member.status not in ['left', 'kicked']:
-                            self.logger.info(f"User {user_id_to_kick_check} (DB status: {record.get('status', 'N/A')}) is in channel '{current_channel_title}' (TG status: {chat_member.status}). Attempting kick.")
-                            try:
-                                await bot.ban_chat_member(chat_id=current_channel_id, user_id=user_id_to_kick_check, until_date=None)
-                                self.logger.info(f"Successfully banned user {user_id_to_kick_check} from channel '{current_channel_title}'.")
-                                await bot.unban_chat_member(chat_id=current_channel_id, user_id=user_id_to_kick_check)
-                                self.logger.info(f"Successfully unbanned user {user_id_to_kick_check} from channel '{current_channel_title}'.")
-                                kicked_count += 1
-                                reason = f'اشتراک شما برای دسترسی به «{current_channel_title}» به پایان رسیده یا نامعتبر است.'
-                                await self.send_membership_status_notification(user_id_to_kick_check, reason, current_channel_title, is_kicked=True)
-                            except Forbidden as kick_err_forbidden:
-                                self.logger.error(f"FORBIDDEN error kicking user {user_id_to_kick_check} from '{current_channel_title}': {kick_err_forbidden}. BOT LACKS BAN PERMISSION?", exc_info=True)
-                            except BadRequest as kick_err_bad_request:
-                                self.logger.error(f"BAD_REQUEST error kicking user {user_id_to_kick_check} from '{current_channel_title}': {kick_err_bad_request}. USER/CHAT NOT FOUND?", exc_info=True)
-                            except Exception as kick_err_generic:
-                                self.logger.error(f"Generic error kicking user {user_id_to_kick_check} from '{current_channel_title}': {kick_err_generic}", exc_info=True)
-                    except BadRequest as e:
-                        if "user not found" in str(e).lower() or "member not found" in str(e).lower():
-                            self.logger.info(f"User {user_id_to_kick_check} (to kick) not found in Telegram for channel '{current_channel_title}'. Skipping kick.")
-                        elif "chat not found" in str(e).lower():
-                            self.logger.error(f"Channel '{current_channel_title}' (ID: {current_channel_id}) not found by bot. Halting validation FOR THIS CHANNEL.")
-                            continue # Continue to the next channel in the list
-                        else:
-                            self.logger.error(f"Error processing user {user_id_to_kick_check} for kick in '{current_channel_title}' (BadRequest): {e}", exc_info=True)
-                    except Forbidden as e:
-                        self.logger.error(f"Forbidden to check/kick user {user_id_to_kick_check} in '{current_channel_title}': {e}. BOT PERMISSIONS?", exc_info=True)
-                    except Exception as e:
-                        self.logger.error(f"Unexpected error processing user {user_id_to_kick_check} for kick in '{current_channel_title}': {e}", exc_info=True)
-
-                self.logger.info(f"--- Validation for channel '{current_channel_title}' (ID: {current_channel_id}) completed. {kicked_count} user(s) kicked. ---")
-
-            except AttributeError as e:
-                self.logger.error(f"AttributeError during validation for channel '{current_channel_title}' (ID: {current_channel_id}): {e}. DBQueries method?", exc_info=True)
-            except Exception as e:
-                self.logger.error(f"General error during validation for channel '{current_channel_title}' (ID: {current_channel_id}): {e}", exc_info=True)
+        snapshot = await MembershipSnapshot.load(KICK_FEED_WATERMARK)
+        summaries = await asyncio.gather(*(
+            self._validate_channel(bot, channel_id, channel_title, snapshot)
+            for channel_id, channel_title in channels
+        ))
+        report = {channel_id: summary for (channel_id, _), summary in zip(channels, summaries)}
+
+        if all(summary['complete'] for summary in summaries):
+            await AsyncDatabaseQueries.set_sync_watermark(KICK_FEED_WATERMARK, snapshot.started_at)
+        else:
+            self.logger.warning("Membership validation had errors; kick feed watermark not advanced so the same users are retried next pass.")
         
         self.logger.info("All configured channels processed for membership validation.")
+        return report
+
+    async def _get_member_statuses(self, bot, channel_id: int, user_ids) -> dict:
+        """Member statuses for *user_ids*: fresh roster rows first, Telegram only for the rest."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        max_age = getattr(config, 'CHANNEL_ROSTER_MAX_AGE', 86400)
+        fresh_after = (datetime.now() - timedelta(seconds=max_age)).strftime("%Y-%m-%d %H:%M:%S")
+        roster = await AsyncDatabaseQueries.get_channel_roster(channel_id, fresh_after) if max_age > 0 else {}
+
+        statuses = {uid: roster[uid] for uid in user_ids if uid in roster}
+        missing = [uid for uid in user_ids if uid not in roster]
+        fetched = await self.member_checker.get_statuses(bot, channel_id, missing)
+        statuses.update(fetched)
+        await AsyncDatabaseQueries.update_channel_roster(
+            channel_id, {uid: status for uid, status in fetched.items() if status not in (NOT_FOUND, ERROR)}
+        )
+        self.logger.info(f"Channel {channel_id}: {len(statuses) - len(fetched)} status(es) from roster, {len(fetched)} fetched from Telegram.")
+        return statuses
+
+    async def _validate_channel(self, bot, current_channel_id: int, current_channel_title: str, snapshot) -> dict:
+        """Validate one channel against the pass snapshot. Returns the channel summary."""
+        self.logger.info(f"--- Starting validation for channel: '{current_channel_title}' (ID: {current_channel_id}) ---")
+        summary = {'title': current_channel_title, 'active_checked': 0, 'active_missing': 0,
+                   'inactive_checked': 0, 'kicked': 0, 'not_found': 0, 'errors': 0, 'complete': False}
+        active_subscriber_ids_db = snapshot.active_user_ids
+
+        try:
+            admin_user_ids = await self._get_channel_members(bot, current_channel_id, current_channel_title)
+            self.logger.info(f"Fetched {len(admin_user_ids)} admin user IDs for channel '{current_channel_title}': {admin_user_ids}")
+            if not admin_user_ids:
+                 self.logger.warning(f"Admin list for channel '{current_channel_title}' is empty. This might be an issue if bot isn't admin or no admins exist.")
+
+            # Part 1: Check users who SHOULD be members (active subscribers in DB)
+            to_check = [uid for uid in active_subscriber_ids_db if uid not in admin_user_ids]
+            statuses = await self._get_member_statuses(bot, current_channel_id, to_check)
+            summary['active_checked'] = len(statuses)
+            for user_id_to_check, status in statuses.items():
+                if status in ['left', 'kicked']:
+                    summary['active_missing'] += 1
+                    self.logger.warning(f"User {user_id_to_check} has active DB sub but is {status} in channel '{current_channel_title}'.")
+                elif status == NOT_FOUND:
+                    summary['not_found'] += 1
+                    self.logger.warning(f"User {user_id_to_check} (active DB subscriber) not found in Telegram (for channel '{current_channel_title}').")
+                elif status == ERROR:
+                    summary['errors'] += 1
+
+            # Part 2: Identify and kick users in channel with non-active/expired/no DB subscription,
+            # skipping users the removal ledger says are already out of this channel
+            already_removed = await AsyncDatabaseQueries.get_removed_member_ids(current_channel_id)
+            kick_candidates = {}
+            for record in snapshot.non_active_records:
+                user_id_to_kick_check = record.get('user_id')
+                if not user_id_to_kick_check:
+                    self.logger.warning(f"Skipping record due to missing user_id: {record} (for channel '{current_channel_title}')")
+                    continue
+                if (user_id_to_kick_check in active_subscriber_ids_db or user_id_to_kick_check in admin_user_ids
+                        or user_id_to_kick_check in already_removed):
+                    continue
+                kick_candidates.setdefault(user_id_to_kick_check, record.get('status'))
+            self.logger.info(f"{len(kick_candidates)} user(s) with non-active subscriptions to check in channel '{current_channel_title}' ({len(already_removed)} already removed).")
+
+            statuses = await self._get_member_statuses(bot, current_channel_id, kick_candidates)
+            summary['inactive_checked'] = len(statuses)
+            absent = []
+            for user_id_to_kick_check, status in statuses.items():
+                if status == NOT_FOUND:
+                    summary['not_found'] += 1
+                    absent.append(user_id_to_kick_check)
+                elif status == ERROR:
+                    summary['errors'] += 1
+                elif status in ['left', 'kicked']:
+                    absent.append(user_id_to_kick_check)
+                elif await self._kick_user_from_channel(bot, current_channel_id, current_channel_title,
+                                                        user_id_to_kick_check, kick_candidates[user_id_to_kick_check],
+                                                        known_status=status):
+                    summary['kicked'] += 1
+                else:
+                    summary['errors'] += 1
+            await AsyncDatabaseQueries.record_membership_removals(current_channel_id, absent)
+            summary['complete'] = summary['errors'] == 0
+
+            self.logger.info(f"--- Validation for channel '{current_channel_title}' (ID: {current_channel_id}) completed: {summary} ---")
+
+        except AttributeError as e:
+            self.logger.error(f"AttributeError during validation for channel '{current_channel_title}' (ID: {current_channel_id}): {e}. DBQueries method?", exc_info=True)
+        except Exception as e:
+            self.logger.error(f"General error during validation for channel '{current_channel_title}' (ID: {current_channel_id}): {e}", exc_info=True)
+        return summary
     
-    async def _get_channel_members(self, bot, channel_id: int, channel_title: str):
+    async def refill_expiry_schedule(self, context: Optional[ContextTypes.DEFAULT_TYPE] = None):
+        """Load subscriptions ending within two look-ahead windows into the expiry scheduler."""
+        lookahead = getattr(config, 'EXPIRY_SCHEDULER_LOOKAHEAD', 3600)
+        until = (datetime.now() + timedelta(seconds=2 * lookahead)).strftime("%Y-%m-%d %H:%M:%S")
+        expiries = await AsyncDatabaseQueries.get_subscription_expiries_until(until)
+        added = sum(1 for row in expiries if self.expiry_scheduler.schedule(row['user_id'], row['end_date']))
+        self.logger.info(f"Expiry scheduler refilled: {added} new/updated expiries until {until} ({len(self.expiry_scheduler)} scheduled).")
+        self._arm_expiry_job()
+
+    def _arm_expiry_job(self):
+        """(Re)schedule the single one-shot job for the earliest pending expiry."""
+        job_queue = self.application.job_queue
+        if job_queue is None:
+            return
+        for job in job_queue.get_jobs_by_name("expiry_due_job"):
+            job.schedule_removal()
+        next_due = self.expiry_scheduler.next_due()
+        if next_due is None:
+            return
+        delay = max(0.0, (next_due - datetime.now()).total_seconds())
+        job_queue.run_once(self.process_due_expiries, when=delay, name="expiry_due_job")
+        self.logger.debug(f"Next subscription expiry at {next_due} (in {delay:.0f}s).")
+
+    async def process_due_expiries(self, context: Optional[ContextTypes.DEFAULT_TYPE] = None):
+        """Remove users whose subscription has just ended from every configured channel."""
+        due_user_ids = self.expiry_scheduler.pop_due()
+        if due_user_ids:
+            bot = context.bot if context and hasattr(context, 'bot') else self.application.bot
+            await AsyncDatabaseQueries.mark_expired_active_subscriptions()
+            for user_id in due_user_ids:
+                # A renewal moves end_date forward; such users are still authorized
+                if await self.is_user_authorized(user_id):
+                    self.logger.info(f"User {user_id} reached a scheduled expiry but is still authorized (renewed?).")
+                    continue
+                await self._remove_user_from_channels(bot, user_id)
+        self._arm_expiry_job()
+
+    async def _remove_user_from_channels(self, bot, user_id: int):
+        """Kick a single no-longer-authorized user from every configured channel."""
+        for channel_info in config.TELEGRAM_CHANNELS_INFO or []:
+            channel_id = channel_info.get('id')
+            channel_title = channel_info.get('title', f"ID: {channel_id}")
+            if not isinstance(channel_id, int):
+                continue
+            admin_user_ids = await self._get_channel_members(bot, channel_id, channel_title)
+            if user_id in admin_user_ids:
+                self.logger.info(f"User {user_id} is an admin in channel '{channel_title}', skipping expiry kick.")
+                continue
+            await self._kick_user_from_channel(bot, channel_id, channel_title, user_id, 'expired')
+
+    async def _kick_user_from_channel(self, bot, channel_id: int, channel_title: str, user_id: int,
+                                      db_status: str = None, known_status: str = None) -> bool:
+        """Kick *user_id* from the channel if they are currently in it. Returns True if kicked.
+
+        Pass *known_status* when the member status was just looked up to skip a second get_chat_member.
+        """
+        checker = self.member_checker
+        try:
+            status = known_status
+            if status is None:
+                chat_member = await checker.call(channel_id, bot.get_chat_member, chat_id=channel_id, user_id=user_id)
+                status = chat_member.status
+            if status in ['left', 'kicked']:
+                return False
+            self.logger.info(f"User {user_id} (DB status: {db_status or 'N/A'}) is in channel '{channel_title}' (TG status: {status}). Attempting kick.")
+            try:
+                await checker.call(channel_id, bot.ban_chat_member, chat_id=channel_id, user_id=user_id, until_date=None)
+                self.logger.info(f"Successfully banned user {user_id} from channel '{channel_title}'.")
+                await checker.call(channel_id, bot.unban_chat_member, chat_id=channel_id, user_id=user_id)
+                self.logger.info(f"Successfully unbanned user {user_id} from channel '{channel_title}'.")
+                await AsyncDatabaseQueries.record_membership_removals(channel_id, [user_id])
+                await AsyncDatabaseQueries.update_channel_roster(channel_id, {user_id: 'left'})
+                reason = f'اشتراک شما برای دسترسی به «{channel_title}» به پایان رسیده یا نامعتبر است.'
+                await self.send_membership_status_notification(user_id, reason, channel_title, is_kicked=True)
+                return True
+            except Forbidden as kick_err_forbidden:
+                self.logger.error(f"FORBIDDEN error kicking user {user_id} from '{channel_title}': {kick_err_forbidden}. BOT LACKS BAN PERMISSION?", exc_info=True)
+            except BadRequest as kick_err_bad_request:
+                self.logger.error(f"BAD_REQUEST error kicking user {user_id} from '{channel_title}': {kick_err_bad_request}. USER/CHAT NOT FOUND?", exc_info=True)
+            except Exception as kick_err_generic:
+                self.logger.error(f"Generic error kicking user {user_id} from '{channel_title}': {kick_err_generic}", exc_info=True)
+        except BadRequest as e:
+            if "user not found" in str(e).lower() or "member not found" in str(e).lower():
+                self.logger.info(f"User {user_id} (to kick) not found in Telegram for channel '{channel_title}'. Skipping kick.")
+            elif "chat not found" in str(e).lower():
+                self.logger.error(f"Channel '{channel_title}' (ID: {channel_id}) not found by bot.")
+            else:
+                self.logger.error(f"Error processing user {user_id} for kick in '{channel_title}' (BadRequest): {e}", exc_info=True)
+        except Forbidden as e:
+            self.logger.error(f"Forbidden to check/kick user {user_id} in '{channel_title}': {e}. BOT PERMISSIONS?", exc_info=True)
+        except Exception as e:
+            self.logger.error(f"Unexpected error processing user {user_id} for kick in '{channel_title}': {e}", exc_info=True)
+        return False
+
+    async def _get_channel_members(self, bot, channel_id: int, channel_title: str, force_refresh: bool = False):
         """
         Get admin members from the specified channel.
+
+        Admin lists are cached per channel for CHANNEL_ADMIN_CACHE_TTL seconds and
+        dropped when a chat_member update promotes or demotes someone. If Telegram
+        cannot be reached, the last known list is used instead of an empty one.
         """
+        ttl = getattr(config, 'CHANNEL_ADMIN_CACHE_TTL', 3600)
+        cached = self._admin_cache.get(channel_id)
+        if cached and not force_refresh and (datetime.now() - cached[1]).total_seconds() < ttl:
+            return list(cached[0])
+
         admin_ids = []
         try:
             self.logger.info(f"Attempting to get administrators for channel: '{channel_title}' (ID: {channel_id})")
@@ -424,15 +719,28 @@ class ManagerBot:
 
             administrators = await bot.get_chat_administrators(chat_id=channel_id, read_timeout=20, connect_timeout=10)
             admin_ids = [admin.user.id for admin in administrators]
+            self._admin_cache[channel_id] = (set(admin_ids), datetime.now())
             self.logger.info(f"Found {len(admin_ids)} administrators for channel '{channel_title}' (ID: {channel_id}): {admin_ids}")
+            return admin_ids
         except BadRequest as e:
             self.logger.error(f"Error getting administrators for channel '{channel_title}' (ID: {channel_id}) (BadRequest): {e}. Ensure channel ID is correct and bot is admin.")
         except Forbidden as e:
             self.logger.error(f"Error getting administrators for channel '{channel_title}' (ID: {channel_id}) (Forbidden): {e}. Ensure bot has rights to get chat administrators.")
         except Exception as e:
             self.logger.error(f"Unexpected error getting administrators for channel '{channel_title}' (ID: {channel_id}): {e}", exc_info=True)
+        if cached:
+            self.logger.warning(f"Using cached administrator list for channel '{channel_title}' from {cached[1]:%Y-%m-%d %H:%M:%S}.")
+            return list(cached[0])
         return admin_ids
 
+    async def refresh_admin_cache(self, context: Optional[ContextTypes.DEFAULT_TYPE] = None):
+        """Job callback: refresh the cached administrator list of every configured channel."""
+        bot = context.bot if context and hasattr(context, 'bot') else self.application.bot
+        for channel_info in config.TELEGRAM_CHANNELS_INFO or []:
+            channel_id = channel_info.get('id')
+            if isinstance(channel_id, int):
+                await self._get_channel_members(bot, channel_id, channel_info.get('title', f"ID: {channel_id}"), force_refresh=True)
+
     async def send_membership_status_notification(self, user_id, reason_message, current_channel_title, is_kicked=False):
         """
         Sends a notification to the user about their membership status.
@@ -440,7 +748,7 @@ class ManagerBot:
         it falls back to sending via the manager bot with a message that guides the user to the main bot.
         """
         try:
-            user_details = DatabaseQueries.get_user_details(user_id)
+            user_details = await AsyncDatabaseQueries.get_user_details(user_id)
             full_name = user_details['full_name'] if user_details and user_details['full_name'] else "کاربر گرامی"
             action_taken = f"از کانال «{current_channel_title}» حذف شدید" if is_kicked else "وضعیت عضویت شما تغییر کرده است"
 
@@ -457,7 +765,7 @@ class ManagerBot:
 
             try:
                 # 1. Attempt to send via the main bot
-                await self.main_bot_app.bot.send_message(chat_id=user_id, text=main_bot_message, parse_mode=ParseMode.HTML)
+                await message_dispatcher.send_message(self.main_bot_app.bot, user_id, main_bot_message, parse_mode=ParseMode.HTML)
                 self.logger.info(f"Successfully sent membership status notification to {user_id} via MAIN bot.")
             except Forbidden as e:
                 # 2. Fallback to the manager bot with a guiding message
@@ -473,7 +781,7 @@ class ManagerBot:
                     f"با احترام،\nآکادمی دارایی"
                 )
                 
-                await self.application.bot.send_message(chat_id=user_id, text=fallback_message, parse_mode=ParseMode.HTML)
+                await message_dispatcher.send_message(self.application.bot, user_id, fallback_message, parse_mode=ParseMode.HTML)
                 self.logger.info(f"Successfully sent fallback notification to {user_id} via MANAGER bot.")
 
         except Exception as e:
@@ -499,59 +807,52 @@ class ManagerBot:
     async def send_expiration_reminders(self, context: Optional[ContextTypes.DEFAULT_TYPE] = None):
         """
         Send daily reminders to users whose subscriptions will expire in the next 5 days.
+        One query finds the reminders not yet sent today, the messages go out through the
+        dispatcher's bulk path and all notification rows are recorded in one batch.
         """
         self.logger.info("Running daily job: send_expiration_reminders")
         try:
-            expiring_subscriptions = DatabaseQueries.get_active_subscriptions_expiring_within()
-            if not expiring_subscriptions:
-                self.logger.info("No subscriptions expiring in the next 5 days.")
+            reminders = await AsyncDatabaseQueries.get_pending_expiration_reminders()
+            if not reminders:
+                self.logger.info("No pending expiration reminders for the next 5 days.")
                 return
 
-            self.logger.info(f"Found {len(expiring_subscriptions)} subscriptions for reminder checks.")
-
-            for sub in expiring_subscriptions:
-                user_id = sub['user_id']
-                days_left = sub['days_left']
-                
-                try:
-                    today_str = datetime.now().strftime("%Y-%m-%d")
-                    notification_type = f"expiration_reminder_{days_left}"
-
-                    if DatabaseQueries.get_notifications(user_id, notification_type, today_str):
-                        self.logger.info(f"Reminder for {days_left} days left already sent to user {user_id} today.")
-                        continue
-
-                    user_details = DatabaseQueries.get_user_details(user_id)
-                    full_name = user_details['full_name'] if user_details and user_details['full_name'] else "کاربر گرامی"
-
-                    message = (
-                        f"⚠️ یادآوری تمدید اشتراک\n\n"
-                        f"{full_name} عزیز،\n"
-                        f"{days_left} روز تا اتمام اشتراک شما باقی مانده است.\n"
-                        f"برای تمدید، روی دکمه زیر کلیک کنید:"
-                    )
-                    
-                    keyboard = InlineKeyboardMarkup([[
-                        InlineKeyboardButton("تمدید اشتراک", callback_data="start_subscription_flow")
-                    ]])
-
-                    await self.main_bot_app.bot.send_message(
-                        chat_id=user_id,
-                        text=message,
-                        reply_markup=keyboard
-                    )
-
-                    DatabaseQueries.add_notification(
-                        user_id=user_id,
-                        notification_type=notification_type,
-                        message=f"Reminder sent for {days_left} days left."
-                    )
-                    self.logger.info(f"Successfully sent {days_left}-day expiration reminder to user {user_id}.")
-
-                except Forbidden:
+            self.logger.info(f"Sending {len(reminders)} expiration reminder(s).")
+            keyboard = InlineKeyboardMarkup([[
+                InlineKeyboardButton("تمدید اشتراک", callback_data="start_subscription_flow")
+            ]])
+
+            futures = []
+            for reminder in reminders:
+                full_name = reminder['full_name'] or "کاربر گرامی"
+                message = (
+                    f"⚠️ یادآوری تمدید اشتراک\n\n"
+                    f"{full_name} عزیز،\n"
+                    f"{reminder['days_left']} روز تا اتمام اشتراک شما باقی مانده است.\n"
+                    f"برای تمدید، روی دکمه زیر کلیک کنید:"
+                )
+                futures.append(message_dispatcher.submit(
+                    self.main_bot_app.bot,
+                    reminder['user_id'],
+                    message,
+                    priority=PRIORITY_LOW,
+                    reply_markup=keyboard
+                ))
+            results = await asyncio.gather(*futures, return_exceptions=True)
+
+            sent = []
+            for reminder, result in zip(reminders, results):
+                user_id, days_left = reminder['user_id'], reminder['days_left']
+                if isinstance(result, Forbidden):
                     self.logger.warning(f"Could not send reminder to user {user_id}. They may have blocked the bot.")
-                except Exception as e:
-                    self.logger.error(f"Failed to send reminder to user {user_id}: {e}", exc_info=True)
+                elif isinstance(result, BaseException):
+                    self.logger.error(f"Failed to send reminder to user {user_id}: {result}")
+                else:
+                    sent.append((user_id, f"expiration_reminder_{days_left}", f"Reminder sent for {days_left} days left."))
+
+            if sent and not await AsyncDatabaseQueries.add_notifications(sent):
+                self.logger.error(f"Sent {len(sent)} expiration reminder(s) but failed to record them.")
+            self.logger.info(f"Expiration reminders: {len(sent)} sent, {len(reminders) - len(sent)} failed.")
 
         except Exception as e:
             self.logger.error(f"An unexpected error occurred in the send_expiration_reminders job: {e}", exc_info=True)
@@ -562,6 +863,9 @@ class ManagerBot:
         self.application.add_handler(CommandHandler("start", self.start_command))
         self.application.add_handler(CommandHandler("tickets", self.view_tickets_command))
         self.application.add_handler(CommandHandler("validate_now", self.validate_memberships_now_command))
+        self.application.add_handler(CommandHandler("broadcast", self.broadcast_command))
+        self.application.add_handler(CommandHandler("broadcast_status", self.broadcast_status_command))
+        self.application.add_handler(CommandHandler("broadcast_cancel", self.broadcast_cancel_command))
         self.application.add_handler(CommandHandler("help", self.help_command))
 
         # Add ticket management handlers from the ticket handler
@@ -598,9 +902,11 @@ class ManagerBot:
                     
                     if 'main_bot_support_staff' in roles and chat_id:
                         try:
-                            await self.main_bot_app.bot.send_message(
-                                chat_id=chat_id,
-                                text=notif_message,
+                            await message_dispatcher.send_message(
+                                self.main_bot_app.bot,
+                                chat_id,
+                                notif_message,
+                                priority=PRIORITY_HIGH,
                                 parse_mode=ParseMode.HTML
                             )
                             notified_count += 1
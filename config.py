@@ -130,6 +130,7 @@ TRONGRID_API_KEY = os.getenv("TRONGRID_API_KEY")
 if not TRONGRID_API_KEY:
     TRONGRID_API_KEY = _KEY_NOT_SET_PLACEHOLDER
     logger.warning("TRONGRID_API_KEY not set in .env. Using placeholder. TronGrid communication will fail.")
+TRONGRID_API_URL = os.getenv("TRONGRID_API_URL", "https://api.trongrid.io").rstrip("/")
 
 COINGECKO_API_KEY = os.getenv("COINGECKO_API_KEY", "") # Default to empty string if not set
 if not COINGECKO_API_KEY:
@@ -219,6 +220,555 @@ except OSError as e:
 # For compatibility, DATABASE_NAME should be the full path to the database file.
 DATABASE_NAME = DATABASE_PATH
 
+# --- Database Connection Pool ---
+# Number of long-lived SQLite connections kept open and reused across queries.
+DB_POOL_SIZE_STR = os.getenv("DB_POOL_SIZE", "5")
+try:
+    DB_POOL_SIZE = int(DB_POOL_SIZE_STR)
+    if DB_POOL_SIZE < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for DB_POOL_SIZE in .env: '{DB_POOL_SIZE_STR}'. "
+        f"Using default value: 5."
+    )
+    DB_POOL_SIZE = 5
+
+# Idle pooled connections older than this many seconds are checked with 'SELECT 1' before reuse.
+DB_POOL_HEALTHCHECK_INTERVAL_STR = os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", "60")
+try:
+    DB_POOL_HEALTHCHECK_INTERVAL = int(DB_POOL_HEALTHCHECK_INTERVAL_STR)
+except ValueError:
+    logger.warning(
+        f"Invalid value for DB_POOL_HEALTHCHECK_INTERVAL in .env: '{DB_POOL_HEALTHCHECK_INTERVAL_STR}'. "
+        f"Using default value: 60."
+    )
+    DB_POOL_HEALTHCHECK_INTERVAL = 60
+
+# Extra short-lived connections opened when every pooled one is in use; past that,
+# queries wait up to DB_POOL_TIMEOUT seconds for a connection to be returned.
+DB_POOL_MAX_OVERFLOW_STR = os.getenv("DB_POOL_MAX_OVERFLOW", "10")
+try:
+    DB_POOL_MAX_OVERFLOW = int(DB_POOL_MAX_OVERFLOW_STR)
+    if DB_POOL_MAX_OVERFLOW < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for DB_POOL_MAX_OVERFLOW in .env: '{DB_POOL_MAX_OVERFLOW_STR}'. "
+        f"Using default value: 10."
+    )
+    DB_POOL_MAX_OVERFLOW = 10
+
+DB_POOL_TIMEOUT_STR = os.getenv("DB_POOL_TIMEOUT", "30")
+try:
+    DB_POOL_TIMEOUT = int(DB_POOL_TIMEOUT_STR)
+except ValueError:
+    logger.warning(
+        f"Invalid value for DB_POOL_TIMEOUT in .env: '{DB_POOL_TIMEOUT_STR}'. "
+        f"Using default value: 30."
+    )
+    DB_POOL_TIMEOUT = 30
+
+# --- SQLite PRAGMA profile ---
+# Applied to every pooled connection when it is opened. WAL lets readers and the
+# single writer proceed concurrently, so the manager bot's membership job no longer
+# blocks the main bot's activity/payment writes (and vice versa).
+DB_PRAGMA_PROFILES = {
+    # WAL with relaxed fsync: safe against application crashes, may lose the last
+    # transactions on power loss. Recommended for the bots.
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,       # milliseconds
+        "cache_size": -16000,       # negative = KiB, i.e. ~16 MB page cache
+        "mmap_size": 134217728,     # 128 MB
+        "temp_store": "MEMORY",
+    },
+    # WAL with full fsync on every commit.
+    "wal_durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "cache_size": -16000,
+        "mmap_size": 134217728,
+        "temp_store": "MEMORY",
+    },
+    # SQLite's own defaults (rollback journal); only a busy timeout is added.
+    "legacy": {
+        "busy_timeout": 5000,
+    },
+}
+DB_PRAGMA_PROFILE = os.getenv("DB_PRAGMA_PROFILE", "wal").strip().lower()
+if DB_PRAGMA_PROFILE not in DB_PRAGMA_PROFILES:
+    logger.warning(
+        f"Unknown DB_PRAGMA_PROFILE in .env: '{DB_PRAGMA_PROFILE}'. "
+        f"Valid profiles: {', '.join(DB_PRAGMA_PROFILES)}. Using default profile: wal."
+    )
+    DB_PRAGMA_PROFILE = "wal"
+DB_PRAGMAS = dict(DB_PRAGMA_PROFILES[DB_PRAGMA_PROFILE])
+
+# DB_BUSY_TIMEOUT (milliseconds) overrides the profile's busy_timeout if set.
+DB_BUSY_TIMEOUT_STR = os.getenv("DB_BUSY_TIMEOUT")
+if DB_BUSY_TIMEOUT_STR:
+    try:
+        DB_PRAGMAS["busy_timeout"] = int(DB_BUSY_TIMEOUT_STR)
+    except ValueError:
+        logger.warning(
+            f"Invalid value for DB_BUSY_TIMEOUT in .env: '{DB_BUSY_TIMEOUT_STR}'. "
+            f"Keeping profile value: {DB_PRAGMAS.get('busy_timeout')}."
+        )
+
+# --- User activity write buffer ---
+# users.last_activity stamps are buffered in memory and flushed in one batch every
+# USER_ACTIVITY_FLUSH_INTERVAL seconds (and on shutdown). At most that many seconds
+# of stamps can be lost on a crash. Set to 0 to write every stamp immediately.
+USER_ACTIVITY_FLUSH_INTERVAL_STR = os.getenv("USER_ACTIVITY_FLUSH_INTERVAL", "30")
+try:
+    USER_ACTIVITY_FLUSH_INTERVAL = int(USER_ACTIVITY_FLUSH_INTERVAL_STR)
+    if USER_ACTIVITY_FLUSH_INTERVAL < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for USER_ACTIVITY_FLUSH_INTERVAL in .env: '{USER_ACTIVITY_FLUSH_INTERVAL_STR}'. "
+        f"Using default value: 30."
+    )
+    USER_ACTIVITY_FLUSH_INTERVAL = 30
+
+# Flush early once this many distinct users are waiting in the buffer.
+USER_ACTIVITY_BUFFER_MAX_STR = os.getenv("USER_ACTIVITY_BUFFER_MAX", "1000")
+try:
+    USER_ACTIVITY_BUFFER_MAX = int(USER_ACTIVITY_BUFFER_MAX_STR)
+    if USER_ACTIVITY_BUFFER_MAX < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for USER_ACTIVITY_BUFFER_MAX in .env: '{USER_ACTIVITY_BUFFER_MAX_STR}'. "
+        f"Using default value: 1000."
+    )
+    USER_ACTIVITY_BUFFER_MAX = 1000
+
+# --- Activity log writer ---
+# UserAction logs are queued and inserted in batches by a background writer.
+# When the queue is full, rows are written synchronously instead of being dropped.
+ACTIVITY_LOG_QUEUE_SIZE_STR = os.getenv("ACTIVITY_LOG_QUEUE_SIZE", "10000")
+try:
+    ACTIVITY_LOG_QUEUE_SIZE = int(ACTIVITY_LOG_QUEUE_SIZE_STR)
+    if ACTIVITY_LOG_QUEUE_SIZE < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for ACTIVITY_LOG_QUEUE_SIZE in .env: '{ACTIVITY_LOG_QUEUE_SIZE_STR}'. "
+        f"Using default value: 10000."
+    )
+    ACTIVITY_LOG_QUEUE_SIZE = 10000
+
+ACTIVITY_LOG_BATCH_SIZE_STR = os.getenv("ACTIVITY_LOG_BATCH_SIZE", "200")
+try:
+    ACTIVITY_LOG_BATCH_SIZE = int(ACTIVITY_LOG_BATCH_SIZE_STR)
+    if ACTIVITY_LOG_BATCH_SIZE < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for ACTIVITY_LOG_BATCH_SIZE in .env: '{ACTIVITY_LOG_BATCH_SIZE_STR}'. "
+        f"Using default value: 200."
+    )
+    ACTIVITY_LOG_BATCH_SIZE = 200
+
+# --- Plan catalog cache ---
+# Plans are served from memory and reloaded after any plan change made through the
+# bot. This TTL (seconds) bounds staleness for edits made directly in the database.
+# Set to 0 to disable the cache.
+PLAN_CACHE_TTL_STR = os.getenv("PLAN_CACHE_TTL", "300")
+try:
+    PLAN_CACHE_TTL = int(PLAN_CACHE_TTL_STR)
+    if PLAN_CACHE_TTL < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for PLAN_CACHE_TTL in .env: '{PLAN_CACHE_TTL_STR}'. "
+        f"Using default value: 300."
+    )
+    PLAN_CACHE_TTL = 300
+
+# --- Authorized member index ---
+# Join checks use an in-memory index of subscribed/banned users that is updated on
+# subscription and ban changes and fully rebuilt every this many seconds.
+AUTHORIZED_INDEX_RECONCILE_INTERVAL_STR = os.getenv("AUTHORIZED_INDEX_RECONCILE_INTERVAL", "300")
+try:
+    AUTHORIZED_INDEX_RECONCILE_INTERVAL = int(AUTHORIZED_INDEX_RECONCILE_INTERVAL_STR)
+    if AUTHORIZED_INDEX_RECONCILE_INTERVAL < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for AUTHORIZED_INDEX_RECONCILE_INTERVAL in .env: '{AUTHORIZED_INDEX_RECONCILE_INTERVAL_STR}'. "
+        f"Using default value: 300."
+    )
+    AUTHORIZED_INDEX_RECONCILE_INTERVAL = 300
+
+# --- Membership expiry handling ---
+# Expired users are removed by a scheduler that fires when each subscription ends.
+# The scheduler loads expiries for the next two look-ahead windows every
+# EXPIRY_SCHEDULER_LOOKAHEAD seconds; the full channel sweep only runs every
+# MEMBERSHIP_RECONCILE_INTERVAL seconds as a safety net.
+EXPIRY_SCHEDULER_LOOKAHEAD_STR = os.getenv("EXPIRY_SCHEDULER_LOOKAHEAD", "3600")
+try:
+    EXPIRY_SCHEDULER_LOOKAHEAD = int(EXPIRY_SCHEDULER_LOOKAHEAD_STR)
+    if EXPIRY_SCHEDULER_LOOKAHEAD < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for EXPIRY_SCHEDULER_LOOKAHEAD in .env: '{EXPIRY_SCHEDULER_LOOKAHEAD_STR}'. "
+        f"Using default value: 3600."
+    )
+    EXPIRY_SCHEDULER_LOOKAHEAD = 3600
+
+MEMBERSHIP_RECONCILE_INTERVAL_STR = os.getenv("MEMBERSHIP_RECONCILE_INTERVAL", "3600")
+try:
+    MEMBERSHIP_RECONCILE_INTERVAL = int(MEMBERSHIP_RECONCILE_INTERVAL_STR)
+    if MEMBERSHIP_RECONCILE_INTERVAL < 60:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for MEMBERSHIP_RECONCILE_INTERVAL in .env: '{MEMBERSHIP_RECONCILE_INTERVAL_STR}' (minimum 60). "
+        f"Using default value: 3600."
+    )
+    MEMBERSHIP_RECONCILE_INTERVAL = 3600
+
+# Concurrency / flood-limit settings for membership checks (get_chat_member fan-out).
+MEMBERSHIP_CHECK_CONCURRENCY_STR = os.getenv("MEMBERSHIP_CHECK_CONCURRENCY", "8")
+try:
+    MEMBERSHIP_CHECK_CONCURRENCY = int(MEMBERSHIP_CHECK_CONCURRENCY_STR)
+    if MEMBERSHIP_CHECK_CONCURRENCY < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for MEMBERSHIP_CHECK_CONCURRENCY in .env: '{MEMBERSHIP_CHECK_CONCURRENCY_STR}'. "
+        f"Using default value: 8."
+    )
+    MEMBERSHIP_CHECK_CONCURRENCY = 8
+
+# Maximum requests per second sent to one channel.
+MEMBERSHIP_CHECK_PER_CHAT_RATE_STR = os.getenv("MEMBERSHIP_CHECK_PER_CHAT_RATE", "20")
+try:
+    MEMBERSHIP_CHECK_PER_CHAT_RATE = float(MEMBERSHIP_CHECK_PER_CHAT_RATE_STR)
+    if MEMBERSHIP_CHECK_PER_CHAT_RATE <= 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for MEMBERSHIP_CHECK_PER_CHAT_RATE in .env: '{MEMBERSHIP_CHECK_PER_CHAT_RATE_STR}'. "
+        f"Using default value: 20."
+    )
+    MEMBERSHIP_CHECK_PER_CHAT_RATE = 20.0
+
+# How many times a call is retried after Telegram answers with RetryAfter.
+MEMBERSHIP_CHECK_MAX_RETRIES_STR = os.getenv("MEMBERSHIP_CHECK_MAX_RETRIES", "3")
+try:
+    MEMBERSHIP_CHECK_MAX_RETRIES = int(MEMBERSHIP_CHECK_MAX_RETRIES_STR)
+    if MEMBERSHIP_CHECK_MAX_RETRIES < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for MEMBERSHIP_CHECK_MAX_RETRIES in .env: '{MEMBERSHIP_CHECK_MAX_RETRIES_STR}'. "
+        f"Using default value: 3."
+    )
+    MEMBERSHIP_CHECK_MAX_RETRIES = 3
+
+# Roster entries (from chat_member updates / lookups) younger than this many seconds
+# are trusted by membership validation instead of calling get_chat_member.
+CHANNEL_ROSTER_MAX_AGE_STR = os.getenv("CHANNEL_ROSTER_MAX_AGE", "86400")
+try:
+    CHANNEL_ROSTER_MAX_AGE = int(CHANNEL_ROSTER_MAX_AGE_STR)
+    if CHANNEL_ROSTER_MAX_AGE < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for CHANNEL_ROSTER_MAX_AGE in .env: '{CHANNEL_ROSTER_MAX_AGE_STR}'. "
+        f"Using default value: 86400."
+    )
+    CHANNEL_ROSTER_MAX_AGE = 86400
+
+# Channel administrator lists are cached for this many seconds (0 = always fetch).
+CHANNEL_ADMIN_CACHE_TTL_STR = os.getenv("CHANNEL_ADMIN_CACHE_TTL", "3600")
+try:
+    CHANNEL_ADMIN_CACHE_TTL = int(CHANNEL_ADMIN_CACHE_TTL_STR)
+    if CHANNEL_ADMIN_CACHE_TTL < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for CHANNEL_ADMIN_CACHE_TTL in .env: '{CHANNEL_ADMIN_CACHE_TTL_STR}'. "
+        f"Using default value: 3600."
+    )
+    CHANNEL_ADMIN_CACHE_TTL = 3600
+
+# When enabled, the channels' invite links are expected to require admin approval
+# ("request to join"): the Manager Bot approves subscribers' join requests and declines
+# everyone else, instead of banning unauthorized users after they have joined.
+CHANNEL_JOIN_REQUEST_MODE = os.getenv("CHANNEL_JOIN_REQUEST_MODE", "false").strip().lower() in ("1", "true", "yes", "on")
+
+# Outbound messages per second per bot (Telegram allows about 30); 0 disables pacing.
+MESSAGE_DISPATCH_GLOBAL_RATE_STR = os.getenv("MESSAGE_DISPATCH_GLOBAL_RATE", "30")
+try:
+    MESSAGE_DISPATCH_GLOBAL_RATE = float(MESSAGE_DISPATCH_GLOBAL_RATE_STR)
+    if MESSAGE_DISPATCH_GLOBAL_RATE < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for MESSAGE_DISPATCH_GLOBAL_RATE in .env: '{MESSAGE_DISPATCH_GLOBAL_RATE_STR}'. "
+        f"Using default value: 30."
+    )
+    MESSAGE_DISPATCH_GLOBAL_RATE = 30
+
+# Outbound messages per second to a single chat.
+MESSAGE_DISPATCH_PER_CHAT_RATE_STR = os.getenv("MESSAGE_DISPATCH_PER_CHAT_RATE", "1")
+try:
+    MESSAGE_DISPATCH_PER_CHAT_RATE = float(MESSAGE_DISPATCH_PER_CHAT_RATE_STR)
+    if MESSAGE_DISPATCH_PER_CHAT_RATE < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for MESSAGE_DISPATCH_PER_CHAT_RATE in .env: '{MESSAGE_DISPATCH_PER_CHAT_RATE_STR}'. "
+        f"Using default value: 1."
+    )
+    MESSAGE_DISPATCH_PER_CHAT_RATE = 1
+
+# Concurrent senders used by the outbound message dispatcher.
+MESSAGE_DISPATCH_WORKERS_STR = os.getenv("MESSAGE_DISPATCH_WORKERS", "8")
+try:
+    MESSAGE_DISPATCH_WORKERS = int(MESSAGE_DISPATCH_WORKERS_STR)
+    if MESSAGE_DISPATCH_WORKERS < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for MESSAGE_DISPATCH_WORKERS in .env: '{MESSAGE_DISPATCH_WORKERS_STR}'. "
+        f"Using default value: 8."
+    )
+    MESSAGE_DISPATCH_WORKERS = 8
+
+# How many times a message is re-queued after a RetryAfter (flood limit) error.
+MESSAGE_DISPATCH_MAX_RETRIES_STR = os.getenv("MESSAGE_DISPATCH_MAX_RETRIES", "3")
+try:
+    MESSAGE_DISPATCH_MAX_RETRIES = int(MESSAGE_DISPATCH_MAX_RETRIES_STR)
+    if MESSAGE_DISPATCH_MAX_RETRIES < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for MESSAGE_DISPATCH_MAX_RETRIES in .env: '{MESSAGE_DISPATCH_MAX_RETRIES_STR}'. "
+        f"Using default value: 3."
+    )
+    MESSAGE_DISPATCH_MAX_RETRIES = 3
+
+# Recipients loaded, sent and checkpointed per step of an admin broadcast.
+BROADCAST_CHUNK_SIZE_STR = os.getenv("BROADCAST_CHUNK_SIZE", "500")
+try:
+    BROADCAST_CHUNK_SIZE = int(BROADCAST_CHUNK_SIZE_STR)
+    if BROADCAST_CHUNK_SIZE < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for BROADCAST_CHUNK_SIZE in .env: '{BROADCAST_CHUNK_SIZE_STR}'. "
+        f"Using default value: 500."
+    )
+    BROADCAST_CHUNK_SIZE = 500
+
+# Minimum seconds between edits of a broadcast's progress message.
+BROADCAST_PROGRESS_INTERVAL_STR = os.getenv("BROADCAST_PROGRESS_INTERVAL", "5")
+try:
+    BROADCAST_PROGRESS_INTERVAL = float(BROADCAST_PROGRESS_INTERVAL_STR)
+    if BROADCAST_PROGRESS_INTERVAL < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for BROADCAST_PROGRESS_INTERVAL in .env: '{BROADCAST_PROGRESS_INTERVAL_STR}'. "
+        f"Using default value: 5."
+    )
+    BROADCAST_PROGRESS_INTERVAL = 5
+
+# Seconds a fetched USDT→IRR rate counts as fresh; it is refreshed in the background before then.
+USDT_RATE_TTL_STR = os.getenv("USDT_RATE_TTL", "60")
+try:
+    USDT_RATE_TTL = int(USDT_RATE_TTL_STR)
+    if USDT_RATE_TTL < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for USDT_RATE_TTL in .env: '{USDT_RATE_TTL_STR}'. "
+        f"Using default value: 60."
+    )
+    USDT_RATE_TTL = 60
+
+# Seconds an old USDT→IRR rate may still be shown while a refresh is in progress.
+USDT_RATE_MAX_STALE_STR = os.getenv("USDT_RATE_MAX_STALE", "900")
+try:
+    USDT_RATE_MAX_STALE = int(USDT_RATE_MAX_STALE_STR)
+    if USDT_RATE_MAX_STALE < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for USDT_RATE_MAX_STALE in .env: '{USDT_RATE_MAX_STALE_STR}'. "
+        f"Using default value: 900."
+    )
+    USDT_RATE_MAX_STALE = 900
+
+# Threads running the (blocking) Zarinpal SDK calls.
+ZARINPAL_WORKERS_STR = os.getenv("ZARINPAL_WORKERS", "4")
+try:
+    ZARINPAL_WORKERS = int(ZARINPAL_WORKERS_STR)
+    if ZARINPAL_WORKERS < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for ZARINPAL_WORKERS in .env: '{ZARINPAL_WORKERS_STR}'. "
+        f"Using default value: 4."
+    )
+    ZARINPAL_WORKERS = 4
+
+# Deadline in seconds for one Zarinpal request/verify call.
+ZARINPAL_TIMEOUT_STR = os.getenv("ZARINPAL_TIMEOUT", "15")
+try:
+    ZARINPAL_TIMEOUT = float(ZARINPAL_TIMEOUT_STR)
+    if ZARINPAL_TIMEOUT <= 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for ZARINPAL_TIMEOUT in .env: '{ZARINPAL_TIMEOUT_STR}'. "
+        f"Using default value: 15."
+    )
+    ZARINPAL_TIMEOUT = 15
+
+# Consecutive Zarinpal failures (timeouts/errors) that open the circuit breaker.
+ZARINPAL_BREAKER_THRESHOLD_STR = os.getenv("ZARINPAL_BREAKER_THRESHOLD", "5")
+try:
+    ZARINPAL_BREAKER_THRESHOLD = int(ZARINPAL_BREAKER_THRESHOLD_STR)
+    if ZARINPAL_BREAKER_THRESHOLD < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for ZARINPAL_BREAKER_THRESHOLD in .env: '{ZARINPAL_BREAKER_THRESHOLD_STR}'. "
+        f"Using default value: 5."
+    )
+    ZARINPAL_BREAKER_THRESHOLD = 5
+
+# Seconds the Zarinpal circuit stays open before a trial call is allowed.
+ZARINPAL_BREAKER_RESET_STR = os.getenv("ZARINPAL_BREAKER_RESET", "60")
+try:
+    ZARINPAL_BREAKER_RESET = float(ZARINPAL_BREAKER_RESET_STR)
+    if ZARINPAL_BREAKER_RESET < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for ZARINPAL_BREAKER_RESET in .env: '{ZARINPAL_BREAKER_RESET_STR}'. "
+        f"Using default value: 60."
+    )
+    ZARINPAL_BREAKER_RESET = 60
+
+# Background verification of Zarinpal payments the user never returned from (0 disables it)
+ZARINPAL_RECONCILE_INTERVAL_STR = os.getenv("ZARINPAL_RECONCILE_INTERVAL", "120")
+try:
+    ZARINPAL_RECONCILE_INTERVAL = int(ZARINPAL_RECONCILE_INTERVAL_STR)
+    if ZARINPAL_RECONCILE_INTERVAL < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for ZARINPAL_RECONCILE_INTERVAL in .env: '{ZARINPAL_RECONCILE_INTERVAL_STR}'. "
+        f"Using default value: 120."
+    )
+    ZARINPAL_RECONCILE_INTERVAL = 120
+
+# Seconds a pending_verification payment is left alone (between checks) before the reconciler verifies it
+ZARINPAL_RECONCILE_MIN_AGE_STR = os.getenv("ZARINPAL_RECONCILE_MIN_AGE", "300")
+try:
+    ZARINPAL_RECONCILE_MIN_AGE = int(ZARINPAL_RECONCILE_MIN_AGE_STR)
+    if ZARINPAL_RECONCILE_MIN_AGE < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for ZARINPAL_RECONCILE_MIN_AGE in .env: '{ZARINPAL_RECONCILE_MIN_AGE_STR}'. "
+        f"Using default value: 300."
+    )
+    ZARINPAL_RECONCILE_MIN_AGE = 300
+
+# Seconds after creation an unpaid Zarinpal payment is marked expired
+ZARINPAL_RECONCILE_MAX_AGE_STR = os.getenv("ZARINPAL_RECONCILE_MAX_AGE", "3600")
+try:
+    ZARINPAL_RECONCILE_MAX_AGE = int(ZARINPAL_RECONCILE_MAX_AGE_STR)
+    if ZARINPAL_RECONCILE_MAX_AGE <= 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for ZARINPAL_RECONCILE_MAX_AGE in .env: '{ZARINPAL_RECONCILE_MAX_AGE_STR}'. "
+        f"Using default value: 3600."
+    )
+    ZARINPAL_RECONCILE_MAX_AGE = 3600
+
+ZARINPAL_RECONCILE_BATCH_STR = os.getenv("ZARINPAL_RECONCILE_BATCH", "50")
+try:
+    ZARINPAL_RECONCILE_BATCH = int(ZARINPAL_RECONCILE_BATCH_STR)
+    if ZARINPAL_RECONCILE_BATCH <= 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for ZARINPAL_RECONCILE_BATCH in .env: '{ZARINPAL_RECONCILE_BATCH_STR}'. "
+        f"Using default value: 50."
+    )
+    ZARINPAL_RECONCILE_BATCH = 50
+
+# Use the in-process stub instead of the real Zarinpal gateway (local testing only)
+ZARINPAL_USE_STUB = os.getenv("ZARINPAL_USE_STUB", "false").strip().lower() in ("1", "true", "yes", "on")
+if ZARINPAL_USE_STUB:
+    logger.warning("ZARINPAL_USE_STUB is enabled: payments are simulated and no real money is collected.")
+
+# Seconds between polls of TronGrid for USDT transfers to CRYPTO_WALLET_ADDRESS (0 disables the watcher)
+CRYPTO_WATCH_INTERVAL_STR = os.getenv("CRYPTO_WATCH_INTERVAL", "30")
+try:
+    CRYPTO_WATCH_INTERVAL = int(CRYPTO_WATCH_INTERVAL_STR)
+    if CRYPTO_WATCH_INTERVAL < 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for CRYPTO_WATCH_INTERVAL in .env: '{CRYPTO_WATCH_INTERVAL_STR}'. "
+        f"Using default value: 30."
+    )
+    CRYPTO_WATCH_INTERVAL = 30
+
+# Transfers per TronGrid page (TronGrid allows at most 200)
+CRYPTO_WATCH_PAGE_SIZE_STR = os.getenv("CRYPTO_WATCH_PAGE_SIZE", "200")
+try:
+    CRYPTO_WATCH_PAGE_SIZE = int(CRYPTO_WATCH_PAGE_SIZE_STR)
+    if not 0 < CRYPTO_WATCH_PAGE_SIZE <= 200:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for CRYPTO_WATCH_PAGE_SIZE in .env: '{CRYPTO_WATCH_PAGE_SIZE_STR}'. "
+        f"Using default value: 200."
+    )
+    CRYPTO_WATCH_PAGE_SIZE = 200
+
+# Seconds after which an unfinished subscription activation claim (e.g. left by a crash) may be retried
+SUBSCRIPTION_CLAIM_STALE_SECONDS_STR = os.getenv("SUBSCRIPTION_CLAIM_STALE_SECONDS", "120")
+try:
+    SUBSCRIPTION_CLAIM_STALE_SECONDS = int(SUBSCRIPTION_CLAIM_STALE_SECONDS_STR)
+    if SUBSCRIPTION_CLAIM_STALE_SECONDS <= 0:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for SUBSCRIPTION_CLAIM_STALE_SECONDS in .env: '{SUBSCRIPTION_CLAIM_STALE_SECONDS_STR}'. "
+        f"Using default value: 120."
+    )
+    SUBSCRIPTION_CLAIM_STALE_SECONDS = 120
+
+# Worker threads used by AsyncDatabaseQueries to keep SQLite work off the event loop.
+DB_EXECUTOR_WORKERS_STR = os.getenv("DB_EXECUTOR_WORKERS", "4")
+try:
+    DB_EXECUTOR_WORKERS = int(DB_EXECUTOR_WORKERS_STR)
+    if DB_EXECUTOR_WORKERS < 1:
+        raise ValueError
+except ValueError:
+    logger.warning(
+        f"Invalid value for DB_EXECUTOR_WORKERS in .env: '{DB_EXECUTOR_WORKERS_STR}'. "
+        f"Using default value: 4."
+    )
+    DB_EXECUTOR_WORKERS = 4
+
 
 
 
@@ -4,5 +4,6 @@ Database package initialization
 
 from database.models import Database
 from database.queries import DatabaseQueries
+from database.async_queries import AsyncDatabaseQueries
 
-__all__ = ['Database', 'DatabaseQueries']
+__all__ = ['Database', 'DatabaseQueries', 'AsyncDatabaseQueries']
@@ -0,0 +1,78 @@
+"""
+Write-coalescing buffer for users.last_activity for the Daraei Academy Telegram bot
+"""
+
+import logging
+import threading
+from datetime import datetime
+
+import sqlite3
+
+import config
+from database.models import Database
+
+logger = logging.getLogger(__name__)
+
+
+class LastActivityBuffer:
+    """Collects last-activity stamps in memory and writes them in one batch.
+
+    Repeated touches for the same user between two flushes collapse into a single
+    UPDATE carrying the latest timestamp. ``flush()`` writes every pending stamp with
+    one ``executemany`` inside a single transaction. At most ``max_pending`` users are
+    buffered; the caller that crosses the limit flushes synchronously.
+    """
+
+    def __init__(self, max_pending: int = 1000):
+        self.max_pending = max(1, int(max_pending))
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # user_id -> "YYYY-MM-DD HH:MM:SS"
+
+    def touch(self, user_id, timestamp: str = None):
+        """Record activity for *user_id*. Returns True once the stamp is buffered."""
+        if timestamp is None:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._pending[user_id] = timestamp
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self.flush()
+        return True
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """Write all buffered stamps. Returns the number of users written (0 on failure)."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch = self._pending
+                self._pending = {}
+
+            db = Database()
+            if db.connect():
+                try:
+                    db.cursor.executemany(
+                        "UPDATE users SET last_activity = ? WHERE user_id = ?",
+                        [(ts, user_id) for user_id, ts in batch.items()]
+                    )
+                    db.commit()
+                    logger.debug(f"Flushed last_activity for {len(batch)} user(s).")
+                    return len(batch)
+                except sqlite3.Error as e:
+                    logger.error(f"SQLite error flushing last_activity buffer: {e}")
+                finally:
+                    db.close()
+
+            # Put the batch back without overwriting newer stamps taken meanwhile
+            with self._lock:
+                for user_id, ts in batch.items():
+                    self._pending.setdefault(user_id, ts)
+            return 0
+
+
+last_activity_buffer = LastActivityBuffer(max_pending=getattr(config, 'USER_ACTIVITY_BUFFER_MAX', 1000))
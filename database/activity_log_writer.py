@@ -0,0 +1,153 @@
+"""
+Background batched writer for user_activity_logs for the Daraei Academy Telegram bot
+"""
+
+import logging
+import queue
+import threading
+from datetime import datetime
+
+import sqlite3
+
+import config
+from database.models import Database
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ActivityLogWriter:
+    """Queues activity log rows and inserts them from a background thread.
+
+    ``enqueue()`` never touches the database while the queue has room; the writer
+    thread drains up to ``batch_size`` rows at a time and inserts them with one
+    ``executemany`` in a single transaction. When the bounded queue is full the row
+    is written synchronously instead of being dropped (counted in ``stats()``).
+    """
+
+    INSERT_SQL = ("INSERT INTO user_activity_logs (user_id, telegram_id, action_type, timestamp, details) "
+                  "VALUES (?, ?, ?, ?, ?)")
+
+    def __init__(self, max_queue: int = 10000, batch_size: int = 200):
+        self.batch_size = max(1, int(batch_size))
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'failed': 0,
+            'sync_fallback': 0,
+            'batches': 0,
+            'max_depth': 0,
+        }
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def start(self):
+        """Start the writer thread if it is not running. Called lazily by enqueue()."""
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+            self._thread.start()
+            logger.info("Activity log writer started.")
+
+    def enqueue(self, telegram_id: int, action_type: str, details: str = None, user_id: int = None) -> bool:
+        """Queue one activity log row. Returns False only if it could not be stored at all."""
+        row = (user_id, telegram_id, action_type, datetime.now().isoformat(), details)
+        self.start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('sync_fallback')
+            logger.warning("Activity log queue is full; writing log row synchronously.")
+            return self._write([row])
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._queue.qsize())
+        return True
+
+    def _write(self, rows) -> bool:
+        db = Database()
+        if not db.connect():
+            self._count('failed', len(rows))
+            return False
+        try:
+            db.cursor.executemany(self.INSERT_SQL, rows)
+            db.commit()
+            self._count('written', len(rows))
+            self._count('batches')
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"SQLite error writing {len(rows)} activity log row(s): {e}")
+            self._count('failed', len(rows))
+            return False
+        finally:
+            db.close()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = []
+            taken = 1
+            if item is _STOP:
+                stopping = True
+            else:
+                batch.append(item)
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                taken += 1
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            try:
+                if batch:
+                    self._write(batch)
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until every row queued so far has been written (or failed)."""
+        with self._thread_lock:
+            running = self._thread is not None and self._thread.is_alive()
+        if running:
+            self._queue.join()
+
+    def stop(self, timeout: float = 10.0):
+        """Write everything still queued and stop the writer thread. Safe to call repeatedly."""
+        with self._thread_lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning(f"Activity log writer did not finish within {timeout}s; {self._queue.qsize()} row(s) pending.")
+        else:
+            logger.info(f"Activity log writer stopped. Stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        """Counters for monitoring backpressure (queue depth, sync fallbacks, failures)."""
+        with self._stats_lock:
+            result = dict(self._stats)
+        result['depth'] = self._queue.qsize()
+        result['capacity'] = self._queue.maxsize
+        return result
+
+
+activity_log_writer = ActivityLogWriter(
+    max_queue=getattr(config, 'ACTIVITY_LOG_QUEUE_SIZE', 10000),
+    batch_size=getattr(config, 'ACTIVITY_LOG_BATCH_SIZE', 200),
+)
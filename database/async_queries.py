@@ -0,0 +1,69 @@
+"""
+Awaitable database queries for the Daraei Academy Telegram bot
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from database.queries import DatabaseQueries
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabaseQueries:
+    """Awaitable facade over DatabaseQueries.
+
+    Every public static method of DatabaseQueries is available here with the same
+    name and arguments, e.g. ``await AsyncDatabaseQueries.get_user_details(user_id)``.
+    The underlying SQLite work runs on a dedicated thread pool so handlers never block
+    the event loop shared by both bots.
+    """
+
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        with cls._executor_lock:
+            if cls._executor is None:
+                workers = getattr(config, 'DB_EXECUTOR_WORKERS', 4)
+                cls._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-worker")
+                logger.info(f"Started database executor with {workers} worker thread(s).")
+            return cls._executor
+
+    @classmethod
+    async def run(cls, func, *args, **kwargs):
+        """Run a blocking callable on the database executor and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(cls._get_executor(), functools.partial(func, *args, **kwargs))
+
+    @classmethod
+    def shutdown(cls, wait: bool = True):
+        """Stop the database executor. A new one is created lazily if queries are issued afterwards."""
+        with cls._executor_lock:
+            executor = cls._executor
+            cls._executor = None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+            logger.info("Database executor shut down.")
+
+
+def _make_async_query(name):
+    async def query(*args, **kwargs):
+        # Resolve at call time so the facade always follows DatabaseQueries
+        return await AsyncDatabaseQueries.run(getattr(DatabaseQueries, name), *args, **kwargs)
+    query.__name__ = name
+    query.__qualname__ = f"AsyncDatabaseQueries.{name}"
+    query.__doc__ = getattr(DatabaseQueries, name).__doc__
+    return query
+
+
+for _name, _attr in list(vars(DatabaseQueries).items()):
+    if _name.startswith('_') or _name in vars(AsyncDatabaseQueries):
+        continue
+    if isinstance(_attr, staticmethod) or callable(_attr):
+        setattr(AsyncDatabaseQueries, _name, staticmethod(_make_async_query(_name)))
@@ -0,0 +1,129 @@
+"""
+In-memory index of pending crypto payment requests for the Daraei Academy Telegram bot
+"""
+
+import logging
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+
+import sqlite3
+
+from database.models import Database
+
+logger = logging.getLogger(__name__)
+
+USDT_DECIMALS = 6
+# Per-request offsets (micro-USDT) stay below the 0.001 USDT that base prices are rounded to
+UNIQUE_AMOUNT_OFFSETS = 1000
+
+
+def to_micro_usdt(amount) -> int:
+    """USDT amount as an integer count of micro-USDT (the TRC-20 token's base unit)."""
+    return int((Decimal(str(amount)) * 10 ** USDT_DECIMALS).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def first_free_micro_amount(base_micro: int, taken) -> int:
+    """Smallest ``base_micro + offset`` (offset < UNIQUE_AMOUNT_OFFSETS) not in *taken*, or None."""
+    for offset in range(UNIQUE_AMOUNT_OFFSETS):
+        if base_micro + offset not in taken:
+            return base_micro + offset
+    return None
+
+
+class PendingCryptoRequestIndex:
+    """Pending crypto_payments rows keyed by requested amount in micro-USDT.
+
+    Matching an incoming transfer is one dictionary lookup instead of a scan of
+    crypto_payments. The index is built from the database on first use (or by
+    ``rebuild()`` at startup) and kept current by the queries that create, re-price,
+    pay and expire requests. Requests that share an amount are kept oldest first.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_amount = {}     # micro-USDT -> [request row dict, ...] ordered by created_at
+        self._amounts = {}       # payment_id -> micro-USDT key
+        self._built = False
+
+    def rebuild(self) -> bool:
+        """Reload every pending request. Returns False if the database could not be read.
+
+        Requests whose window has passed are kept until they are expired in the database,
+        so transfers made in time but processed late (e.g. after downtime) still match.
+        """
+        db = Database()
+        if not db.connect():
+            return False
+        try:
+            db.cursor.execute("SELECT * FROM crypto_payments WHERE status = 'pending' ORDER BY created_at, id")
+            rows = [dict(row) for row in db.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"SQLite error rebuilding pending crypto request index: {e}")
+            return False
+        finally:
+            db.close()
+
+        by_amount, amounts = {}, {}
+        for row in rows:
+            key = to_micro_usdt(row['usdt_amount_requested'])
+            by_amount.setdefault(key, []).append(row)
+            amounts[row['payment_id']] = key
+        with self._lock:
+            self._by_amount, self._amounts, self._built = by_amount, amounts, True
+        logger.debug(f"Pending crypto request index rebuilt: {len(rows)} request(s).")
+        return True
+
+    def _ensure_built(self):
+        with self._lock:
+            built = self._built
+        if not built:
+            self.rebuild()
+
+    def add(self, request: dict):
+        """Index a newly created (or re-priced) pending request."""
+        self._ensure_built()
+        key = to_micro_usdt(request['usdt_amount_requested'])
+        with self._lock:
+            self._discard_locked(request['payment_id'])
+            bucket = self._by_amount.setdefault(key, [])
+            bucket.append(dict(request))
+            bucket.sort(key=lambda row: str(row['created_at']))
+            self._amounts[request['payment_id']] = key
+
+    def discard(self, payment_id: str):
+        """Drop a request that is no longer pending (paid, expired or cancelled)."""
+        with self._lock:
+            self._discard_locked(payment_id)
+
+    def _discard_locked(self, payment_id):
+        key = self._amounts.pop(payment_id, None)
+        if key is None:
+            return
+        bucket = [row for row in self._by_amount.get(key, []) if row['payment_id'] != payment_id]
+        if bucket:
+            self._by_amount[key] = bucket
+        else:
+            self._by_amount.pop(key, None)
+
+    def expire(self, before: str) -> int:
+        """Drop requests whose expires_at is before *before*. Returns how many were dropped."""
+        with self._lock:
+            expired = [row['payment_id'] for bucket in self._by_amount.values() for row in bucket
+                       if str(row['expires_at']) < before]
+            for payment_id in expired:
+                self._discard_locked(payment_id)
+        return len(expired)
+
+    def candidates(self, usdt_amount, paid_at: str) -> list:
+        """Every pending request for exactly *usdt_amount* that was open at *paid_at*, oldest first."""
+        self._ensure_built()
+        with self._lock:
+            return [dict(row) for row in self._by_amount.get(to_micro_usdt(usdt_amount), ())
+                    if str(row['created_at']) <= paid_at <= str(row['expires_at'])]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'pending': len(self._amounts), 'amounts': len(self._by_amount), 'built': self._built}
+
+
+pending_crypto_requests = PendingCryptoRequestIndex()
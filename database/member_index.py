@@ -0,0 +1,119 @@
+"""
+In-memory index of users allowed in the managed channels for the Daraei Academy Telegram bot
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+import sqlite3
+
+import config
+from database.models import Database
+
+logger = logging.getLogger(__name__)
+
+
+class AuthorizedMemberIndex:
+    """Keeps the latest active subscription end_date per user plus the banned set.
+
+    A user is authorized when they are not banned and their latest active
+    subscription ends in the future, so expiry needs no event: it falls out of the
+    time comparison. Code that changes a user's subscriptions or ban state calls
+    ``invalidate_user()``; that user is re-read (one indexed lookup) on the next
+    check. ``reconcile()`` rebuilds the whole index from the database and is run
+    periodically, and lazily once ``max_age`` seconds have passed since the last build.
+    """
+
+    def __init__(self, max_age: float = 300):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._expiry = {}      # user_id -> latest active end_date ("YYYY-MM-DD HH:MM:SS")
+        self._banned = set()
+        self._dirty = set()
+        self._built_at = None
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._dirty.add(user_id)
+
+    def reconcile(self) -> bool:
+        """Rebuild the index from the database. Returns False (keeping the previous index) if it could not be read."""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        db = Database()
+        if not db.connect():
+            return False
+        try:
+            db.cursor.execute(
+                "SELECT user_id, MAX(end_date) FROM subscriptions WHERE status = 'active' AND end_date > ? GROUP BY user_id",
+                (now,)
+            )
+            expiry = {row[0]: row[1] for row in db.fetchall()}
+            db.cursor.execute("SELECT user_id FROM banned_users")
+            banned = {row[0] for row in db.fetchall()}
+        except sqlite3.Error as e:
+            logger.error(f"SQLite error rebuilding authorized member index: {e}")
+            return False
+        finally:
+            db.close()
+
+        with self._lock:
+            self._expiry = expiry
+            self._banned = banned
+            self._built_at = time.monotonic()
+        logger.debug(f"Authorized member index rebuilt: {len(expiry)} active, {len(banned)} banned.")
+        return True
+
+    def _reload_user(self, user_id):
+        db = Database()
+        if not db.connect():
+            return False
+        try:
+            db.cursor.execute("SELECT MAX(end_date) FROM subscriptions WHERE user_id = ? AND status = 'active'", (user_id,))
+            end_date = db.fetchone()[0]
+            db.cursor.execute("SELECT 1 FROM banned_users WHERE user_id = ? LIMIT 1", (user_id,))
+            banned = db.fetchone() is not None
+        except sqlite3.Error as e:
+            logger.error(f"SQLite error refreshing authorized member index for user {user_id}: {e}")
+            return False
+        finally:
+            db.close()
+
+        with self._lock:
+            if end_date:
+                self._expiry[user_id] = end_date
+            else:
+                self._expiry.pop(user_id, None)
+            if banned:
+                self._banned.add(user_id)
+            else:
+                self._banned.discard(user_id)
+        return True
+
+    def is_authorized(self, user_id) -> bool:
+        with self._lock:
+            stale = self._built_at is None or (self.max_age > 0 and time.monotonic() - self._built_at > self.max_age)
+        if stale:
+            self.reconcile()
+
+        with self._lock:
+            dirty = user_id in self._dirty
+            # Drop the mark before reading so a change made meanwhile marks it again
+            self._dirty.discard(user_id)
+        if dirty and not self._reload_user(user_id):
+            self.invalidate_user(user_id)
+
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            if user_id in self._banned:
+                return False
+            end_date = self._expiry.get(user_id)
+            return end_date is not None and end_date > now
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'active': len(self._expiry), 'banned': len(self._banned), 'dirty': len(self._dirty)}
+
+
+authorized_members = AuthorizedMemberIndex(max_age=getattr(config, 'AUTHORIZED_INDEX_RECONCILE_INTERVAL', 300) * 2)
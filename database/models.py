@@ -5,13 +5,22 @@ Database models for the Daraei Academy Telegram bot
 import uuid
 from datetime import datetime, timedelta
 
+import logging
 import sqlite3
 import os
+import threading
 # Removed duplicate: from datetime import datetime, timedelta
 import config
+from database.pool import SQLiteConnectionPool
+
+logger = logging.getLogger(__name__)
 
 class Database:
     """SQLite database connection and initialization"""
+
+    # One connection pool per database file, shared by every Database instance
+    _pools = {}
+    _pools_lock = threading.Lock()
     
     def __init__(self, db_name=None):
         if db_name is None:
@@ -24,27 +33,72 @@ class Database:
         else:
             self.db_name = db_name
             
-        print(f"Database class initialized. Attempting to use database at: {os.path.abspath(self.db_name)}") 
         self.conn = None
         self.cursor = None
+
+    @classmethod
+    def get_pool(cls, db_name=None) -> SQLiteConnectionPool:
+        """Return the shared connection pool for *db_name*, creating it on first use."""
+        db_name = db_name or config.DATABASE_NAME
+        key = os.path.abspath(db_name)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = SQLiteConnectionPool(
+                    db_name,
+                    size=getattr(config, 'DB_POOL_SIZE', 5),
+                    healthcheck_interval=getattr(config, 'DB_POOL_HEALTHCHECK_INTERVAL', 60),
+                    pragmas=getattr(config, 'DB_PRAGMAS', None),
+                    max_overflow=getattr(config, 'DB_POOL_MAX_OVERFLOW', 10),
+                    timeout=getattr(config, 'DB_POOL_TIMEOUT', 30),
+                )
+                cls._pools[key] = pool
+                logger.info(
+                    f"Created SQLite connection pool (size={pool.size}, "
+                    f"pragma profile '{getattr(config, 'DB_PRAGMA_PROFILE', 'default')}') for {key}"
+                )
+            return pool
+
+    @classmethod
+    def close_pool(cls):
+        """Close all pooled connections. Safe to call more than once (e.g. from both bots' stop())."""
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+        for pool in pools:
+            pool.close_all()
         
     def connect(self):
-        """Connect to the SQLite database"""
+        """Check out a pooled connection to the SQLite database"""
+        if self.conn is not None:
+            return True
         try:
-            print(f"Connecting to: {os.path.abspath(self.db_name)}")
-            self.conn = sqlite3.connect(self.db_name)
-            self.conn.row_factory = sqlite3.Row
+            self.conn = Database.get_pool(self.db_name).acquire()
             self.cursor = self.conn.cursor()
-            print(f"Successfully connected to {os.path.abspath(self.db_name)}")
             return True
         except sqlite3.Error as e:
-            print(f"Database connection error for {os.path.abspath(self.db_name)}: {e}")
+            logger.error(f"Database connection error for {os.path.abspath(self.db_name)}: {e}")
+            self.conn = None
             return False
             
+    def __del__(self):
+        # A query path that returns without close() must not keep its pool slot
+        if getattr(self, 'conn', None) is not None:
+            try:
+                self.close()
+            except Exception:
+                pass
+
     def close(self):
-        """Close the database connection"""
+        """Return the connection to the pool (uncommitted changes are rolled back)"""
         if self.conn:
-            self.conn.close()
+            if self.cursor is not None:
+                try:
+                    self.cursor.close()
+                except sqlite3.Error:
+                    pass
+            Database.get_pool(self.db_name).release(self.conn)
+            self.conn = None
+            self.cursor = None
             
     def commit(self):
         """Commit changes to the database"""
@@ -86,6 +140,51 @@ class Database:
                 return False
         return True
 
+    def get_schema_version(self):
+        """Return the highest applied migration version (0 if none)"""
+        self.cursor.execute("SELECT MAX(version) FROM schema_version")
+        row = self.cursor.fetchone()
+        return row[0] if row and row[0] is not None else 0
+
+    def apply_migrations(self, migrations, version_table):
+        """Apply pending (version, description, steps) migrations in order.
+
+        A step is either an SQL statement or a callable that receives the cursor
+        (for changes that must inspect the existing schema first).
+
+        Each migration runs in its own transaction together with its schema_version
+        row, so a failed step leaves the database at the previous version.
+        Returns True when the schema is up to date.
+        """
+        try:
+            self.cursor.execute(version_table)
+            current = self.get_schema_version()
+        except sqlite3.Error as e:
+            logger.error(f"Could not read schema version: {e}")
+            return False
+
+        for version, description, steps in sorted(migrations, key=lambda m: m[0]):
+            if version <= current:
+                continue
+            try:
+                self.cursor.execute("BEGIN")
+                for step in steps:
+                    if callable(step):
+                        step(self.cursor)
+                    else:
+                        self.cursor.execute(step)
+                self.cursor.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                )
+                self.conn.commit()
+                logger.info(f"Applied database migration {version}: {description}")
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                logger.error(f"Database migration {version} ({description}) failed: {e}")
+                return False
+        return True
+
     # --- Crypto Payment Management ---
     def create_crypto_payment_request(self, user_id, rial_amount, usdt_amount_requested, wallet_address, expires_at):
         """Creates a new crypto payment request and returns its unique payment_id."""
@@ -0,0 +1,102 @@
+"""
+In-process plan catalog cache for the Daraei Academy Telegram bot
+"""
+
+import logging
+import threading
+import time
+
+import sqlite3
+
+import config
+from database.models import Database
+
+logger = logging.getLogger(__name__)
+
+
+class PlanCatalogCache:
+    """Read-through cache of the (small, rarely changing) plans table.
+
+    The whole catalog is loaded in one go and served from memory until it is
+    invalidated. Every code path that changes plans must call ``invalidate()``,
+    which bumps ``version`` so the next read reloads; both bots run in the same
+    process and therefore see the change immediately. ``ttl`` (seconds) bounds how
+    long edits made outside the bot (e.g. directly in the database) stay unseen;
+    ``ttl=0`` disables caching.
+    """
+
+    ACTIVE_PLANS_SQL = (
+        "SELECT id, name, description, price, original_price_irr, price_tether, original_price_usdt, days, features, display_order "
+        "FROM plans WHERE is_active = 1 ORDER BY display_order ASC, id ASC"
+    )
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self.version = 0
+        self._lock = threading.Lock()
+        self._loaded_version = None
+        self._loaded_at = 0.0
+        self._active = []
+        self._by_id = {}
+
+    def invalidate(self):
+        """Drop the cached catalog; the next read reloads it from the database."""
+        with self._lock:
+            self.version += 1
+            self._loaded_version = None
+        logger.info(f"Plan catalog invalidated (version {self.version}).")
+
+    def _is_fresh(self) -> bool:
+        return (self.ttl > 0 and self._loaded_version == self.version
+                and time.monotonic() - self._loaded_at < self.ttl)
+
+    def _load(self):
+        """Return (active_plans, plans_by_id) from the database, or None on failure."""
+        db = Database()
+        if not db.connect():
+            return None
+        try:
+            db.cursor.execute(self.ACTIVE_PLANS_SQL)
+            active = db.fetchall()
+            db.cursor.execute("SELECT * FROM plans")
+            by_id = {row['id']: row for row in db.fetchall()}
+            return active, by_id
+        except sqlite3.Error as e:
+            logger.error(f"SQLite error loading plan catalog: {e}")
+            return None
+        finally:
+            db.close()
+
+    def _snapshot(self):
+        with self._lock:
+            if self._is_fresh():
+                return self._active, self._by_id
+            version = self.version
+
+        loaded = self._load()
+        if loaded is None:
+            # Serve the last catalog we had (empty if none) and retry on the next read
+            with self._lock:
+                return self._active, self._by_id
+        with self._lock:
+            # Only publish if nothing invalidated the catalog while we were loading
+            if self.version == version:
+                self._active, self._by_id = loaded
+                self._loaded_version = version
+                self._loaded_at = time.monotonic()
+        return loaded
+
+    def get_active_plans(self) -> list:
+        active, _ = self._snapshot()
+        return list(active)
+
+    def get_plan(self, plan_id):
+        try:
+            plan_id = int(plan_id)
+        except (TypeError, ValueError):
+            return None
+        _, by_id = self._snapshot()
+        return by_id.get(plan_id)
+
+
+plan_catalog = PlanCatalogCache(ttl=getattr(config, 'PLAN_CACHE_TTL', 300))
@@ -0,0 +1,221 @@
+"""
+SQLite connection pool for the Daraei Academy Telegram bot
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection the pool tracks by identity (plain connections cannot be weakly referenced)."""
+
+    pool_generation = None
+
+
+class SQLiteConnectionPool:
+    """A small pool of long-lived SQLite connections for one database file.
+
+    Connections are handed out with ``acquire()`` and given back with ``release()``.
+    Idle connections are reused (most recently used first) so a handler that touches
+    the database several times pays the ``sqlite3.connect`` cost only once.  When all
+    ``size`` connections are checked out, up to ``max_overflow`` temporary overflow
+    connections are opened instead of blocking; each is closed as soon as it is
+    released.  Past that, ``acquire()`` waits up to ``timeout`` seconds for a
+    connection to come back and then raises ``sqlite3.OperationalError``.
+    Connections are always opened outside the pool lock.
+
+    Checked-out connections are tracked as objects in weak sets, so a connection
+    that is dropped without ``release()`` frees its slot once it is garbage collected.
+
+    ``pragmas`` is an ordered mapping of PRAGMA name to value that is applied to
+    every new connection (e.g. ``{'journal_mode': 'WAL', 'busy_timeout': 5000}``).
+    """
+
+    def __init__(self, db_name: str, size: int = 5, healthcheck_interval: float = 60.0, pragmas: dict = None,
+                 max_overflow: int = 10, timeout: float = 30.0):
+        self.db_name = db_name
+        self.size = max(1, int(size))
+        self.max_overflow = max(0, int(max_overflow))
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.pragmas = dict(pragmas or {})
+        self._lock = threading.Lock()
+        self._returned = threading.Condition(self._lock)   # notified when a slot frees up
+        self._idle = []          # list of (connection, last_used_monotonic)
+        self._checked_out = weakref.WeakSet()   # pooled (non-overflow) connections checked out
+        self._overflow = weakref.WeakSet()      # overflow connections currently checked out
+        self._opening = 0        # pooled slots reserved while a new connection is being opened
+        self._opening_overflow = 0   # overflow slots reserved while a connection is being opened
+        self._generation = 0     # bumped by close_all(); stale connections are closed on release
+
+    def _create_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        try:
+            self._apply_pragmas(conn)
+        except sqlite3.Error:
+            self._close_quietly(conn)
+            raise
+        logger.debug(f"Opened new SQLite connection to {self.db_name}")
+        return conn
+
+    def _apply_pragmas(self, conn: sqlite3.Connection):
+        for name, value in self.pragmas.items():
+            # PRAGMA values cannot be bound as parameters; names/values come from config only
+            conn.execute(f"PRAGMA {name} = {value}")
+
+    def effective_pragmas(self) -> dict:
+        """Read back the configured PRAGMAs from a live connection (as SQLite reports them)."""
+        conn = self.acquire()
+        try:
+            result = {}
+            for name in self.pragmas:
+                row = conn.execute(f"PRAGMA {name}").fetchone()
+                result[name] = row[0] if row is not None else None
+            return result
+        finally:
+            self.release(conn)
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding unhealthy SQLite connection: {e}")
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        """Check out a connection, reusing an idle one when possible."""
+        conn = None
+        last_used = None
+        overflow = False
+        deadline = time.monotonic() + self.timeout
+        warned = False
+        with self._returned:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._checked_out.add(conn)
+                    break
+                if len(self._checked_out) + self._opening < self.size:
+                    self._opening += 1
+                    break
+                if len(self._overflow) + self._opening_overflow < self.max_overflow:
+                    self._opening_overflow += 1
+                    overflow = True
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(
+                        f"SQLite pool for {self.db_name} exhausted: no connection free after {self.timeout}s"
+                    )
+                if not warned:
+                    logger.warning(f"SQLite pool for {self.db_name} reached its overflow cap "
+                                   f"({self.size} + {self.max_overflow} in use); waiting for a connection.")
+                    warned = True
+                # Bounded waits also notice slots freed by garbage-collected connections
+                self._returned.wait(min(remaining, 1.0))
+            generation = self._generation
+
+        if overflow:
+            try:
+                conn = self._create_connection()
+            except sqlite3.Error:
+                with self._returned:
+                    self._opening_overflow -= 1
+                    self._returned.notify()
+                raise
+            with self._lock:
+                self._opening_overflow -= 1
+                self._overflow.add(conn)
+            logger.debug(f"SQLite pool for {self.db_name} exhausted ({self.size} in use); opened overflow connection.")
+            return conn
+
+        if conn is not None and last_used is not None and \
+                time.monotonic() - last_used > self.healthcheck_interval and not self._is_healthy(conn):
+            with self._lock:
+                self._checked_out.discard(conn)
+                self._opening += 1
+            self._close_quietly(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._create_connection()
+            except sqlite3.Error:
+                with self._returned:
+                    self._opening -= 1
+                    self._returned.notify()
+                raise
+            conn.pool_generation = generation
+            with self._lock:
+                self._opening -= 1
+                self._checked_out.add(conn)
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool. Any open transaction is rolled back."""
+        if conn is None:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"Rollback failed while releasing SQLite connection: {e}")
+            self._discard(conn)
+            return
+
+        with self._returned:
+            if conn in self._overflow:
+                self._overflow.discard(conn)
+                stale = True
+            elif conn in self._checked_out:
+                self._checked_out.discard(conn)
+                stale = conn.pool_generation != self._generation
+                if not stale:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                logger.warning(f"Ignoring release of a connection not checked out from the pool for {self.db_name}.")
+                return
+            self._returned.notify()
+        if stale:
+            self._close_quietly(conn)
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._returned:
+            self._overflow.discard(conn)
+            self._checked_out.discard(conn)
+            self._returned.notify()
+        self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self):
+        """Close every idle connection. Connections still checked out are closed when released."""
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+            self._generation += 1
+        for conn, _ in idle:
+            self._close_quietly(conn)
+        logger.info(f"SQLite connection pool for {self.db_name} closed ({len(idle)} idle connection(s) released).")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'in_use': len(self._checked_out),
+                'overflow_in_use': len(self._overflow),
+            }
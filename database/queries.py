@@ -3,11 +3,16 @@ Database queries for the Daraei Academy Telegram bot
 """
 
 import sqlite3
+import uuid
 from datetime import datetime, timedelta
 import config
 import logging
 from database.models import Database
-from database.schema import ALL_TABLES
+from database.activity_buffer import last_activity_buffer
+from database.plan_cache import plan_catalog
+from database.member_index import authorized_members
+from database.crypto_request_index import pending_crypto_requests, to_micro_usdt, first_free_micro_amount, USDT_DECIMALS, UNIQUE_AMOUNT_OFFSETS
+from database.schema import ALL_TABLES, MIGRATIONS, SCHEMA_VERSION_TABLE
 from utils.helpers import get_current_time  # ensure Tehran-tz aware now
 
 class DatabaseQueries:
@@ -20,7 +25,14 @@ class DatabaseQueries:
         if db.connect():
             result = db.create_tables(ALL_TABLES)
             db.commit()
+            if result:
+                result = db.apply_migrations(MIGRATIONS, SCHEMA_VERSION_TABLE)
             db.close()
+            try:
+                pragmas = Database.get_pool(db.db_name).effective_pragmas()
+                config.logger.info(f"SQLite effective PRAGMA settings: {pragmas}")
+            except sqlite3.Error as e:
+                config.logger.warning(f"Could not read back SQLite PRAGMA settings: {e}")
             return result
         return False
     
@@ -53,7 +65,13 @@ class DatabaseQueries:
     
     @staticmethod
     def update_user_activity(user_id):
-        """Update user's last activity timestamp"""
+        """Update user's last activity timestamp.
+
+        When USER_ACTIVITY_FLUSH_INTERVAL > 0 the stamp is buffered and written in a
+        batch by flush_user_activity(); otherwise it is written immediately.
+        """
+        if getattr(config, 'USER_ACTIVITY_FLUSH_INTERVAL', 0) > 0:
+            return last_activity_buffer.touch(user_id)
         db = Database()
         if db.connect():
             now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -66,6 +84,11 @@ class DatabaseQueries:
             return True
         return False
     
+    @staticmethod
+    def flush_user_activity():
+        """Write buffered last_activity stamps. Returns the number of users written."""
+        return last_activity_buffer.flush()
+
     @staticmethod
     def get_user_details(user_id):
         """Get user details from database"""
@@ -120,6 +143,7 @@ class DatabaseQueries:
                 db.commit()
                 db.close()
                 return True
+            db.close()
         return False
 
     @staticmethod
@@ -148,28 +172,6 @@ class DatabaseQueries:
                 db.close()
         return False
     
-    # User Activity Log queries
-    @staticmethod
-    def add_user_activity_log(telegram_id: int, action_type: str, details: str = None, user_id: int = None):
-        """Add a new user activity log to the database."""
-        db = Database()
-        if db.connect():
-            now = datetime.now().isoformat()
-            try:
-                db.execute(
-                    "INSERT INTO user_activity_logs (user_id, telegram_id, action_type, timestamp, details) VALUES (?, ?, ?, ?, ?)",
-                    (user_id, telegram_id, action_type, now, details)
-                )
-                db.commit()
-                return True
-            except sqlite3.Error as e:
-                print(f"SQLite error when adding user activity log: {e}") # Basic error logging
-                # Consider more robust logging for production
-                return False
-            finally:
-                db.close()
-        return False
-
     # Registration-related queries
     @staticmethod
     def is_registered(user_id):
@@ -197,60 +199,299 @@ class DatabaseQueries:
         return False
 
     @staticmethod
-    def create_crypto_payment_request(user_id: int, rial_amount: float, usdt_amount_requested: float = None, wallet_address: str = None, expires_at: datetime = None):
+    def create_crypto_payment_request(user_id: int, rial_amount: float, usdt_amount_requested: float = None, wallet_address: str = None, expires_at: datetime = None, plan_id: int = None):
         """
-        Creates a preliminary crypto payment request in the database.
-        'usdt_amount_requested' can be None initially and updated later.
-        Assumes 'payments' table has: user_id, amount (for rial), usdt_amount_requested,
-        payment_method, status, description, wallet_address, expires_at, created_at, updated_at.
+        Creates a pending USDT payment request in crypto_payments.
+        Returns its unique payment_id (a UUID string), or None on failure.
+        'usdt_amount_requested' is the base price; the stored amount gets the smallest
+        micro-USDT offset that no other open request uses, so each transfer matches one request.
+        Without it the amount is set later with update_crypto_payment_request_with_amount.
         """
         db = Database()
         if db.connect():
-            now_iso = datetime.now().isoformat()
-            expires_at_iso = expires_at.isoformat() if expires_at else None
-            
-            description = f"Crypto payment for user ID {user_id}"
-
+            now = datetime.now()
+            now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+            payment_id = str(uuid.uuid4())
+            expires_at = expires_at or now + timedelta(minutes=config.CRYPTO_PAYMENT_TIMEOUT_MINUTES)
             try:
-                db.execute(
-                    """INSERT INTO payments (user_id, amount, usdt_amount_requested, payment_method, status, description, wallet_address, expires_at, created_at, updated_at)
-                       VALUES (?, ?, ?, 'crypto', 'pending', ?, ?, ?, ?, ?)""",
-                    (user_id, rial_amount, usdt_amount_requested, description, wallet_address, expires_at_iso, now_iso, now_iso)
+                # Write lock first, so concurrent requests cannot pick the same amount
+                db.cursor.execute("BEGIN IMMEDIATE")
+                db.cursor.execute(
+                    """INSERT INTO crypto_payments
+                       (user_id, payment_id, plan_id, rial_amount, usdt_amount_requested, wallet_address, status, created_at, updated_at, expires_at)
+                       VALUES (?, ?, ?, ?, 0, ?, 'pending', ?, ?, ?)""",
+                    (user_id, payment_id, plan_id, rial_amount, wallet_address or config.CRYPTO_WALLET_ADDRESS,
+                     now_str, now_str, expires_at.strftime("%Y-%m-%d %H:%M:%S"))
                 )
-                payment_id = db.cursor.lastrowid # Corrected: Use cursor.lastrowid
+                if usdt_amount_requested and DatabaseQueries._assign_unique_crypto_amount(db, payment_id, usdt_amount_requested, now_str) is None:
+                    db.conn.rollback()
+                    return None
                 db.commit()
+                if usdt_amount_requested:
+                    # Indexed only once its final amount is stored
+                    db.execute("SELECT * FROM crypto_payments WHERE payment_id = ?", (payment_id,))
+                    pending_crypto_requests.add(dict(db.fetchone()))
                 return payment_id
             except sqlite3.Error as e:
                 config.logger.error(f"SQLite error in create_crypto_payment_request: {e}") # Use logger
+                if db.conn and db.conn.in_transaction:
+                    db.conn.rollback()
                 return None
             finally:
                 db.close()
         return None
 
     @staticmethod
-    def update_crypto_payment_request_with_amount(payment_request_id: int, usdt_amount: float):
+    def _assign_unique_crypto_amount(db, payment_id: str, base_usdt_amount: float, now_str: str):
+        """
+        Store base_usdt_amount plus the smallest micro-USDT offset not used by another open
+        pending request. Runs inside the caller's write transaction. Returns the amount, or None.
+        """
+        base = to_micro_usdt(base_usdt_amount)
+        if base <= 0:
+            return None
+        scale = 10 ** USDT_DECIMALS
+        db.cursor.execute(
+            """SELECT usdt_amount_requested FROM crypto_payments
+               WHERE status = 'pending' AND expires_at >= ? AND payment_id != ?
+               AND usdt_amount_requested >= ? AND usdt_amount_requested <= ?""",
+            (now_str, payment_id, (base - 1) / scale, (base + UNIQUE_AMOUNT_OFFSETS) / scale)
+        )
+        final = first_free_micro_amount(base, {to_micro_usdt(row[0]) for row in db.cursor.fetchall()})
+        if final is None:
+            config.logger.error(f"No free USDT amount offset left for {base_usdt_amount} (payment {payment_id}).")
+            return None
+        amount = final / scale
+        db.cursor.execute(
+            "UPDATE crypto_payments SET usdt_amount_requested = ?, updated_at = ? WHERE payment_id = ?",
+            (amount, now_str, payment_id)
+        )
+        return amount
+
+    @staticmethod
+    def update_crypto_payment_request_with_amount(payment_request_id: str, usdt_amount: float):
         """
-        Updates an existing crypto payment request with the calculated USDT amount.
-        Assumes 'payments' table has: usdt_amount_requested, updated_at, payment_id, payment_method.
+        Updates a pending crypto payment request with the calculated USDT amount
+        (plus a unique micro-USDT offset, as in create_crypto_payment_request).
         """
         db = Database()
         if db.connect():
-            now_iso = datetime.now().isoformat()
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             try:
-                db.execute(
-                    "UPDATE payments SET usdt_amount_requested = ?, updated_at = ? WHERE payment_id = ? AND payment_method = 'crypto' AND status = 'pending'",
-                    (usdt_amount, now_iso, payment_request_id)
+                db.cursor.execute("BEGIN IMMEDIATE")
+                db.cursor.execute(
+                    "SELECT 1 FROM crypto_payments WHERE payment_id = ? AND status = 'pending'", (payment_request_id,)
                 )
+                if db.fetchone() is None or \
+                        DatabaseQueries._assign_unique_crypto_amount(db, payment_request_id, usdt_amount, now) is None:
+                    db.conn.rollback()
+                    return False
                 db.commit()
-                # Check if any row was actually updated; rowcount might be 0 if no matching record or value is the same
-                return db.cursor.rowcount > 0 
+                db.execute("SELECT * FROM crypto_payments WHERE payment_id = ?", (payment_request_id,))
+                pending_crypto_requests.add(dict(db.fetchone()))
+                return True
             except sqlite3.Error as e:
                 config.logger.error(f"SQLite error in update_crypto_payment_request_with_amount: {e}") # Use logger
+                if db.conn and db.conn.in_transaction:
+                    db.conn.rollback()
                 return False
             finally:
                 db.close()
         return False
 
+    @staticmethod
+    def get_crypto_payment_request(payment_id: str):
+        """The crypto_payments row for *payment_id* (the request's UUID) as a dict, or None."""
+        db = Database()
+        if db.connect():
+            try:
+                db.execute("SELECT * FROM crypto_payments WHERE payment_id = ?", (payment_id,))
+                row = db.fetchone()
+                return dict(row) if row else None
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in get_crypto_payment_request for {payment_id}: {e}")
+            finally:
+                db.close()
+        return None
+
+    @staticmethod
+    def find_pending_crypto_payments(usdt_amount: float, paid_at: str) -> list:
+        """
+        Every pending crypto request for exactly *usdt_amount* (to the micro-USDT) that was
+        open at *paid_at* ("%Y-%m-%d %H:%M:%S"), oldest first.
+        Served from the in-memory pending request index (one dictionary lookup).
+        """
+        return pending_crypto_requests.candidates(usdt_amount, paid_at)
+
+    @staticmethod
+    def rebuild_pending_crypto_index() -> bool:
+        """Rebuild the pending crypto request index from the database."""
+        return pending_crypto_requests.rebuild()
+
+    @staticmethod
+    def mark_crypto_payment_paid(payment_id: str, transaction_id: str, usdt_amount_received: float) -> bool:
+        """
+        Mark a pending crypto request paid by *transaction_id*.
+        Returns False if it is no longer pending or the transaction already paid another request;
+        None on a database error (the request is left pending).
+        """
+        db = Database()
+        if db.connect():
+            try:
+                db.cursor.execute("SELECT payment_id FROM crypto_payments WHERE transaction_id = ?", (transaction_id,))
+                used_by = db.fetchone()
+                if used_by is not None:
+                    config.logger.warning(f"Transaction {transaction_id} already paid crypto request {used_by['payment_id']}, not {payment_id}.")
+                    return False
+                db.cursor.execute(
+                    """UPDATE crypto_payments
+                       SET status = 'paid', transaction_id = ?, usdt_amount_received = ?, updated_at = ?
+                       WHERE payment_id = ? AND status = 'pending'""",
+                    (transaction_id, usdt_amount_received, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), payment_id)
+                )
+                db.commit()
+                paid = db.cursor.rowcount > 0
+                if paid:
+                    pending_crypto_requests.discard(payment_id)
+                return paid
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in mark_crypto_payment_paid for {payment_id}: {e}")
+                return None
+            finally:
+                db.close()
+        return None
+
+    @staticmethod
+    def mark_crypto_payments_for_review(payment_ids: list, usdt_amount_received: float) -> int:
+        """
+        Move pending crypto requests that one transfer could have paid to 'needs_review',
+        so none of them is activated automatically. Returns how many were moved, or None on a
+        database error (the requests are left pending).
+        """
+        if not payment_ids:
+            return 0
+        db = Database()
+        if db.connect():
+            try:
+                placeholders = ",".join("?" for _ in payment_ids)
+                db.cursor.execute(
+                    f"""UPDATE crypto_payments
+                        SET status = 'needs_review', usdt_amount_received = ?, updated_at = ?
+                        WHERE status = 'pending' AND payment_id IN ({placeholders})""",
+                    (usdt_amount_received, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), *payment_ids)
+                )
+                db.commit()
+                for payment_id in payment_ids:
+                    pending_crypto_requests.discard(payment_id)
+                return max(db.cursor.rowcount, 0)
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in mark_crypto_payments_for_review for {payment_ids}: {e}")
+            finally:
+                db.close()
+        return None
+
+    @staticmethod
+    def expire_crypto_payments(before: str) -> int:
+        """Mark pending crypto requests whose expires_at is before *before* as expired. Returns how many."""
+        db = Database()
+        if db.connect():
+            try:
+                db.cursor.execute(
+                    "UPDATE crypto_payments SET status = 'expired', updated_at = ? WHERE status = 'pending' AND expires_at < ?",
+                    (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), before)
+                )
+                expired = max(db.cursor.rowcount, 0)
+                db.commit()
+                # Only drop requests from the index once the database agrees they are closed
+                pending_crypto_requests.expire(before)
+                return expired
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in expire_crypto_payments: {e}")
+            finally:
+                db.close()
+        return 0
+
+    @staticmethod
+    def link_crypto_payment_record(payment_id: str):
+        """
+        The payments row recording a paid crypto request, created on first call
+        (method 'crypto', the plan's rial amount, the transaction hash as gateway_ref_id).
+        Its payment_id is what add_subscription applies at most once. Returns it, or None.
+        """
+        db = Database()
+        if db.connect():
+            try:
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                db.cursor.execute("BEGIN IMMEDIATE")
+                db.cursor.execute("SELECT * FROM crypto_payments WHERE payment_id = ?", (payment_id,))
+                request = db.fetchone()
+                if request is None or request['status'] != 'paid':
+                    db.conn.rollback()
+                    return None
+                if request['linked_payment_id']:
+                    db.conn.rollback()
+                    return request['linked_payment_id']
+                db.cursor.execute(
+                    """INSERT INTO payments
+                       (user_id, plan_id, amount, payment_date, payment_method, transaction_id, gateway_ref_id, description, status, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, 'crypto', ?, ?, ?, 'completed', ?, ?)""",
+                    (request['user_id'], request['plan_id'], request['rial_amount'], request['updated_at'] or now,
+                     payment_id, request['transaction_id'], f"USDT-TRC20 {request['usdt_amount_received']}", now, now)
+                )
+                linked_payment_id = db.cursor.lastrowid
+                db.cursor.execute(
+                    "UPDATE crypto_payments SET linked_payment_id = ? WHERE payment_id = ?", (linked_payment_id, payment_id)
+                )
+                db.commit()
+                return linked_payment_id
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in link_crypto_payment_record for {payment_id}: {e}")
+                if db.conn and db.conn.in_transaction:
+                    db.conn.rollback()
+            finally:
+                db.close()
+        return None
+
+    @staticmethod
+    def record_crypto_payment_activation(payment_id: str, subscription_id=None) -> bool:
+        """
+        Store the subscription a paid crypto request activated. Without one, only updated_at
+        is bumped so the failed activation is retried after a back-off.
+        """
+        db = Database()
+        if db.connect():
+            try:
+                db.cursor.execute(
+                    "UPDATE crypto_payments SET subscription_id = COALESCE(?, subscription_id), updated_at = ? WHERE payment_id = ?",
+                    (subscription_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), payment_id)
+                )
+                db.commit()
+                return db.cursor.rowcount > 0
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in record_crypto_payment_activation for {payment_id}: {e}")
+            finally:
+                db.close()
+        return False
+
+    @staticmethod
+    def get_unactivated_crypto_payments(updated_before: str, limit: int = 20) -> list:
+        """Paid crypto requests without a subscription yet, last attempted at or before *updated_before*."""
+        db = Database()
+        if db.connect():
+            try:
+                db.execute(
+                    """SELECT * FROM crypto_payments
+                       WHERE status = 'paid' AND subscription_id IS NULL AND updated_at <= ?
+                       ORDER BY updated_at, id LIMIT ?""",
+                    (updated_before, limit)
+                )
+                return [dict(row) for row in db.fetchall()]
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in get_unactivated_crypto_payments: {e}")
+            finally:
+                db.close()
+        return []
+
     @staticmethod
     def update_payment_transaction_id(payment_id: int, transaction_id: str, status: str = "pending_verification"):
         """
@@ -281,8 +522,8 @@ class DatabaseQueries:
         Args:
             authority: The Authority code provided by Zarinpal.
         Returns:
-            A dictionary containing payment details (payment_id, user_id, plan_id, amount, status)
-            if found, otherwise None.
+            A dictionary containing payment details (payment_id, user_id, plan_id, amount, status,
+            gateway_ref_id) if found, otherwise None.
         """
         db = Database()
         if db.connect():
@@ -290,7 +531,7 @@ class DatabaseQueries:
                 # Assuming 'transaction_id' stores the Zarinpal Authority and 'plan_id' column exists.
                 # Also assuming 'payments' table has 'payment_method' to distinguish zarinpal payments
                 db.execute(
-                    """SELECT p.payment_id, p.user_id, p.plan_id, p.amount, p.status
+                    """SELECT p.payment_id, p.user_id, p.plan_id, p.amount, p.status, p.gateway_ref_id
                        FROM payments p
                        WHERE p.transaction_id = ? AND p.payment_method = 'zarinpal'""",
                     (authority,)
@@ -346,34 +587,148 @@ class DatabaseQueries:
                 db.close()
         return False
 
-    # Plan-related queries
     @staticmethod
-    def get_active_plans():
-        """Get all active subscription plans, ordered by display_order."""
+    def claim_payment_completion(payment_id: int, gateway_ref_id: str = None):
+        """
+        Atomically mark a pending payment as completed.
+        Returns True only for the caller that moved it out of pending/pending_verification,
+        so exactly one verification path activates the subscription; False if it was
+        already settled; None on a database error (the payment is left pending).
+        """
         db = Database()
         if db.connect():
-            db.execute(
-                "SELECT id, name, description, price, original_price_irr, price_tether, original_price_usdt, days, features, display_order FROM plans WHERE is_active = 1 ORDER BY display_order ASC, id ASC"
-            )
-            result = db.fetchall()
-            db.close()
-            return result
+            try:
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                db.cursor.execute(
+                    """UPDATE payments
+                       SET status = 'completed', gateway_ref_id = COALESCE(?, gateway_ref_id), updated_at = ?
+                       WHERE payment_id = ? AND status IN ('pending', 'pending_verification')""",
+                    (gateway_ref_id, now, payment_id)
+                )
+                db.commit()
+                return db.cursor.rowcount > 0
+            except sqlite3.Error as e:
+                config.logger.error(f"Database error in claim_payment_completion for payment_id {payment_id}: {e}")
+                return None
+            finally:
+                db.close()
+        return None
+
+    @staticmethod
+    def expire_pending_payment(payment_id: int) -> bool:
+        """
+        Mark a payment expired only if it is still pending/pending_verification.
+        Returns False if it was completed (or otherwise settled) in the meantime.
+        """
+        db = Database()
+        if db.connect():
+            try:
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                db.execute(
+                    """UPDATE payments SET status = 'expired', updated_at = ?
+                       WHERE payment_id = ? AND status IN ('pending', 'pending_verification')""",
+                    (now, payment_id)
+                )
+                db.commit()
+                return db.cursor.rowcount > 0
+            except sqlite3.Error as e:
+                config.logger.error(f"Database error in expire_pending_payment for payment_id {payment_id}: {e}")
+                return False
+            finally:
+                db.close()
+        return False
+
+    @staticmethod
+    def get_stale_pending_zarinpal_payments(older_than: str, limit: int = 50) -> list:
+        """
+        Zarinpal payments still pending_verification whose last update (or creation)
+        is at or before *older_than*, oldest first.
+        """
+        db = Database()
+        if db.connect():
+            try:
+                db.execute(
+                    """SELECT payment_id, user_id, plan_id, amount, transaction_id, payment_date, updated_at
+                       FROM payments
+                       WHERE payment_method = 'zarinpal' AND status = 'pending_verification'
+                       AND transaction_id IS NOT NULL
+                       AND COALESCE(updated_at, payment_date) <= ?
+                       ORDER BY payment_id
+                       LIMIT ?""",
+                    (older_than, limit)
+                )
+                return [dict(row) for row in db.fetchall()]
+            except sqlite3.Error as e:
+                config.logger.error(f"Database error in get_stale_pending_zarinpal_payments: {e}")
+            finally:
+                db.close()
         return []
 
     @staticmethod
-    def get_plan_by_id(plan_id):
-        """Get plan details by its ID."""
+    def get_unactivated_zarinpal_payments(updated_before: str, limit: int = 50) -> list:
+        """
+        Completed Zarinpal payments not yet applied to a subscription (activation failed or
+        was interrupted), last updated at or before *updated_before*, oldest first.
+        Only payments completed since subscription_payments exists (migration 7) are considered;
+        earlier ones were applied before it could record them.
+        """
         db = Database()
         if db.connect():
-            db.execute(
-                "SELECT id, name, description, price, original_price_irr, price_tether, original_price_usdt, days, features, is_active, display_order FROM plans WHERE id = ?",
-                (plan_id,)
-            )
-            result = db.fetchone()
-            db.close()
-            return result
-        return None
+            try:
+                db.execute(
+                    """SELECT p.payment_id, p.user_id, p.plan_id, p.amount, p.transaction_id, p.gateway_ref_id, p.updated_at
+                       FROM payments p
+                       WHERE p.payment_method = 'zarinpal' AND p.status = 'completed'
+                       AND p.updated_at <= ?
+                       AND p.updated_at >= (SELECT applied_at FROM schema_version WHERE version = 7)
+                       AND NOT EXISTS (SELECT 1 FROM subscription_payments sp
+                                       WHERE sp.payment_id = p.payment_id AND sp.subscription_id IS NOT NULL)
+                       ORDER BY p.payment_id
+                       LIMIT ?""",
+                    (updated_before, limit)
+                )
+                return [dict(row) for row in db.fetchall()]
+            except sqlite3.Error as e:
+                config.logger.error(f"Database error in get_unactivated_zarinpal_payments: {e}")
+            finally:
+                db.close()
+        return []
+
+    @staticmethod
+    def touch_payments(payment_ids) -> bool:
+        """Set updated_at = now for *payment_ids* (one statement), e.g. after an unsuccessful check."""
+        payment_ids = list(payment_ids)
+        if not payment_ids:
+            return True
+        db = Database()
+        if db.connect():
+            try:
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                db.cursor.executemany("UPDATE payments SET updated_at = ? WHERE payment_id = ?", [(now, pid) for pid in payment_ids])
+                db.commit()
+                return True
+            except sqlite3.Error as e:
+                config.logger.error(f"Database error in touch_payments: {e}")
+            finally:
+                db.close()
+        return False
+
+    # Plan-related queries
+    @staticmethod
+    def get_active_plans():
+        """Get all active subscription plans, ordered by display_order (served from the plan catalog cache)."""
+        return plan_catalog.get_active_plans()
+
+    @staticmethod
+    def get_plan_by_id(plan_id):
+        """Get plan details by its ID (served from the plan catalog cache)."""
+        return plan_catalog.get_plan(plan_id)
     
+    @staticmethod
+    def invalidate_plan_cache():
+        """Call after any change to the plans table so both bots reload the catalog."""
+        plan_catalog.invalidate()
+
     # Subscription-related queries
     @staticmethod
     def get_all_active_subscribers():
@@ -445,6 +800,8 @@ class DatabaseQueries:
         Adds a new subscription or extends an existing active one for a user.
         If an active subscription exists, its end_date is extended.
         Otherwise, a new subscription record is created.
+        A payment_id is applied only once: repeated calls for the same payment
+        return the subscription it already activated without extending it again.
 
         Args:
             user_id: The ID of the user.
@@ -458,6 +815,99 @@ class DatabaseQueries:
         Returns:
             The ID of the created or updated subscription record, or None on failure.
         """
+        if payment_id is not None:
+            claimed, applied_subscription_id = DatabaseQueries._claim_subscription_payment(payment_id, user_id)
+            if not claimed:
+                config.logger.info(f"Payment {payment_id} was already applied to subscription {applied_subscription_id}; not extending again.")
+                return applied_subscription_id
+
+        subscription_id = DatabaseQueries._apply_subscription(
+            user_id, plan_id, payment_id, plan_duration_days, amount_paid, payment_method, status
+        )
+        if payment_id is not None:
+            DatabaseQueries._finish_subscription_payment(payment_id, subscription_id)
+        return subscription_id
+
+    @staticmethod
+    def _claim_subscription_payment(payment_id: int, user_id: int):
+        """
+        Reserve *payment_id* in subscription_payments.
+        Returns (True, None) for the caller that may activate it, otherwise (False, subscription_id
+        it activated), with None while another caller is still activating it.
+        A claim left unfinished for SUBSCRIPTION_CLAIM_STALE_SECONDS (a crash between claim and
+        finish) is taken over, unless a subscription already records the payment.
+        """
+        db = Database()
+        if not db.connect():
+            return False, None
+        try:
+            now = datetime.now()
+            now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+            db.cursor.execute(
+                "INSERT OR IGNORE INTO subscription_payments (payment_id, user_id, applied_at) VALUES (?, ?, ?)",
+                (payment_id, user_id, now_str)
+            )
+            db.commit()
+            if db.cursor.rowcount > 0:
+                return True, None
+            db.cursor.execute("SELECT subscription_id, applied_at FROM subscription_payments WHERE payment_id = ?", (payment_id,))
+            row = db.fetchone()
+            if row is None:
+                return False, None
+            stale_before = (now - timedelta(seconds=config.SUBSCRIPTION_CLAIM_STALE_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+            if row['subscription_id'] or str(row['applied_at']) > stale_before:
+                return False, row['subscription_id']
+
+            # Unfinished claim: the activation may have committed before the claim was finished
+            db.cursor.execute("SELECT id FROM subscriptions WHERE payment_id = ? ORDER BY id DESC LIMIT 1", (payment_id,))
+            applied = db.fetchone()
+            if applied:
+                db.cursor.execute(
+                    "UPDATE subscription_payments SET subscription_id = ? WHERE payment_id = ? AND subscription_id IS NULL",
+                    (applied['id'], payment_id)
+                )
+                db.commit()
+                return False, applied['id']
+            db.cursor.execute(
+                "UPDATE subscription_payments SET user_id = ?, applied_at = ? "
+                "WHERE payment_id = ? AND subscription_id IS NULL AND applied_at = ?",
+                (user_id, now_str, payment_id, row['applied_at'])
+            )
+            db.commit()
+            if db.cursor.rowcount > 0:
+                config.logger.warning(f"Retrying activation of payment {payment_id}: its claim from {row['applied_at']} was never finished.")
+                return True, None
+            return False, None
+        except sqlite3.Error as e:
+            config.logger.error(f"Database error in _claim_subscription_payment for payment_id {payment_id}: {e}")
+            return False, None
+        finally:
+            db.close()
+
+    @staticmethod
+    def _finish_subscription_payment(payment_id: int, subscription_id):
+        """Record the subscription a claimed payment activated, or release the claim if activation failed."""
+        db = Database()
+        if db.connect():
+            try:
+                if subscription_id:
+                    db.execute(
+                        "UPDATE subscription_payments SET subscription_id = ? WHERE payment_id = ?",
+                        (subscription_id, payment_id)
+                    )
+                else:
+                    db.execute("DELETE FROM subscription_payments WHERE payment_id = ?", (payment_id,))
+                db.commit()
+            except sqlite3.Error as e:
+                config.logger.error(f"Database error in _finish_subscription_payment for payment_id {payment_id}: {e}")
+            finally:
+                db.close()
+
+    @staticmethod
+    def _apply_subscription(user_id: int, plan_id: int, payment_id: int,
+                            plan_duration_days: int, amount_paid: float,
+                            payment_method: str, status: str = 'active'):
+        """Create or extend the subscription; see add_subscription."""
         db = Database()
         if not db.connect():
             print(f"Failed to connect to database in add_subscription for user {user_id}")
@@ -499,6 +949,8 @@ class DatabaseQueries:
                     status=status
                 ):
                     print(f"DEBUG: Successfully updated subscription {current_active_sub['id']}")
+                    authorized_members.invalidate_user(user_id)
+                    DatabaseQueries.clear_membership_removals(user_id)
                     return current_active_sub['id']
                 else:
                     print(f"Failed to update existing subscription for user {user_id}.")
@@ -524,6 +976,8 @@ class DatabaseQueries:
                 
                 db.commit()
                 print(f"DEBUG: Committed transaction for subscription {subscription_id}")
+                authorized_members.invalidate_user(user_id)
+                DatabaseQueries.clear_membership_removals(user_id)
                 
                 return subscription_id
         except sqlite3.Error as e:
@@ -596,6 +1050,7 @@ class DatabaseQueries:
             try:
                 db.execute("UPDATE plans SET is_active = 0 WHERE id = ?", (plan_id,))
                 db.commit()
+                plan_catalog.invalidate()
                 return db.cursor.rowcount > 0
             except sqlite3.Error as e:
                 logging.error(f"SQLite error in deactivate_plan: {e}")
@@ -606,54 +1061,19 @@ class DatabaseQueries:
 
     @staticmethod
     def get_plan_by_id(plan_id: int):
-        """Fetch a plan row by its ID."""
-        db = Database()
-        if db.connect():
-            try:
-                db.execute("SELECT * FROM plans WHERE id = ?", (plan_id,))
-                return db.fetchone()
-            except sqlite3.Error as e:
-                logging.error(f"SQLite error in get_plan_by_id: {e}")
-                return None
-            finally:
-                db.close()
-        return None
+        """Fetch a plan row by its ID (served from the plan catalog cache)."""
+        return plan_catalog.get_plan(plan_id)
 
     # Backwards compatibility alias
     @staticmethod
     def get_plan(plan_id: int):
         return DatabaseQueries.get_plan_by_id(plan_id)
 
-    @staticmethod
     # ---- User Subscription Summary Helpers ----
-    @staticmethod
-    def _ensure_user_summary_columns():
-        """Ensures that `users` table has the summary columns. If not, add them with ALTER TABLE."""
-        db = Database()
-        if not db.connect():
-            return False
-        try:
-            db.execute("PRAGMA table_info(users)")
-            cols = [row['name'] for row in db.fetchall()]
-            needed = []
-            if 'total_subscription_days' not in cols:
-                needed.append("ALTER TABLE users ADD COLUMN total_subscription_days INTEGER DEFAULT 0")
-            if 'subscription_expiration_date' not in cols:
-                needed.append("ALTER TABLE users ADD COLUMN subscription_expiration_date TEXT")
-            for stmt in needed:
-                db.execute(stmt)
-            if needed:
-                db.commit()
-        except sqlite3.Error as e:
-            logging.error(f"SQLite error ensuring user summary columns: {e}")
-        finally:
-            db.close()
-        return True
-
+    # The summary columns are added by schema migration 2 (see database/schema.py).
     @staticmethod
     def get_user_subscription_summary(user_id: int):
         """Return total days and expiration date for a user from `users` table (may return None)."""
-        DatabaseQueries._ensure_user_summary_columns()
         db = Database()
         if db.connect():
             try:
@@ -669,7 +1089,6 @@ class DatabaseQueries:
     @staticmethod
     def update_user_subscription_summary(user_id: int, total_days: int, expiration_date: str) -> bool:
         """Update summary columns for user."""
-        DatabaseQueries._ensure_user_summary_columns()
         db = Database()
         if db.connect():
             try:
@@ -928,17 +1347,8 @@ class DatabaseQueries:
     
     @staticmethod
     def get_plan(plan_id):
-        """Get plan details"""
-        db = Database()
-        if db.connect():
-            db.execute(
-                "SELECT * FROM plans WHERE id = ?",
-                (plan_id,)
-            )
-            result = db.fetchone()
-            db.close()
-            return result
-        return None
+        """Get plan details (served from the plan catalog cache)"""
+        return plan_catalog.get_plan(plan_id)
     
     # Support ticket queries
     @staticmethod
@@ -1075,6 +1485,7 @@ class DatabaseQueries:
                     (plan_id,)
                 )
                 db.commit()
+                plan_catalog.invalidate()
                 return True
             finally:
                 db.close()
@@ -1114,7 +1525,7 @@ class DatabaseQueries:
                 # Fetch users whose subscription status is already non-active OR whose active subscription has expired.
                 now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 # First, mark any expired active subscriptions as 'inactive' so downstream logic stays simple
-                db.execute("UPDATE subscriptions SET status = 'inactive' WHERE status = 'active' AND end_date <= ?", (now,))
+                db.execute("UPDATE subscriptions SET status = 'inactive', updated_at = ? WHERE status = 'active' AND end_date <= ?", (now, now))
                 db.commit()
                 query = """
                     SELECT DISTINCT user_id,
@@ -1145,6 +1556,337 @@ class DatabaseQueries:
                 db.close()
         return users
 
+    @staticmethod
+    def get_newly_inactive_subscription_users(since: str):
+        """Users whose subscription lapsed or left the 'active' status after *since*.
+
+        Incremental counterpart of get_users_with_non_active_subscription_records():
+        covers subscriptions whose end_date passed in (since, now] and non-active
+        subscriptions updated after *since*. Returns a list of {'user_id', 'status'}.
+        """
+        db = Database()
+        users = []
+        if db.connect():
+            try:
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                db.execute(
+                    """SELECT user_id, 'inactive' AS status FROM subscriptions
+                       WHERE end_date > ? AND end_date <= ?
+                       UNION
+                       SELECT user_id, status FROM subscriptions
+                       WHERE updated_at > ? AND status IS NOT NULL AND status != '' AND status != 'active'""",
+                    (since, now, since)
+                )
+                seen = set()
+                for row in db.fetchall():
+                    if row[0] not in seen:
+                        seen.add(row[0])
+                        users.append({'user_id': row[0], 'status': row[1]})
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in get_newly_inactive_subscription_users: {e}")
+            finally:
+                db.close()
+        return users
+
+    @staticmethod
+    def get_sync_watermark(name: str):
+        """Return the stored watermark value for *name*, or None if never set."""
+        db = Database()
+        if db.connect():
+            try:
+                db.cursor.execute("SELECT value FROM sync_watermarks WHERE name = ?", (name,))
+                row = db.fetchone()
+                return row[0] if row else None
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in get_sync_watermark: {e}")
+            finally:
+                db.close()
+        return None
+
+    @staticmethod
+    def set_sync_watermark(name: str, value: str) -> bool:
+        db = Database()
+        if db.connect():
+            try:
+                db.cursor.execute(
+                    "INSERT OR REPLACE INTO sync_watermarks (name, value, updated_at) VALUES (?, ?, ?)",
+                    (name, value, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                )
+                db.commit()
+                return True
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in set_sync_watermark: {e}")
+            finally:
+                db.close()
+        return False
+
+    @staticmethod
+    def get_removed_member_ids(channel_id: int) -> set:
+        """User ids already removed from (or absent in) *channel_id* according to the removal ledger."""
+        db = Database()
+        if db.connect():
+            try:
+                db.cursor.execute("SELECT user_id FROM membership_removals WHERE channel_id = ?", (channel_id,))
+                return {row[0] for row in db.fetchall()}
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in get_removed_member_ids: {e}")
+            finally:
+                db.close()
+        return set()
+
+    @staticmethod
+    def record_membership_removals(channel_id: int, user_ids) -> bool:
+        """Add users to the removal ledger for *channel_id* (one transaction)."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return True
+        db = Database()
+        if db.connect():
+            try:
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                db.cursor.executemany(
+                    "INSERT OR REPLACE INTO membership_removals (user_id, channel_id, removed_at) VALUES (?, ?, ?)",
+                    [(user_id, channel_id, now) for user_id in user_ids]
+                )
+                db.commit()
+                return True
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in record_membership_removals: {e}")
+            finally:
+                db.close()
+        return False
+
+    @staticmethod
+    def clear_membership_removals(user_id: int) -> bool:
+        """Forget a user's removals (e.g. after a new subscription) so later expiries are handled again."""
+        db = Database()
+        if db.connect():
+            try:
+                db.cursor.execute("DELETE FROM membership_removals WHERE user_id = ?", (user_id,))
+                db.commit()
+                return True
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in clear_membership_removals: {e}")
+            finally:
+                db.close()
+        return False
+
+    @staticmethod
+    def update_channel_roster(channel_id: int, statuses: dict) -> bool:
+        """Upsert {user_id: status} into the roster of *channel_id* (one transaction)."""
+        if not statuses:
+            return True
+        db = Database()
+        if db.connect():
+            try:
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                db.cursor.executemany(
+                    "INSERT OR REPLACE INTO channel_roster (channel_id, user_id, status, updated_at) VALUES (?, ?, ?, ?)",
+                    [(channel_id, user_id, status, now) for user_id, status in statuses.items()]
+                )
+                db.commit()
+                return True
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in update_channel_roster: {e}")
+            finally:
+                db.close()
+        return False
+
+    @staticmethod
+    def get_channel_roster(channel_id: int, updated_after: str) -> dict:
+        """Return {user_id: status} for roster rows of *channel_id* updated after *updated_after*."""
+        db = Database()
+        if db.connect():
+            try:
+                db.execute(
+                    "SELECT user_id, status FROM channel_roster WHERE channel_id = ? AND updated_at > ?",
+                    (channel_id, updated_after)
+                )
+                return {row[0]: row[1] for row in db.fetchall()}
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in get_channel_roster: {e}")
+            finally:
+                db.close()
+        return {}
+
+    # --- Admin broadcasts ---
+    @staticmethod
+    def _broadcast_target_query(segment: str, segment_arg=None):
+        """Return (sql, params) selecting the user_ids of a broadcast segment after a cursor.
+
+        The SQL has two trailing placeholders left for the caller: the user_id cursor
+        is the first parameter and LIMIT is the last one, so pages are walked in
+        user_id order without loading the whole segment.
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Users who blocked the bot are skipped until they are active again
+        not_blocked = ("NOT EXISTS (SELECT 1 FROM bot_blocked_users b WHERE b.user_id = u.user_id "
+                       "AND b.blocked_at >= COALESCE(u.last_activity, ''))")
+        if segment == 'all':
+            sql = f"SELECT u.user_id FROM users u WHERE u.user_id > ? AND {not_blocked} ORDER BY u.user_id LIMIT ?"
+            return sql, []
+        if segment not in ('active', 'expiring'):
+            raise ValueError(f"Unknown broadcast segment: {segment}")
+
+        conditions = ["s.status = 'active'", "s.user_id > ?", not_blocked]
+        params = []
+        having = "MAX(s.end_date) > ?"
+        having_params = [now]
+        if segment == 'active' and segment_arg:
+            conditions.append("s.plan_id = ?")
+            params.append(int(segment_arg))
+        elif segment == 'expiring':
+            until = (datetime.now() + timedelta(days=int(segment_arg or 7))).strftime("%Y-%m-%d %H:%M:%S")
+            having += " AND MAX(s.end_date) <= ?"
+            having_params.append(until)
+        sql = (
+            "SELECT s.user_id FROM subscriptions s JOIN users u ON u.user_id = s.user_id "
+            f"WHERE {' AND '.join(conditions)} "
+            f"GROUP BY s.user_id HAVING {having} ORDER BY s.user_id LIMIT ?"
+        )
+        return sql, params + having_params
+
+    @staticmethod
+    def get_broadcast_targets(segment: str, segment_arg=None, after_user_id: int = 0, limit: int = 500) -> list:
+        """One page of recipient user_ids (ascending) with user_id > after_user_id."""
+        sql, params = DatabaseQueries._broadcast_target_query(segment, segment_arg)
+        db = Database()
+        if db.connect():
+            try:
+                db.execute(sql, [after_user_id] + params + [limit])
+                return [row[0] for row in db.fetchall()]
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in get_broadcast_targets: {e}")
+            finally:
+                db.close()
+        return []
+
+    @staticmethod
+    def count_broadcast_targets(segment: str, segment_arg=None) -> int:
+        sql, params = DatabaseQueries._broadcast_target_query(segment, segment_arg)
+        db = Database()
+        if db.connect():
+            try:
+                db.execute(f"SELECT COUNT(*) FROM ({sql})", [0] + params + [-1])
+                return db.fetchone()[0]
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in count_broadcast_targets: {e}")
+            finally:
+                db.close()
+        return 0
+
+    @staticmethod
+    def create_broadcast(admin_id: int, segment: str, segment_arg, message_text: str, total_count: int = 0):
+        """Create a running broadcast job. Returns its id or None."""
+        db = Database()
+        if db.connect():
+            try:
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                db.execute(
+                    "INSERT INTO broadcasts (admin_id, segment, segment_arg, message_text, status, total_count, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'running', ?, ?, ?)",
+                    (admin_id, segment, segment_arg, message_text, total_count, now, now)
+                )
+                db.commit()
+                return db.cursor.lastrowid
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in create_broadcast: {e}")
+            finally:
+                db.close()
+        return None
+
+    @staticmethod
+    def get_broadcast(broadcast_id: int):
+        db = Database()
+        if db.connect():
+            try:
+                db.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+                row = db.fetchone()
+                return dict(row) if row else None
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in get_broadcast: {e}")
+            finally:
+                db.close()
+        return None
+
+    @staticmethod
+    def get_broadcasts_by_status(status: str = 'running') -> list:
+        db = Database()
+        if db.connect():
+            try:
+                db.execute("SELECT * FROM broadcasts WHERE status = ? ORDER BY id", (status,))
+                return [dict(row) for row in db.fetchall()]
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in get_broadcasts_by_status: {e}")
+            finally:
+                db.close()
+        return []
+
+    @staticmethod
+    def checkpoint_broadcast(broadcast_id: int, last_user_id: int, sent: int, failed: int, blocked_user_ids=()) -> bool:
+        """Record one delivered page: counters, cursor and newly blocked users in one transaction."""
+        blocked_user_ids = list(blocked_user_ids)
+        db = Database()
+        if db.connect():
+            try:
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                if blocked_user_ids:
+                    db.cursor.executemany(
+                        "INSERT OR REPLACE INTO bot_blocked_users (user_id, blocked_at, reason) VALUES (?, ?, 'broadcast')",
+                        [(user_id, now) for user_id in blocked_user_ids]
+                    )
+                db.cursor.execute(
+                    "UPDATE broadcasts SET last_user_id = ?, sent_count = sent_count + ?, failed_count = failed_count + ?, "
+                    "blocked_count = blocked_count + ?, updated_at = ? WHERE id = ?",
+                    (last_user_id, sent, failed, len(blocked_user_ids), now, broadcast_id)
+                )
+                db.commit()
+                return True
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in checkpoint_broadcast: {e}")
+                if db.conn:
+                    db.conn.rollback()
+            finally:
+                db.close()
+        return False
+
+    @staticmethod
+    def set_broadcast_status(broadcast_id: int, status: str) -> bool:
+        """Set a broadcast's status; 'completed' and 'cancelled' also stamp finished_at."""
+        db = Database()
+        if db.connect():
+            try:
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                finished_at = now if status in ('completed', 'cancelled') else None
+                db.execute(
+                    "UPDATE broadcasts SET status = ?, updated_at = ?, finished_at = COALESCE(?, finished_at) WHERE id = ?",
+                    (status, now, finished_at, broadcast_id)
+                )
+                db.commit()
+                return db.cursor.rowcount > 0
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in set_broadcast_status: {e}")
+            finally:
+                db.close()
+        return False
+
+    @staticmethod
+    def set_broadcast_progress_message(broadcast_id: int, chat_id: int, message_id: int) -> bool:
+        db = Database()
+        if db.connect():
+            try:
+                db.execute(
+                    "UPDATE broadcasts SET progress_chat_id = ?, progress_message_id = ? WHERE id = ?",
+                    (chat_id, message_id, broadcast_id)
+                )
+                db.commit()
+                return True
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in set_broadcast_progress_message: {e}")
+            finally:
+                db.close()
+        return False
+
     @staticmethod
     def mark_expired_active_subscriptions():
         """Set status='inactive' for active subscriptions whose end_date has passed. Returns number of rows changed."""
@@ -1154,8 +1896,8 @@ class DatabaseQueries:
             try:
                 now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 db.execute(
-                    "UPDATE subscriptions SET status = 'inactive' WHERE status = 'active' AND end_date <= ?",
-                    (now,)
+                    "UPDATE subscriptions SET status = 'inactive', updated_at = ? WHERE status = 'active' AND end_date <= ?",
+                    (now, now)
                 )
                 if hasattr(db.cursor, 'rowcount'):
                     rows_updated = db.cursor.rowcount
@@ -1181,6 +1923,7 @@ class DatabaseQueries:
                     (user_id, reason, now)
                 )
                 db.commit()
+                authorized_members.invalidate_user(user_id)
                 return True
             except sqlite3.Error as e:
                 print(f"SQLite error in add_banned_user: {e}")
@@ -1197,6 +1940,7 @@ class DatabaseQueries:
             try:
                 db.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,))
                 db.commit()
+                authorized_members.invalidate_user(user_id)
                 return True
             except sqlite3.Error as e:
                 print(f"SQLite error in remove_banned_user: {e}")
@@ -1207,94 +1951,40 @@ class DatabaseQueries:
         return False
 
     @staticmethod
-    def is_user_banned(user_id: int) -> bool:
-        db = Database()
-        if db.connect():
-            db.execute("SELECT 1 FROM banned_users WHERE user_id = ? LIMIT 1", (user_id,))
-            result = db.fetchone()
-            db.close()
-            return result is not None
-        return False
+    def is_user_authorized(user_id: int) -> bool:
+        """True if the user is not banned and has an unexpired active subscription (in-memory index)."""
+        return authorized_members.is_authorized(user_id)
 
     @staticmethod
-    def get_active_subscriptions_expiring_within(days: int = 5):
-        """
-        Get active subscriptions that will expire within the next 5 days.
-        Returns list of dictionaries with user_id and days_left.
-        """
-        db = Database()
-        if db.connect():
-            try:
-                now = datetime.now()
-                end_date = (now + timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
-                query = """
-                    SELECT s.user_id, 
-                           s.end_date,
-                           julianday(s.end_date) - julianday('now') as days_left
-                    FROM subscriptions s
-                    WHERE s.status = 'active' 
-                    AND s.end_date > ?
-                    AND s.end_date <= ?
-                    AND julianday(s.end_date) - julianday('now') BETWEEN 1 AND ?
-                """
-                db.execute(query, (
-                    now.strftime("%Y-%m-%d %H:%M:%S"), 
-                    end_date,
-                    days
-                ))
-                results = db.fetchall()
-                
-                # Convert results to list of dictionaries
-                expiring_subscriptions = []
-                for row in results:
-                    expiring_subscriptions.append({
-                        'user_id': row[0],
-                        'end_date': row[1],
-                        'days_left': int(row[2])
-                    })
-                
-                return expiring_subscriptions
-            except sqlite3.Error as e:
-                print(f"SQLite error in get_active_subscriptions_expiring_within: {e}")
-            finally:
-                db.close()
-        return []
-        """
-        Get active subscriptions that will expire within the specified number of days.
-        Returns list of dictionaries with user_id and days_left.
+    def reconcile_authorized_members() -> bool:
+        """Rebuild the authorized member index from the database."""
+        return authorized_members.reconcile()
+
+    @staticmethod
+    def get_subscription_expiries_until(until: str):
+        """Users whose latest active subscription ends between now and *until*.
+
+        Returns a list of dicts with user_id and end_date ("YYYY-MM-DD HH:MM:SS").
         """
         db = Database()
+        expiries = []
         if db.connect():
             try:
-                now = datetime.now()
-                end_date = (now + timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
-                query = """
-                    SELECT s.user_id, 
-                           s.end_date,
-                           julianday(s.end_date) - julianday('now') as days_left
-                    FROM subscriptions s
-                    WHERE s.status = 'active' 
-                    AND s.end_date > ?
-                    AND s.end_date <= ?
-                """
-                db.execute(query, (now.strftime("%Y-%m-%d %H:%M:%S"), end_date))
-                results = db.fetchall()
-                
-                # Convert results to list of dictionaries
-                expiring_subscriptions = []
-                for row in results:
-                    expiring_subscriptions.append({
-                        'user_id': row[0],
-                        'end_date': row[1],
-                        'days_left': int(row[2])
-                    })
-                
-                return expiring_subscriptions
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                db.execute(
+                    """SELECT user_id, MAX(end_date) AS end_date
+                       FROM subscriptions
+                       WHERE status = 'active'
+                       GROUP BY user_id
+                       HAVING MAX(end_date) > ? AND MAX(end_date) <= ?""",
+                    (now, until)
+                )
+                expiries = [{'user_id': row[0], 'end_date': row[1]} for row in db.fetchall()]
             except sqlite3.Error as e:
-                print(f"SQLite error in get_active_subscriptions_expiring_within: {e}")
+                config.logger.error(f"SQLite error in get_subscription_expiries_until: {e}")
             finally:
                 db.close()
-        return []
+        return expiries
 
     @staticmethod
     def add_notification(user_id: int, notification_type: str, message: str = None):
@@ -1331,10 +2021,12 @@ class DatabaseQueries:
                     FROM notifications 
                     WHERE user_id = ? 
                     AND type = ? 
-                    AND date(sent_date) = ?
+                    AND sent_date >= ? AND sent_date < date(?, '+1 day')
                     LIMIT 1
                 """
-                db.execute(query, (user_id, notification_type, date))
+                # Range on sent_date (instead of date(sent_date) = ?) so the
+                # (user_id, type, sent_date) index covers the whole predicate
+                db.execute(query, (user_id, notification_type, date, date))
                 result = db.fetchone()
                 return result is not None
             except sqlite3.Error as e:
@@ -1343,6 +2035,81 @@ class DatabaseQueries:
                 db.close()
         return False
 
+    @staticmethod
+    def get_pending_expiration_reminders(days: int = 5):
+        """
+        Get the expiration reminders still to be sent today, in one query.
+        Expiring active subscriptions are joined to users and anti-joined to the
+        'expiration_reminder_<days_left>' notifications already sent today.
+        Returns list of dictionaries with user_id, days_left and full_name.
+        """
+        reminders = []
+        db = Database()
+        if db.connect():
+            try:
+                now = datetime.now()
+                today = now.strftime("%Y-%m-%d")
+                tomorrow = (now + timedelta(days=1)).strftime("%Y-%m-%d")
+                query = """
+                    SELECT e.user_id, e.days_left, u.full_name
+                    FROM (
+                        SELECT DISTINCT s.user_id,
+                               CAST(julianday(s.end_date) - julianday(?) AS INTEGER) AS days_left
+                        FROM subscriptions s
+                        WHERE s.status = 'active'
+                        AND s.end_date > ?
+                        AND s.end_date <= ?
+                    ) e
+                    LEFT JOIN users u ON u.user_id = e.user_id
+                    WHERE e.days_left BETWEEN 1 AND ?
+                    AND NOT EXISTS (
+                        SELECT 1 FROM notifications n
+                        WHERE n.user_id = e.user_id
+                        AND n.type = 'expiration_reminder_' || e.days_left
+                        AND n.sent_date >= ? AND n.sent_date < ?
+                    )
+                    ORDER BY e.user_id
+                """
+                now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+                until = (now + timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+                db.execute(query, (now_str, now_str, until, days, today, tomorrow))
+                reminders = [
+                    {'user_id': row[0], 'days_left': row[1], 'full_name': row[2]}
+                    for row in db.fetchall()
+                ]
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in get_pending_expiration_reminders: {e}")
+            finally:
+                db.close()
+        return reminders
+
+    @staticmethod
+    def add_notifications(notifications):
+        """
+        Record many notifications in one transaction.
+        notifications: iterable of (user_id, notification_type, message) tuples.
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [(user_id, notification_type, message or '', now) for user_id, notification_type, message in notifications]
+        if not rows:
+            return True
+        db = Database()
+        if db.connect():
+            try:
+                db.cursor.executemany(
+                    "INSERT INTO notifications (user_id, type, content, sent_date) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                db.commit()
+                return True
+            except sqlite3.Error as e:
+                config.logger.error(f"SQLite error in add_notifications: {e}")
+                if db.conn:
+                    db.conn.rollback()
+            finally:
+                db.close()
+        return False
+
     @staticmethod
     def get_all_banned_users():
         db = Database()
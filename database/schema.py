@@ -131,7 +131,7 @@ CREATE TABLE IF NOT EXISTS crypto_payments (
     usdt_amount_received REAL, -- Actual USDT amount confirmed on blockchain
     wallet_address TEXT NOT NULL, -- The wallet address payment was requested to
     transaction_id TEXT UNIQUE, -- Blockchain transaction ID, initially NULL
-    status TEXT NOT NULL DEFAULT 'pending', -- e.g., pending, paid, expired, failed, error, underpaid, overpaid
+    status TEXT NOT NULL DEFAULT 'pending', -- e.g., pending, paid, expired, needs_review, failed, error, underpaid, overpaid
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Tracks the last status update
     expires_at TIMESTAMP NOT NULL, -- When this payment request becomes invalid
@@ -175,3 +175,183 @@ ALL_TABLES = [
     CRYPTO_PAYMENTS_TABLE,
     USER_ACTIVITY_LOGS_TABLE
 ]
+
+# --- Versioned migrations ---
+# Applied once, in order, by DatabaseQueries.init_database(). The highest applied
+# version is recorded in schema_version; never edit a released step, append a new one.
+SCHEMA_VERSION_TABLE = '''
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT,
+    applied_at TEXT NOT NULL
+)
+'''
+
+# Indexes for the hot lookup paths:
+#   get_user_active_subscription  -> subscriptions(user_id, status, end_date)
+#   get_payment_by_authority      -> payments(transaction_id, payment_method)
+#   get_notifications             -> notifications(user_id, type, sent_date)
+#   get_ticket_messages           -> ticket_messages(ticket_id, timestamp)
+HOT_PATH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_subscriptions_user_status_end ON subscriptions (user_id, status, end_date)",
+    "CREATE INDEX IF NOT EXISTS idx_payments_transaction_method ON payments (transaction_id, payment_method)",
+    "CREATE INDEX IF NOT EXISTS idx_notifications_user_type_sent ON notifications (user_id, type, sent_date)",
+    "CREATE INDEX IF NOT EXISTS idx_ticket_messages_ticket_timestamp ON ticket_messages (ticket_id, timestamp)",
+]
+
+
+
+def add_user_summary_columns(cursor):
+    """Add users.total_subscription_days / subscription_expiration_date if missing.
+
+    Older databases may already have them (they used to be added lazily at query time).
+    """
+    cursor.execute("PRAGMA table_info(users)")
+    cols = [row[1] for row in cursor.fetchall()]
+    if 'total_subscription_days' not in cols:
+        cursor.execute("ALTER TABLE users ADD COLUMN total_subscription_days INTEGER DEFAULT 0")
+    if 'subscription_expiration_date' not in cols:
+        cursor.execute("ALTER TABLE users ADD COLUMN subscription_expiration_date TEXT")
+
+
+# Incremental membership validation: a ledger of users already removed from each
+# channel and named watermarks for "changed since the last successful pass" feeds.
+MEMBERSHIP_REMOVALS_TABLE = '''
+CREATE TABLE IF NOT EXISTS membership_removals (
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    removed_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, channel_id)
+)
+'''
+
+SYNC_WATERMARKS_TABLE = '''
+CREATE TABLE IF NOT EXISTS sync_watermarks (
+    name TEXT PRIMARY KEY,
+    value TEXT,
+    updated_at TEXT
+)
+'''
+
+INCREMENTAL_MEMBERSHIP_STEPS = [
+    MEMBERSHIP_REMOVALS_TABLE,
+    SYNC_WATERMARKS_TABLE,
+    "CREATE INDEX IF NOT EXISTS idx_membership_removals_channel ON membership_removals (channel_id)",
+    "CREATE INDEX IF NOT EXISTS idx_subscriptions_end_date ON subscriptions (end_date)",
+    "CREATE INDEX IF NOT EXISTS idx_subscriptions_updated_at ON subscriptions (updated_at)",
+]
+
+# Last known membership status per channel, fed by chat_member updates and by
+# get_chat_member lookups. Validation only asks Telegram when a row is stale.
+CHANNEL_ROSTER_TABLE = '''
+CREATE TABLE IF NOT EXISTS channel_roster (
+    channel_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL, -- ChatMember status: creator, administrator, member, restricted, left, kicked
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (channel_id, user_id)
+)
+'''
+
+# Admin broadcasts. Recipients are walked in user_id order and last_user_id is the
+# checkpoint, so a job resumes where it stopped after a restart.
+BROADCASTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    admin_id INTEGER NOT NULL,
+    segment TEXT NOT NULL, -- all, active, expiring
+    segment_arg INTEGER, -- plan_id for 'active', days for 'expiring'
+    message_text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running', -- running, completed, cancelled
+    total_count INTEGER DEFAULT 0,
+    sent_count INTEGER DEFAULT 0,
+    failed_count INTEGER DEFAULT 0,
+    blocked_count INTEGER DEFAULT 0,
+    last_user_id INTEGER DEFAULT 0,
+    progress_chat_id INTEGER,
+    progress_message_id INTEGER,
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    finished_at TEXT
+)
+'''
+
+# Users for whom the main bot got Forbidden (blocked / deactivated). Skipped by
+# broadcasts unless they have been active again since blocked_at.
+BOT_BLOCKED_USERS_TABLE = '''
+CREATE TABLE IF NOT EXISTS bot_blocked_users (
+    user_id INTEGER PRIMARY KEY,
+    blocked_at TEXT NOT NULL,
+    reason TEXT
+)
+'''
+
+BROADCAST_STEPS = [
+    BROADCASTS_TABLE,
+    BOT_BLOCKED_USERS_TABLE,
+    "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)",
+    "CREATE INDEX IF NOT EXISTS idx_subscriptions_status_user ON subscriptions (status, user_id)",
+]
+
+# Background Zarinpal reconciliation scans pending_verification payments by age
+PAYMENT_RECONCILE_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_payments_method_status_updated "
+    "ON payments (payment_method, status, updated_at)"
+)
+
+# One row per payment that activated or extended a subscription; the primary key
+# guarantees a payment_id is applied only once, however many times it is verified
+SUBSCRIPTION_PAYMENTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS subscription_payments (
+    payment_id INTEGER PRIMARY KEY,
+    subscription_id INTEGER,     -- NULL while the subscription is being activated
+    user_id INTEGER,
+    applied_at TEXT NOT NULL,
+    FOREIGN KEY (payment_id) REFERENCES payments (payment_id),
+    FOREIGN KEY (subscription_id) REFERENCES subscriptions (id)
+)
+'''
+
+SUBSCRIPTION_PAYMENTS_STEPS = [
+    SUBSCRIPTION_PAYMENTS_TABLE,
+    # Payments already recorded on subscriptions count as applied
+    "INSERT OR IGNORE INTO subscription_payments (payment_id, subscription_id, user_id, applied_at) "
+    "SELECT payment_id, id, user_id, COALESCE(updated_at, created_at, start_date, CURRENT_TIMESTAMP) "
+    "FROM subscriptions WHERE payment_id IS NOT NULL",
+]
+
+def add_crypto_payment_plan_column(cursor):
+    """Link crypto payment requests to the plan they activate once paid."""
+    cursor.execute("PRAGMA table_info(crypto_payments)")
+    cols = [row[1] for row in cursor.fetchall()]
+    if 'plan_id' not in cols:
+        cursor.execute("ALTER TABLE crypto_payments ADD COLUMN plan_id INTEGER REFERENCES plans (id)")
+
+def add_crypto_payment_activation_columns(cursor):
+    """Link paid crypto requests to their payments row and to the subscription they activated."""
+    cursor.execute("PRAGMA table_info(crypto_payments)")
+    cols = [row[1] for row in cursor.fetchall()]
+    if 'linked_payment_id' not in cols:
+        cursor.execute("ALTER TABLE crypto_payments ADD COLUMN linked_payment_id INTEGER REFERENCES payments (payment_id)")
+    if 'subscription_id' not in cols:
+        cursor.execute("ALTER TABLE crypto_payments ADD COLUMN subscription_id INTEGER REFERENCES subscriptions (id)")
+
+# Loading pending crypto requests (and amount lookups on the table) by status and amount
+CRYPTO_PENDING_AMOUNT_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_crypto_payments_status_amount_expires "
+    "ON crypto_payments (status, usdt_amount_requested, expires_at)"
+)
+
+# (version, description, steps) - a step is an SQL string or a callable taking a cursor
+MIGRATIONS = [
+    (1, "Indexes for hot query predicates", HOT_PATH_INDEXES),
+    (2, "User subscription summary columns", [add_user_summary_columns]),
+    (3, "Membership removal ledger and sync watermarks", INCREMENTAL_MEMBERSHIP_STEPS),
+    (4, "Channel roster", [CHANNEL_ROSTER_TABLE]),
+    (5, "Admin broadcasts and blocked bot users", BROADCAST_STEPS),
+    (6, "Index for Zarinpal payment reconciliation", [PAYMENT_RECONCILE_INDEX]),
+    (7, "Apply each payment to a subscription at most once", SUBSCRIPTION_PAYMENTS_STEPS),
+    (8, "Plan link for crypto payment requests", [add_crypto_payment_plan_column]),
+    (9, "Index pending crypto payments by amount", [CRYPTO_PENDING_AMOUNT_INDEX]),
+    (10, "Payment record and activation state for crypto payments", [add_crypto_payment_activation_columns]),
+]
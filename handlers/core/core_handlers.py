@@ -11,7 +11,9 @@ from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboard
 from telegram.constants import ParseMode
 
 from database.queries import DatabaseQueries # Assuming direct import is fine
-from services.zarinpal_service import ZarinpalPaymentService
+from database.async_queries import AsyncDatabaseQueries
+from services.zarinpal_service import zarinpal_gateway
+from services.zarinpal_reconciler import activate_zarinpal_payment, complete_verified_payment
 from utils.keyboards import get_main_menu_keyboard, get_main_reply_keyboard
 from utils.constants.all_constants import (
     TEXT_BACK_TO_MAIN_MENU, CALLBACK_BACK_TO_MAIN_MENU,
@@ -24,6 +26,8 @@ from utils.constants.all_constants import (
     ZARINPAL_PAYMENT_VERIFIED_SUCCESS_PLAN_NOT_FOUND_MESSAGE_USER,
     ZARINPAL_PAYMENT_VERIFICATION_FAILED_MESSAGE_USER,
     ZARINPAL_PAYMENT_CANCELLED_MESSAGE_USER,
+    ZARINPAL_GATEWAY_UNAVAILABLE_MESSAGE_USER,
+    ZARINPAL_PAYMENT_COMPLETION_DB_ERROR_MESSAGE_USER,
     GENERAL_ERROR_MESSAGE_USER,
     WELCOME_MESSAGE, HELP_MESSAGE, RULES_MESSAGE, TEXT_MAIN_MENU_BUY_SUBSCRIPTION, SUBSCRIPTION_PLANS_MESSAGE,
     ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_ALREADY_VERIFIED_STATUS,
@@ -55,7 +59,7 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text(GENERAL_ERROR_MESSAGE_USER)
                 processed_payment_callback = True # Prevent further default start logic for this case
             else:
-                payment_details = DatabaseQueries.get_payment_by_authority(authority)
+                payment_details = await AsyncDatabaseQueries.get_payment_by_authority(authority)
 
                 if not payment_details:
                     await update.message.reply_text(ZARINPAL_PAYMENT_NOT_FOUND_MESSAGE_USER)
@@ -64,7 +68,14 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     # Payment already processed or in an unexpected state
                     # Check if it was successful and inform user, or if failed
                     if payment_details['status'] == 'completed' or payment_details['status'] == 'already_verified':
-                        await update.message.reply_text(ZARINPAL_PAYMENT_ALREADY_VERIFIED_MESSAGE_USER)
+                        # Activates it now if an earlier attempt failed; otherwise returns the subscription it activated
+                        if payment_details['status'] == 'completed' and not await activate_zarinpal_payment(
+                                payment_details['payment_id'], payment_details['user_id'], payment_details['plan_id'],
+                                payment_details['amount'], payment_details.get('gateway_ref_id')):
+                            await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER.format(
+                                ref_id=payment_details.get('gateway_ref_id')))
+                        else:
+                            await update.message.reply_text(ZARINPAL_PAYMENT_ALREADY_VERIFIED_MESSAGE_USER)
                     else:
                         await update.message.reply_text(ZARINPAL_PAYMENT_FAILED_MESSAGE_TRY_AGAIN_USER.format(status=payment_details['status']))
                     processed_payment_callback = True
@@ -72,43 +83,42 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     # Payment is pending verification, proceed
                     if status_from_url == 'OK':
                         rial_amount = int(payment_details['amount']) # Zarinpal expects integer amount
-                        verification_result = ZarinpalPaymentService.verify_payment(amount=rial_amount, authority=authority)
+                        verification_result = await zarinpal_gateway.verify_payment(amount=rial_amount, authority=authority)
                         
-                        if verification_result and verification_result.get('status') == ZARINPAL_VERIFY_SUCCESS_STATUS:
+                        if verification_result and verification_result.get('status') in (ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_ALREADY_VERIFIED_STATUS):
                             ref_id = verification_result.get('ref_id')
-                            DatabaseQueries.update_payment_verification_status(payment_details['payment_id'], 'completed', str(ref_id))
-                            
-                            plan_info = DatabaseQueries.get_plan_by_id(payment_details['plan_id'])
-                            if plan_info:
-                                subscription_id = DatabaseQueries.add_subscription(
-                                    user_id=user_id,
-                                    plan_id=payment_details['plan_id'],
-                                    payment_id=payment_details['payment_id'],
-                                    plan_duration_days=plan_info['days'],
-                                    amount_paid=payment_details['amount'],
-                                    payment_method='zarinpal'
-                                )
-                                if subscription_id:
-                                    await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_AND_SUB_ACTIVATED_MESSAGE_USER.format(ref_id=ref_id, plan_name=plan_info['name']))
-                                else:
+                            # Claim and activate; if the background reconciler completed it already,
+                            # this returns the subscription it activated (a payment is applied only once)
+                            claimed, subscription_id = await complete_verified_payment(
+                                payment_details['payment_id'], payment_details['user_id'], payment_details['plan_id'],
+                                payment_details['amount'], ref_id
+                            )
+                            if claimed is None:
+                                # Database error: the payment stays pending for the reconciler
+                                await update.message.reply_text(ZARINPAL_PAYMENT_COMPLETION_DB_ERROR_MESSAGE_USER.format(ref_id=ref_id))
+                            elif not subscription_id:
+                                # Completed but not activated: the reconciler retries the activation
+                                if await AsyncDatabaseQueries.get_plan_by_id(payment_details['plan_id']):
                                     await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER.format(ref_id=ref_id))
+                                else:
+                                    # Plan info not found, should not happen if data integrity is maintained
+                                    await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_PLAN_NOT_FOUND_MESSAGE_USER.format(ref_id=ref_id))
+                            elif not claimed:
+                                await update.message.reply_text(ZARINPAL_PAYMENT_ALREADY_VERIFIED_MESSAGE_USER)
                             else:
-                                # Plan info not found, should not happen if data integrity is maintained
-                                await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_PLAN_NOT_FOUND_MESSAGE_USER.format(ref_id=ref_id))
-                        
-                        elif verification_result and verification_result.get('status') == ZARINPAL_ALREADY_VERIFIED_STATUS:
-                            ref_id = verification_result.get('ref_id') # Usually available
-                            DatabaseQueries.update_payment_verification_status(payment_details['payment_id'], 'already_verified', str(ref_id) if ref_id else None)
-                            # Potentially re-check and activate subscription if it wasn't due to some race condition or error
-                            # For simplicity, just informing the user it's already verified.
-                            await update.message.reply_text(ZARINPAL_PAYMENT_ALREADY_VERIFIED_MESSAGE_USER)
+                                plan_info = await AsyncDatabaseQueries.get_plan_by_id(payment_details['plan_id'])
+                                await update.message.reply_text(ZARINPAL_PAYMENT_VERIFIED_SUCCESS_AND_SUB_ACTIVATED_MESSAGE_USER.format(
+                                    ref_id=ref_id, plan_name=plan_info['name'] if plan_info else ''))
+                        elif zarinpal_gateway.is_transient(verification_result):
+                            # Gateway outage: leave the payment pending_verification for a later attempt
+                            await update.message.reply_text(ZARINPAL_GATEWAY_UNAVAILABLE_MESSAGE_USER)
                         else:
                             # Verification failed
                             error_code = verification_result.get('status', 'N/A')
-                            DatabaseQueries.update_payment_verification_status(payment_details['payment_id'], 'failed')
+                            await AsyncDatabaseQueries.update_payment_verification_status(payment_details['payment_id'], 'failed')
                             await update.message.reply_text(ZARINPAL_PAYMENT_VERIFICATION_FAILED_MESSAGE_USER.format(error_code=error_code))
                     else: # Status from URL was not 'OK' (e.g., user cancelled)
-                        DatabaseQueries.update_payment_verification_status(payment_details['payment_id'], 'cancelled')
+                        await AsyncDatabaseQueries.update_payment_verification_status(payment_details['payment_id'], 'cancelled')
                         await update.message.reply_text(ZARINPAL_PAYMENT_CANCELLED_MESSAGE_USER)
                     processed_payment_callback = True
         except Exception as e:
@@ -119,12 +129,12 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Standard /start command logic (if not a payment callback or after processing it)
     if not processed_payment_callback:
         # Update or create user in database
-        if not DatabaseQueries.user_exists(user_id):
-            DatabaseQueries.add_user(user_id, username)
+        if not await AsyncDatabaseQueries.user_exists(user_id):
+            await AsyncDatabaseQueries.add_user(user_id, username)
             user_db_data = None # New user, not yet registered with details
         else:
-            DatabaseQueries.update_user_activity(user_id)
-            user_db_data = DatabaseQueries.get_user_details(user_id)
+            await AsyncDatabaseQueries.update_user_activity(user_id)
+            user_db_data = await AsyncDatabaseQueries.get_user_details(user_id)
         
         is_registered = bool(user_db_data and user_db_data['full_name'] and user_db_data['phone'])
 
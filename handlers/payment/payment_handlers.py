@@ -3,7 +3,8 @@ Payment handlers for the Daraei Academy Telegram bot
 """
 
 from services.crypto_payment_service import CryptoPaymentService
-from services.zarinpal_service import ZarinpalPaymentService # Added for Zarinpal
+from services.zarinpal_service import zarinpal_gateway # Added for Zarinpal
+from services.zarinpal_reconciler import activate_zarinpal_payment, complete_verified_payment
 from config import CRYPTO_WALLET_ADDRESS, CRYPTO_PAYMENT_TIMEOUT_MINUTES, RIAL_GATEWAY_URL, CRYPTO_GATEWAY_URL, PAYMENT_CONVERSATION_TIMEOUT # Added CRYPTO_WALLET_ADDRESS, CRYPTO_PAYMENT_TIMEOUT_MINUTES
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice, ReplyKeyboardMarkup, KeyboardButton
@@ -21,8 +22,8 @@ logger = logging.getLogger(__name__)
 from datetime import datetime, timedelta
 import uuid
 # import config # Direct access to SUBSCRIPTION_PLANS removed
-from database.queries import DatabaseQueries as Database
-from utils.price_utils import get_usdt_to_irr_rate, convert_irr_to_usdt
+from database.async_queries import AsyncDatabaseQueries
+from utils.price_utils import get_usdt_to_irr_rate, get_usdt_rate_age, convert_irr_to_usdt
 from config import RIAL_GATEWAY_URL, CRYPTO_GATEWAY_URL # Assuming these are still needed from config
 from utils.keyboards import (
     get_subscription_plans_keyboard, get_payment_methods_keyboard,
@@ -41,7 +42,14 @@ from utils.constants.all_constants import (
     TEXT_GENERAL_BACK_TO_MAIN_MENU, 
     CALLBACK_BACK_TO_MAIN_MENU
 ) # Added for Zarinpal
-from utils.constants.all_constants import ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_REQUEST_SUCCESS_STATUS # Added for Zarinpal status check
+from utils.constants.all_constants import ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_ALREADY_VERIFIED_STATUS, ZARINPAL_REQUEST_SUCCESS_STATUS # Added for Zarinpal status check
+from utils.constants.all_constants import ZARINPAL_GATEWAY_UNAVAILABLE_MESSAGE_USER, ZARINPAL_PAYMENT_COMPLETION_DB_ERROR_MESSAGE_USER
+from utils.constants.all_constants import ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER
+from utils.constants.all_constants import (
+    CRYPTO_PAYMENT_NOT_SEEN_YET_MESSAGE_USER, CRYPTO_PAYMENT_ALREADY_ACTIVATED_MESSAGE_USER,
+    CRYPTO_PAYMENT_ACTIVATION_PENDING_MESSAGE_USER, CRYPTO_PAYMENT_EXPIRED_MESSAGE_USER,
+    CRYPTO_PAYMENT_NEEDS_REVIEW_MESSAGE_USER
+)
 from utils.helpers import calculate_days_left, generate_qr_code
 from handlers.subscription.subscription_handlers import activate_or_extend_subscription
 from utils.user_actions import UserAction
@@ -58,7 +66,7 @@ async def back_to_main_menu_from_payment_handler(update: Update, context: Contex
     from handlers.subscription.subscription_handlers import view_active_subscription
     query = update.callback_query
     user_id = update.effective_user.id
-    Database.update_user_activity(user_id)
+    await AsyncDatabaseQueries.update_user_activity(user_id)
     context.user_data.clear()
     return await view_active_subscription(update, context)
 
@@ -109,7 +117,7 @@ async def select_plan_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     logger.info(f"[select_plan_handler] User {user_id} triggered with data: {query.data}")
     await query.answer()
 
-    Database.update_user_activity(user_id)
+    await AsyncDatabaseQueries.update_user_activity(user_id)
 
     # The ConversationHandler's pattern ensures query.data starts with 'plan_'
     callback_data = query.data.split('_')
@@ -120,7 +128,7 @@ async def select_plan_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.message.edit_text("خطا: شناسه طرح نامعتبر است.")
         return SELECT_PLAN
 
-    selected_plan = Database.get_plan_by_id(numeric_plan_id)
+    selected_plan = await AsyncDatabaseQueries.get_plan_by_id(numeric_plan_id)
     logger.info(f"[select_plan_handler] Selected plan: {selected_plan}")
 
     # Handle free plans immediately
@@ -131,7 +139,7 @@ async def select_plan_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         plan_id = selected_plan['id']
 
         # 1. Check if user has already used this free plan
-        if Database.has_user_used_free_plan(user_id, plan_id):
+        if await AsyncDatabaseQueries.has_user_used_free_plan(user_id, plan_id):
             logger.warning(f"User {user_id} has already used free plan {plan_id}.")
             keyboard = [[InlineKeyboardButton("بازگشت به پروفایل کاربری", callback_data='back_to_main_menu')]]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -146,13 +154,13 @@ async def select_plan_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         capacity = selected_plan['capacity'] if 'capacity' in selected_plan.keys() and selected_plan['capacity'] is not None else None
         if capacity is not None:
             logger.info(f"Checking total capacity for plan {plan_id}. Capacity: {capacity}")
-            subscription_count = Database.count_total_subscriptions_for_plan(plan_id)
+            subscription_count = await AsyncDatabaseQueries.count_total_subscriptions_for_plan(plan_id)
             logger.info(f"Total subscriptions ever created for plan {plan_id}: {subscription_count}")
 
             if subscription_count >= capacity:
                 logger.warning(f"Free plan {plan_id} has reached its capacity. Deactivating plan.")
                 # Deactivate the plan for future users
-                Database.deactivate_plan(plan_id)
+                await AsyncDatabaseQueries.deactivate_plan(plan_id)
                 keyboard = [[InlineKeyboardButton("بازگشت به پروفایل کاربری", callback_data='back_to_main_menu')]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 await query.edit_message_text(
@@ -200,7 +208,8 @@ async def select_plan_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     context.user_data['selected_plan_details'] = dict(selected_plan)
     plan_price_irr_formatted = f"{int(selected_plan['price']):,}" if selected_plan['price'] is not None else "N/A"
-    usdt_rate = await get_usdt_to_irr_rate()
+    # Served from the background-refreshed cache; never waits on Nobitex
+    usdt_rate = await get_usdt_to_irr_rate(wait=False)
     if usdt_rate and selected_plan['price'] is not None:
         converted_usdt_price = convert_irr_to_usdt(float(selected_plan['price']), usdt_rate)
         plan_price_usdt_formatted = f"{converted_usdt_price}" if converted_usdt_price is not None else "N/A"
@@ -208,7 +217,7 @@ async def select_plan_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             context.user_data['live_usdt_price'] = converted_usdt_price
     else:
         plan_price_usdt_formatted = "N/A"
-        logger.warning(f"[select_plan_handler] Could not calculate USDT price for plan {numeric_plan_id}. USDT rate: {usdt_rate}")
+        logger.warning(f"[select_plan_handler] Could not calculate USDT price for plan {numeric_plan_id}. USDT rate: {usdt_rate}, age: {get_usdt_rate_age()}")
 
     message_text = PAYMENT_METHOD_MESSAGE.format(
         plan_name=selected_plan['name'],
@@ -234,9 +243,9 @@ async def select_payment_method(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     telegram_id = update.effective_user.id
 
-    Database.update_user_activity(telegram_id) # Ensures user exists in DB
+    await AsyncDatabaseQueries.update_user_activity(telegram_id) # Ensures user exists in DB
 
-    user_record = Database.get_user_details(telegram_id)
+    user_record = await AsyncDatabaseQueries.get_user_details(telegram_id)
     if not user_record:
         logger.error(f"Critical: User with telegram_id {telegram_id} not found in database after update_user_activity.")
         await query.message.edit_text("خطای سیستمی: اطلاعات کاربری شما یافت نشد. لطفاً با پشتیبانی تماس بگیرید.")
@@ -260,7 +269,7 @@ async def select_payment_method(update: Update, context: ContextTypes.DEFAULT_TY
 
     plan_id = selected_plan['id']
     # Fetch full plan with price_tether from DB
-    db_plan = Database.get_plan(plan_id)
+    db_plan = await AsyncDatabaseQueries.get_plan(plan_id)
     if db_plan is not None:
         selected_plan = dict(db_plan)
         context.user_data['selected_plan_details'] = selected_plan
@@ -274,7 +283,7 @@ async def select_payment_method(update: Update, context: ContextTypes.DEFAULT_TY
         # Create a detailed description for the payment record in the database
         db_description = f"خرید محصولات {plan_name} (Plan ID: {plan_id}) توسط کاربر ID: {user_db_id}"
 
-        payment_db_id = Database.add_payment(
+        payment_db_id = await AsyncDatabaseQueries.add_payment(
             user_id=user_db_id,
             plan_id=plan_id,  # Associate payment with the plan
             amount=plan_price_irr,  # Amount for the plan in IRR
@@ -298,7 +307,7 @@ async def select_payment_method(update: Update, context: ContextTypes.DEFAULT_TY
         logger.info(f"Requesting Zarinpal payment for user {telegram_id}, plan {plan_id}, amount {amount_for_zarinpal} IRR.")
         bot_username = (await context.bot.get_me()).username
         # The callback_url will be dynamically constructed inside the service
-        zarinpal_request = ZarinpalPaymentService.create_payment_request(
+        zarinpal_request = await zarinpal_gateway.create_payment_request(
             amount=amount_for_zarinpal,
             description=description,
             callback_url=f"https://t.me/{bot_username}" # Base URL for deep linking
@@ -310,7 +319,7 @@ async def select_payment_method(update: Update, context: ContextTypes.DEFAULT_TY
             payment_url = zarinpal_request.get('payment_url')
 
             # Immediately update the database with the authority code
-            Database.update_payment_transaction_id(payment_db_id, str(authority), status='pending_verification')
+            await AsyncDatabaseQueries.update_payment_transaction_id(payment_db_id, str(authority), status='pending_verification')
 
             context.user_data['zarinpal_authority'] = authority
             context.user_data['rial_amount_for_zarinpal'] = amount_for_zarinpal
@@ -339,7 +348,7 @@ async def select_payment_method(update: Update, context: ContextTypes.DEFAULT_TY
             return VERIFY_PAYMENT
         
         else: # ERROR or other statuses
-            Database.update_payment_status(payment_db_id, 'failed', error_message=f"zarinpal_req_err_{zarinpal_request.get('status')}")
+            await AsyncDatabaseQueries.update_payment_status(payment_db_id, 'failed', error_message=f"zarinpal_req_err_{zarinpal_request.get('status')}")
             logger.error(f"Zarinpal payment request failed for user {telegram_id}. Response: {zarinpal_request}")
             await query.message.edit_text(
                 f"متاسفانه در ایجاد لینک پرداخت مشکلی پیش آمد.\nخطا: {zarinpal_request.get('message')} (کد: {zarinpal_request.get('status')})\nلطفاً دقایقی دیگر مجدداً تلاش کنید یا روش پرداخت دیگری را انتخاب نمایید.",
@@ -368,67 +377,33 @@ async def select_payment_method(update: Update, context: ContextTypes.DEFAULT_TY
 
         expires_at = datetime.now() + timedelta(minutes=CRYPTO_PAYMENT_TIMEOUT_MINUTES)
 
-        # Step 1: Create a preliminary crypto payment request entry to get an ID.
+        try:
+            # Step 1: The plan's base USDT amount; a unique offset is added when the request is stored.
+            base_usdt_amount = CryptoPaymentService.get_final_usdt_payment_amount(
+                base_usdt_amount_rounded_to_3_decimals=live_calculated_usdt_price # live_calculated_usdt_price is the USDT amount for the plan, already rounded to 3 decimals
+            )
+        except Exception as e:
+            logger.exception(f"Error calculating USDT amount for rial_amount {rial_amount}. telegram_id: {telegram_id}")
+            await query.message.edit_text("خطا در سیستم تبدیل ارز. لطفاً لحظاتی دیگر تلاش کنید یا با پشتیبانی تماس بگیرید.", reply_markup=get_payment_methods_keyboard())
+            return SELECT_PAYMENT_METHOD
+
+        # Step 2: Store the request with its final, unique USDT amount.
         rial_plan_price = selected_plan.get('price') # Get RIAL price of the plan
         payment_timeout_minutes = config.CRYPTO_PAYMENT_TIMEOUT_MINUTES
         expires_at_dt = datetime.now() + timedelta(minutes=payment_timeout_minutes)
 
-        crypto_payment_request_db_id = Database.create_crypto_payment_request(
+        crypto_payment_request_db_id = await AsyncDatabaseQueries.create_crypto_payment_request(
             user_id=user_db_id,
             rial_amount=rial_plan_price, # Pass the RIAL amount of the plan
-            usdt_amount_requested=live_calculated_usdt_price, # This is the base USDT price for the plan
+            usdt_amount_requested=base_usdt_amount,
             wallet_address=config.CRYPTO_WALLET_ADDRESS,
-            expires_at=expires_at_dt
+            expires_at=expires_at_dt,
+            plan_id=plan_id
         )
         logger.info(f"User {telegram_id} (DB ID: {user_db_id}): Crypto payment_request_db_id: {crypto_payment_request_db_id}. Result from Database.create_crypto_payment_request.")
+        crypto_request = await AsyncDatabaseQueries.get_crypto_payment_request(crypto_payment_request_db_id) if crypto_payment_request_db_id else None
 
-        if not crypto_payment_request_db_id:
-            UserAction.log_user_action(
-                telegram_id=telegram_id, 
-                action_type='crypto_placeholder_creation_failed',
-                details={'plan_id': plan_id, 'rial_amount': rial_amount, 'user_db_id': user_db_id}
-            )
-            logger.error(f"Failed to create placeholder crypto payment request for user_db_id {user_db_id}, plan {plan_id}.")
-            await query.message.edit_text(PAYMENT_ERROR_MESSAGE, reply_markup=get_main_menu_keyboard(telegram_id))
-            return ConversationHandler.END # Or SELECT_PAYMENT_METHOD
-
-        logger.info(f"User {telegram_id} (DB ID: {user_db_id}): About to call Database.create_crypto_payment_request for plan {selected_plan['id']}, price_tether: {selected_plan['price_tether']}")
-
-        try:
-            # Step 2: Calculate the unique USDT amount using the obtained ID.
-            logger.info(f"User {telegram_id} (DB ID: {user_db_id}): Crypto payment_request_db_id: {crypto_payment_request_db_id}. About to call CryptoPaymentService.get_final_usdt_payment_amount with base_usdt_amount_rounded_to_3_decimals: {live_calculated_usdt_price}")
-            usdt_amount_requested = CryptoPaymentService.get_final_usdt_payment_amount(
-                base_usdt_amount_rounded_to_3_decimals=live_calculated_usdt_price # live_calculated_usdt_price is the USDT amount for the plan, already rounded to 3 decimals
-            )
-            # The following log line can be adjusted if needed, as 'unique_amount' might be misleading now.
-            # Perhaps change 'unique_amount' to 'final_amount' or 'requested_amount'.
-            logger.info(f"User {telegram_id} (DB ID: {user_db_id}): Crypto final_usdt_amount_data: {{'final_amount': {usdt_amount_requested}, 'id': {crypto_payment_request_db_id}}}")
-            context.user_data['usdt_amount_requested'] = usdt_amount_requested
-
-        except Exception as e:
-            logger.exception(f"Error calculating USDT amount for rial_amount {rial_amount}, payment_id {crypto_payment_request_db_id}. telegram_id: {telegram_id}")
-            # Consider updating DB record status to 'calculation_exception'
-            await query.message.edit_text("خطا در سیستم تبدیل ارز. لطفاً لحظاتی دیگر تلاش کنید یا با پشتیبانی تماس بگیرید.", reply_markup=get_payment_methods_keyboard())
-            return SELECT_PAYMENT_METHOD
-
-        # Step 3: Update the crypto payment request record with the calculated USDT amount.
-        # This requires a method like: Database.update_crypto_payment_request_with_amount(request_id, usdt_amount)
-        update_success = Database.update_crypto_payment_request_with_amount(
-            payment_request_id=crypto_payment_request_db_id,
-            usdt_amount=usdt_amount_requested
-        )
-
-        if not update_success:
-            UserAction.log_user_action(
-                telegram_id=telegram_id, 
-                action_type='crypto_usdt_amount_update_failed',
-                details={'payment_request_id': crypto_payment_request_db_id, 'usdt_amount': usdt_amount_requested, 'user_db_id': user_db_id}
-            )
-            logger.error(f"Failed to update crypto payment request {crypto_payment_request_db_id} with USDT amount {usdt_amount_requested}. telegram_id: {telegram_id}")
-            await query.message.edit_text("خطای سیستمی هنگام ثبت مبلغ تتر. لطفاً با پشتیبانی تماس بگیرید.", reply_markup=get_main_menu_keyboard(telegram_id))
-            return ConversationHandler.END # Or SELECT_PAYMENT_METHOD
-
-        if not crypto_payment_request_db_id:
+        if not crypto_request:
             UserAction.log_user_action(
                 telegram_id=telegram_id,
                 user_db_id=user_db_id,
@@ -436,13 +411,16 @@ async def select_payment_method(update: Update, context: ContextTypes.DEFAULT_TY
                 details={
                     'plan_id': plan_id,
                     'rial_amount': rial_amount,
-                    'usdt_amount_requested': usdt_amount_requested
+                    'usdt_amount_requested': base_usdt_amount
                 }
             )
             logger.error(f"Failed to create crypto_payment_request in DB for user_db_id {user_db_id}, telegram_id {telegram_id}, plan_id {plan_id}")
             await query.message.edit_text("خطا: امکان ایجاد درخواست پرداخت کریپتو وجود ندارد. لطفاً با پشتیبانی تماس بگیرید.", reply_markup=get_payment_methods_keyboard())
             return SELECT_PAYMENT_METHOD
 
+        usdt_amount_requested = crypto_request['usdt_amount_requested']
+        logger.info(f"User {telegram_id} (DB ID: {user_db_id}): Crypto final_usdt_amount_data: {{'final_amount': {usdt_amount_requested}, 'id': {crypto_payment_request_db_id}}}")
+
         context.user_data['crypto_payment_id'] = crypto_payment_request_db_id
         context.user_data['usdt_amount_requested'] = usdt_amount_requested
 
@@ -450,7 +428,7 @@ async def select_payment_method(update: Update, context: ContextTypes.DEFAULT_TY
 
         payment_info_text = CRYPTO_PAYMENT_UNIQUE_AMOUNT_MESSAGE.format(
             wallet_address=CRYPTO_WALLET_ADDRESS,
-            usdt_amount=f"{usdt_amount_requested:.3f}",
+            usdt_amount=f"{usdt_amount_requested:.6f}",
             timeout_minutes=CRYPTO_PAYMENT_TIMEOUT_MINUTES
         )
 
@@ -564,7 +542,7 @@ async def verify_payment_status(update: Update, context: ContextTypes.DEFAULT_TY
     telegram_id = update.effective_user.id # Renamed from user_id for clarity
     user_db_id = None # Will be populated after fetching payment record
 
-    Database.update_user_activity(telegram_id) # Uses telegram_id
+    await AsyncDatabaseQueries.update_user_activity(telegram_id) # Uses telegram_id
 
     user_db_id = context.user_data.get('user_db_id')
     selected_plan_details = context.user_data.get('selected_plan_details')
@@ -599,7 +577,7 @@ async def verify_payment_status(update: Update, context: ContextTypes.DEFAULT_TY
         return SELECT_PLAN
 
     # Fetch payment record to get user_db_id and verify payment
-    db_payment = Database.get_payment_by_id(payment_id)
+    db_payment = await AsyncDatabaseQueries.get_payment_by_id(payment_id)
     if not db_payment:
         UserAction.log_user_action(
             telegram_id=telegram_id,
@@ -637,7 +615,7 @@ async def verify_payment_status(update: Update, context: ContextTypes.DEFAULT_TY
             }
         )
         
-        if not Database.update_payment_status(payment_id, "completed", gateway_transaction_id):
+        if not await AsyncDatabaseQueries.update_payment_status(payment_id, "completed", gateway_transaction_id):
             UserAction.log_user_action(
                 telegram_id=telegram_id,
                 user_db_id=user_db_id,
@@ -732,9 +710,9 @@ async def verify_payment_status(update: Update, context: ContextTypes.DEFAULT_TY
                     'plan_id': plan_id
                 }
             )
-            updated_subscription = Database.get_subscription(subscription_record_id)
+            updated_subscription = await AsyncDatabaseQueries.get_subscription(subscription_record_id)
             if not updated_subscription:
-                updated_subscription = Database.get_user_active_subscription(user_db_id if user_db_id else telegram_id)
+                updated_subscription = await AsyncDatabaseQueries.get_user_active_subscription(user_db_id if user_db_id else telegram_id)
 
             display_end_date = "نامشخص"
             if updated_subscription and updated_subscription.get('end_date'):
@@ -790,7 +768,7 @@ async def verify_payment_status(update: Update, context: ContextTypes.DEFAULT_TY
                 'payment_method': payment_method
             }
         )
-        if not Database.update_payment_status(payment_id, "failed", gateway_transaction_id):
+        if not await AsyncDatabaseQueries.update_payment_status(payment_id, "failed", gateway_transaction_id):
              logger.warning(f"Warning: Failed to update payment status to 'failed' for payment_id {payment_id} for user {telegram_id}")
              UserAction.log_user_action(
                 telegram_id=telegram_id,
@@ -814,15 +792,14 @@ async def show_qr_code_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     # Extract crypto_payment_request_db_id from callback_data, which acts as our transaction identifier here
     crypto_payment_request_db_id = query.data.split('_')[-1]
 
-    # Retrieve wallet address and amount from context or database if necessary
-    # For this example, we assume wallet address is fixed and amount is in context
-    wallet_address = CRYPTO_WALLET_ADDRESS
-    # Retrieve payment details using crypto_payment_request_db_id
-    # This might involve a database lookup if not all info is in context.user_data
-    # For now, let's assume usdt_amount_requested was stored with a key related to this ID or is generally available.
-    # A more robust way would be to fetch from DB: payment_record = Database.get_payment_by_id(crypto_payment_request_db_id)
-    # and then use payment_record['amount']
-    usdt_amount = context.user_data.get('usdt_amount_requested') # Assuming it's the one from the current flow
+    # The request (a crypto_payments row keyed by its UUID) holds the exact amount and wallet
+    crypto_request = await AsyncDatabaseQueries.get_crypto_payment_request(crypto_payment_request_db_id)
+    if not crypto_request:
+        await query.answer("خطا: درخواست پرداخت یافت نشد.", show_alert=True)
+        logger.error(f"QR Code: crypto payment request {crypto_payment_request_db_id} not found for user {telegram_id}")
+        return
+    wallet_address = crypto_request['wallet_address'] or CRYPTO_WALLET_ADDRESS
+    usdt_amount = crypto_request['usdt_amount_requested']
 
     if not wallet_address:
         await query.answer("خطا: آدرس کیف پول برای تولید QR کد یافت نشد.", show_alert=True)
@@ -851,6 +828,44 @@ async def show_qr_code_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.error(f"Error generating or sending QR code for user {telegram_id}, payment_request_id {crypto_payment_request_db_id}: {e}")
         await query.answer("خطا در تولید یا ارسال QR کد.", show_alert=True)
 
+async def payment_verify_crypto_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles the 'I paid, check it' button for crypto payments by showing the request's status.
+
+    Transfers are matched and activated by the background USDT watcher; this only reports
+    what it has found so far for the crypto_payments request in context.
+    """
+    query = update.callback_query
+    await query.answer("در حال بررسی وضعیت پرداخت...")
+    telegram_id = update.effective_user.id
+    crypto_payment_id = context.user_data.get('crypto_payment_id')
+    crypto_request = await AsyncDatabaseQueries.get_crypto_payment_request(crypto_payment_id) if crypto_payment_id else None
+
+    if not crypto_request:
+        logger.error(f"Crypto payment request {crypto_payment_id} not found for user {telegram_id} in payment_verify_crypto_handler.")
+        await query.message.edit_text("خطا: رکورد پرداخت شما یافت نشد. با پشتیبانی تماس بگیرید.", reply_markup=get_main_menu_keyboard(telegram_id))
+        return ConversationHandler.END
+
+    status = crypto_request['status']
+    usdt_amount = f"{crypto_request['usdt_amount_requested']:.6f}"
+    UserAction.log_user_action(telegram_id, action_type='crypto_payment_status_checked', details={'crypto_payment_request_id': crypto_payment_id, 'status': status})
+    if status == 'pending':
+        # Keep the original message and buttons so the user can check again
+        await query.message.reply_text(CRYPTO_PAYMENT_NOT_SEEN_YET_MESSAGE_USER.format(usdt_amount=usdt_amount))
+        return VERIFY_PAYMENT
+
+    if status == 'paid' and crypto_request.get('subscription_id'):
+        text = CRYPTO_PAYMENT_ALREADY_ACTIVATED_MESSAGE_USER.format(tx_id=crypto_request['transaction_id'])
+    elif status == 'paid':
+        text = CRYPTO_PAYMENT_ACTIVATION_PENDING_MESSAGE_USER.format(tx_id=crypto_request['transaction_id'])
+    elif status == 'expired':
+        text = CRYPTO_PAYMENT_EXPIRED_MESSAGE_USER.format(usdt_amount=usdt_amount)
+    else:
+        text = CRYPTO_PAYMENT_NEEDS_REVIEW_MESSAGE_USER
+    await query.message.edit_text(text, reply_markup=get_main_menu_keyboard(telegram_id))
+    for key in ['crypto_payment_id', 'usdt_amount_requested']:
+        context.user_data.pop(key, None)
+    return ConversationHandler.END
+
 async def payment_verify_zarinpal_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles the 'Payment Done, Verify' button for Zarinpal payments."""
     query = update.callback_query
@@ -859,7 +874,7 @@ async def payment_verify_zarinpal_handler(update: Update, context: ContextTypes.
     user_db_id = context.user_data.get('user_db_id')
 
     if not user_db_id:
-        user_record = Database.get_user_by_telegram_id(telegram_id)
+        user_record = await AsyncDatabaseQueries.get_user_by_telegram_id(telegram_id)
         if user_record:
             user_db_id = user_record['id']
             context.user_data['user_db_id'] = user_db_id
@@ -885,9 +900,9 @@ async def payment_verify_zarinpal_handler(update: Update, context: ContextTypes.
 
     try:
         logger.info(f"Verifying Zarinpal payment for user {telegram_id}, authority {zarinpal_authority}, amount {rial_amount}")
-        verification_result = ZarinpalPaymentService.verify_payment(amount=rial_amount, authority=zarinpal_authority)
+        verification_result = await zarinpal_gateway.verify_payment(amount=rial_amount, authority=zarinpal_authority)
         
-        current_payment_record = Database.get_payment_by_id(payment_db_id)
+        current_payment_record = await AsyncDatabaseQueries.get_payment_by_id(payment_db_id)
         if not current_payment_record or current_payment_record['user_id'] != user_db_id:
             logger.error(f"Zarinpal verification: Payment record {payment_db_id} not found or mismatch for user {user_db_id}.")
             await query.message.edit_text("خطا: رکورد پرداخت شما یافت نشد. با پشتیبانی تماس بگیرید.")
@@ -895,47 +910,73 @@ async def payment_verify_zarinpal_handler(update: Update, context: ContextTypes.
         
         if current_payment_record['status'] == 'completed':
             logger.info(f"Zarinpal payment {payment_db_id} for authority {zarinpal_authority} already marked as completed for user {telegram_id}.")
+            # Activates it now if an earlier attempt failed; otherwise returns the subscription it activated
+            if not await activate_zarinpal_payment(payment_db_id, user_db_id, plan_id, rial_amount, current_payment_record['gateway_ref_id']):
+                await query.message.edit_text(
+                    ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER.format(ref_id=current_payment_record['gateway_ref_id']),
+                    reply_markup=get_main_menu_keyboard(telegram_id)
+                )
+                return ConversationHandler.END
             await query.message.edit_text(
                 "پرداخت شما قبلاً با موفقیت تایید و اشتراک شما فعال شده است.",
                 reply_markup=get_main_menu_keyboard(telegram_id)
             )
             return ConversationHandler.END
 
-        if verification_result and verification_result.get('status') == ZARINPAL_VERIFY_SUCCESS_STATUS:
+        if verification_result and verification_result.get('status') in (ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_ALREADY_VERIFIED_STATUS):
             ref_id = verification_result.get('ref_id')
-            logger.info(f"Zarinpal payment successful for user {telegram_id}, authority {zarinpal_authority}, ref_id {ref_id}.")
-            Database.update_payment_status(payment_db_id, 'completed', transaction_id=str(ref_id))
-            activation_details = await activate_or_extend_subscription(user_db_id, plan_id, payment_db_id, 'zarinpal', telegram_id, context)
-            success_message = PAYMENT_SUCCESS_MESSAGE.format(
-                plan_name=selected_plan_name,
-                expiry_date=activation_details.get('new_expiry_date_jalali', 'N/A')
-            )
-            await query.message.edit_text(success_message, reply_markup=get_main_menu_keyboard(telegram_id))
-            UserAction.log_user_action(telegram_id, 'zarinpal_payment_verified', {'payment_db_id': payment_db_id, 'plan_id': plan_id, 'amount': rial_amount, 'zarinpal_authority': zarinpal_authority, 'zarinpal_ref_id': ref_id, 'subscription_details': activation_details})
+            logger.info(f"Zarinpal payment verified (status {verification_result.get('status')}) for user {telegram_id}, authority {zarinpal_authority}, ref_id {ref_id}.")
+            # Claim and activate; if the background reconciler completed it meanwhile,
+            # this returns the subscription it activated (a payment is applied only once)
+            claimed, subscription_id = await complete_verified_payment(payment_db_id, user_db_id, plan_id, rial_amount, ref_id)
+            if claimed is None:
+                # Database error, not a lost race: keep the payment pending and let the user retry
+                logger.error(f"Could not record completion of verified Zarinpal payment {payment_db_id} (user {telegram_id}).")
+                await query.message.edit_text(
+                    ZARINPAL_PAYMENT_COMPLETION_DB_ERROR_MESSAGE_USER.format(ref_id=ref_id),
+                    reply_markup=InlineKeyboardMarkup([
+                        [InlineKeyboardButton("تلاش مجدد برای بررسی", callback_data=VERIFY_ZARINPAL_PAYMENT_CALLBACK)],
+                        [InlineKeyboardButton(TEXT_GENERAL_BACK_TO_MAIN_MENU, callback_data=CALLBACK_BACK_TO_MAIN_MENU)]
+                    ])
+                )
+                return VERIFY_PAYMENT
+            if not subscription_id:
+                # Completed but not activated: the reconciler retries the activation
+                await query.message.edit_text(
+                    ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER.format(ref_id=ref_id),
+                    reply_markup=get_main_menu_keyboard(telegram_id)
+                )
+                UserAction.log_user_action(telegram_id, 'zarinpal_activation_failed', {'payment_db_id': payment_db_id, 'plan_id': plan_id, 'zarinpal_ref_id': ref_id})
+            elif not claimed:
+                logger.info(f"Zarinpal payment {payment_db_id} (user {telegram_id}) was already completed by another verification path.")
+                await query.message.edit_text("این پرداخت قبلاً تایید شده است.", reply_markup=get_main_menu_keyboard(telegram_id))
+            else:
+                subscription = await AsyncDatabaseQueries.get_subscription(subscription_id)
+                success_message = PAYMENT_SUCCESS_MESSAGE.format(
+                    plan_name=selected_plan_name,
+                    days_left=calculate_days_left(subscription['end_date']) if subscription else 'N/A'
+                )
+                await query.message.edit_text(success_message, reply_markup=get_main_menu_keyboard(telegram_id))
+                UserAction.log_user_action(telegram_id, 'zarinpal_payment_verified', {'payment_db_id': payment_db_id, 'plan_id': plan_id, 'amount': rial_amount, 'zarinpal_authority': zarinpal_authority, 'zarinpal_ref_id': ref_id, 'zarinpal_status': verification_result.get('status'), 'subscription_id': subscription_id})
             for key in ['zarinpal_authority', 'rial_amount_for_zarinpal', 'selected_plan_id', 'payment_db_id_zarinpal', 'selected_plan_name']:
                 context.user_data.pop(key, None)
             return ConversationHandler.END
-        elif verification_result and verification_result.get('status') == 101: # Already verified by Zarinpal
-            ref_id = verification_result.get('ref_id')
-            logger.warning(f"Zarinpal payment for authority {zarinpal_authority} (user {telegram_id}) already verified by Zarinpal (status 101). Ref ID: {ref_id}. Checking our DB status.")
-            if current_payment_record['status'] != 'completed':
-                logger.info(f"Processing Zarinpal status 101 as success for payment_db_id {payment_db_id} (user {telegram_id}) as it's not completed in our DB.")
-                Database.update_payment_status(payment_db_id, 'completed', transaction_id=str(ref_id))
-                activation_details = await activate_or_extend_subscription(user_db_id, plan_id, payment_db_id, 'zarinpal', telegram_id, context)
-                success_message = PAYMENT_SUCCESS_MESSAGE.format(plan_name=selected_plan_name, expiry_date=activation_details.get('new_expiry_date_jalali', 'N/A'))
-                await query.message.edit_text(success_message, reply_markup=get_main_menu_keyboard(telegram_id))
-                UserAction.log_user_action(telegram_id, 'zarinpal_payment_verified_status_101', {'payment_db_id': payment_db_id, 'zarinpal_ref_id': ref_id, 'subscription_details': activation_details})
-                for key in ['zarinpal_authority', 'rial_amount_for_zarinpal', 'selected_plan_id', 'payment_db_id_zarinpal', 'selected_plan_name']:
-                    context.user_data.pop(key, None)
-                return ConversationHandler.END
-            else:
-                await query.message.edit_text("این پرداخت قبلاً تایید شده است.", reply_markup=get_main_menu_keyboard(telegram_id))
-                return ConversationHandler.END
+        elif zarinpal_gateway.is_transient(verification_result):
+            # Gateway outage: keep the payment pending_verification and let the user retry
+            logger.warning(f"Zarinpal unavailable while verifying authority {zarinpal_authority} for user {telegram_id}: {verification_result}")
+            await query.message.edit_text(
+                ZARINPAL_GATEWAY_UNAVAILABLE_MESSAGE_USER,
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("تلاش مجدد برای بررسی", callback_data=VERIFY_ZARINPAL_PAYMENT_CALLBACK)],
+                    [InlineKeyboardButton(TEXT_GENERAL_BACK_TO_MAIN_MENU, callback_data=CALLBACK_BACK_TO_MAIN_MENU)]
+                ])
+            )
+            return VERIFY_PAYMENT
         else:
             error_code = verification_result.get('status', 'N/A')
             error_message_zarinpal = verification_result.get('error_message', 'خطای نامشخص از زرین‌پال')
             logger.error(f"Zarinpal payment verification failed for user {telegram_id}, authority {zarinpal_authority}. Status: {error_code}, Message: {error_message_zarinpal}")
-            Database.update_payment_status(payment_db_id, 'failed', error_code=str(error_code))
+            await AsyncDatabaseQueries.update_payment_status(payment_db_id, 'failed', error_code=str(error_code))
             await query.message.edit_text(
                 f"متاسفانه تایید پرداخت شما با مشکل مواجه شد (کد خطا: {error_code}).\n{error_message_zarinpal}\n"
                 "لطفاً دوباره تلاش کنید یا با پشتیبانی تماس بگیرید.",
@@ -952,14 +993,14 @@ async def payment_verify_zarinpal_handler(update: Update, context: ContextTypes.
         await query.message.edit_text("خطایی در هنگام بررسی پرداخت رخ داد. لطفاً با پشتیبانی تماس بگیرید.", reply_markup=get_main_menu_keyboard(telegram_id))
         UserAction.log_user_action(telegram_id, 'zarinpal_verification_exception', {'zarinpal_authority': zarinpal_authority, 'error': str(e)})
         if payment_db_id:
-            Database.update_payment_status(payment_db_id, 'error', error_code='handler_exception')
+            await AsyncDatabaseQueries.update_payment_status(payment_db_id, 'error', error_code='handler_exception')
         return ConversationHandler.END
 
 async def back_to_payment_methods_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """بازگشت به انتخاب روش پرداخت و پاک‌سازی context مرحله تأیید پرداخت"""
     query = update.callback_query
     user_id = update.effective_user.id
-    Database.update_user_activity(user_id)
+    await AsyncDatabaseQueries.update_user_activity(user_id)
     # پاک‌سازی context مرحله تأیید پرداخت
     for key in ['payment_info', 'payment_db_id']:
         context.user_data.pop(key, None)
@@ -973,7 +1014,7 @@ async def back_to_payment_methods_handler(update: Update, context: ContextTypes.
 
     # Always refresh plan from DB to ensure all fields (like price_tether) are present
     plan_id = selected_plan.get('id')
-    db_plan = Database.get_plan(plan_id)
+    db_plan = await AsyncDatabaseQueries.get_plan(plan_id)
     if db_plan:
         selected_plan = dict(db_plan)
         context.user_data['selected_plan_details'] = selected_plan
@@ -985,7 +1026,7 @@ async def back_to_payment_methods_handler(update: Update, context: ContextTypes.
     live_usdt_price = None
     rial_price = selected_plan.get('price')
     if rial_price:
-        usdt_rate = await get_usdt_to_irr_rate() # Fetches live rate from Nobitex/Coingecko
+        usdt_rate = await get_usdt_to_irr_rate(wait=False) # Cached Nobitex rate, refreshed in the background
         if usdt_rate:
             live_usdt_price = convert_irr_to_usdt(rial_price, usdt_rate)
             context.user_data['live_usdt_price'] = live_usdt_price # Store for crypto payment step
@@ -1048,6 +1089,7 @@ payment_conversation = ConversationHandler(
         VERIFY_PAYMENT: [
             CallbackQueryHandler(verify_payment_status, pattern='^payment_verify$'),
             CallbackQueryHandler(payment_verify_zarinpal_handler, pattern=f'^{VERIFY_ZARINPAL_PAYMENT_CALLBACK}$'),
+            CallbackQueryHandler(payment_verify_crypto_handler, pattern='^payment_verify_crypto$'),
             CallbackQueryHandler(back_to_payment_methods_handler, pattern='^back_to_payment_methods$'),
             MessageHandler(filters.Regex(r"^(🎫 خرید محصولات)$"), start_subscription_flow),
         ],
@@ -5,7 +5,7 @@ Support ticket handlers for the Daraei Academy Telegram bot
 from telegram import Update, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 from telegram.constants import ParseMode
-from database.queries import DatabaseQueries as Database
+from database.async_queries import AsyncDatabaseQueries
 from utils.keyboards import get_main_menu_keyboard, get_support_menu_keyboard, get_ticket_conversation_keyboard, get_back_button
 from utils.constants import (
     SUPPORT_WELCOME_MESSAGE, NEW_TICKET_SUBJECT_REQUEST,
@@ -24,10 +24,10 @@ async def start_support(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Update user activity
-    Database.update_user_activity(user_id)
+    await AsyncDatabaseQueries.update_user_activity(user_id)
     
     # Get user's tickets
-    tickets = Database.get_user_tickets(user_id)
+    tickets = await AsyncDatabaseQueries.get_user_tickets(user_id)
     reply_markup = get_support_menu_keyboard(tickets)
     
     if update.callback_query:
@@ -123,7 +123,7 @@ async def get_ticket_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     # Create the ticket
     user_id = update.effective_user.id
-    ticket_number_from_db = Database.create_ticket( # Renamed to avoid confusion
+    ticket_number_from_db = await AsyncDatabaseQueries.create_ticket( # Renamed to avoid confusion
         user_id=user_id,
         subject=subject,
         message=message
@@ -154,7 +154,7 @@ async def get_ticket_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     
     # Get user's tickets again to update the support menu
-    tickets = Database.get_user_tickets(user_id)
+    tickets = await AsyncDatabaseQueries.get_user_tickets(user_id)
     await update.message.reply_text(
         success_message_user,
         reply_markup=get_support_menu_keyboard(tickets),
@@ -203,24 +203,24 @@ async def view_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE, ticket
     # This part might need adjustment based on how view_ticket can be invoked without a callback.
     # For now, we assume ticket_id is primarily from callback.
 
-    ticket = Database.get_ticket(ticket_id)
+    ticket = await AsyncDatabaseQueries.get_ticket(ticket_id)
     if not ticket:
         not_found_message = "تیکت مورد نظر یافت نشد یا شما دسترسی به آن ندارید."
         if update.callback_query:
             await update.callback_query.message.edit_text(
                 not_found_message,
-                reply_markup=get_support_menu_keyboard(Database.get_user_tickets(update.effective_user.id))
+                reply_markup=get_support_menu_keyboard(await AsyncDatabaseQueries.get_user_tickets(update.effective_user.id))
             )
         else:
             # This case (direct message to view_ticket) is less common for viewing existing tickets
             await update.message.reply_text(
                 not_found_message,
-                reply_markup=get_support_menu_keyboard(Database.get_user_tickets(update.effective_user.id))
+                reply_markup=get_support_menu_keyboard(await AsyncDatabaseQueries.get_user_tickets(update.effective_user.id))
             )
         logger.debug(f"view_ticket returning SUPPORT_MENU because ticket {ticket_id} not found or no access (direct message path).")
         return SUPPORT_MENU
 
-    messages = Database.get_ticket_messages(ticket_id)
+    messages = await AsyncDatabaseQueries.get_ticket_messages(ticket_id)
 
     message_text = f"<b>📋 تیکت #{ticket_id}: {ticket['subject']}</b>\n"
     message_text += f"🕒 تاریخ ایجاد: {ticket['created_at']}\n"
@@ -272,18 +272,18 @@ async def send_ticket_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not ticket_id:
         await update.message.reply_text(
             "خطایی رخ داده است. لطفاً ابتدا یک تیکت را از منو پشتیبانی انتخاب کنید.",
-            reply_markup=get_support_menu_keyboard(Database.get_user_tickets(update.effective_user.id))
+            reply_markup=get_support_menu_keyboard(await AsyncDatabaseQueries.get_user_tickets(update.effective_user.id))
         )
         return SUPPORT_MENU
 
-    ticket = Database.get_ticket(ticket_id)
+    ticket = await AsyncDatabaseQueries.get_ticket(ticket_id)
 
     # User can send message if ticket exists and is not 'closed'
     # Valid statuses for sending a message: 'open', 'pending_admin_reply', 'pending_user_reply'
     if not ticket or ticket['status'] == 'closed':
         await update.message.reply_text(
             "این تیکت بسته شده است و امکان ارسال پیام جدید وجود ندارد. برای ادامه، لطفاً تیکت را بازگشایی کنید یا تیکت جدیدی ایجاد نمایید.",
-            reply_markup=get_support_menu_keyboard(Database.get_user_tickets(update.effective_user.id))
+            reply_markup=get_support_menu_keyboard(await AsyncDatabaseQueries.get_user_tickets(update.effective_user.id))
         )
         # Optionally, show the specific ticket view again so they can see the reopen button if applicable
         # return await view_ticket(update, context, ticket_id) 
@@ -297,7 +297,7 @@ async def send_ticket_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return VIEW_TICKET # Stay in the same state to allow user to re-enter message
 
     # Add message to ticket, for user messages, is_admin_message is False (default)
-    success = Database.add_ticket_message(
+    success = await AsyncDatabaseQueries.add_ticket_message(
         ticket_id=ticket_id,
         user_id=user_id,
         message=message_text,
@@ -326,7 +326,7 @@ async def back_to_tickets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Get user's tickets
     user_id = update.effective_user.id
-    tickets = Database.get_user_tickets(user_id)
+    tickets = await AsyncDatabaseQueries.get_user_tickets(user_id)
     
     # Send support menu
     await query.message.edit_text(
@@ -375,7 +375,7 @@ async def support_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     
     # Get user's tickets
     user_id = update.effective_user.id
-    tickets = Database.get_user_tickets(user_id)
+    tickets = await AsyncDatabaseQueries.get_user_tickets(user_id)
     
     # Send support menu
     await query.message.edit_text(
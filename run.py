@@ -11,6 +11,9 @@ import json
 from bots import MainBot, ManagerBot
 from database.models import Database
 from database.queries import DatabaseQueries
+from database.async_queries import AsyncDatabaseQueries
+from database.activity_log_writer import activity_log_writer
+from services.message_dispatcher import message_dispatcher
 import config
 from dotenv import load_dotenv
 
@@ -40,6 +43,13 @@ logger = logging.getLogger(__name__)
 # Load environment variables from .env file
 load_dotenv()
 
+def shutdown_shared_services():
+    """Tear down process-wide services used by both bots, once both have stopped"""
+    DatabaseQueries.flush_user_activity()
+    activity_log_writer.stop()
+    AsyncDatabaseQueries.shutdown()
+    Database.close_pool()
+
 async def main():
     """Start both bots"""
     logger.info("Starting Daraei Academy Telegram Bot System")
@@ -90,11 +100,17 @@ async def main():
     except Exception as e:
         logger.error(f"Error in main: {e}")
     finally:
+        # No new broadcast messages are queued once the runner stops; the shared
+        # dispatcher is drained while both bots' HTTP clients are still open
+        await manager_bot.broadcast_runner.stop()
+        await message_dispatcher.stop()
+
         # Stop both bots
         await asyncio.gather(
             main_bot.stop(),
             manager_bot.stop()
         )
+        shutdown_shared_services()
         
         logger.info("Both bots have been stopped")
 
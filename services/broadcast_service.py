@@ -0,0 +1,131 @@
+"""
+Resumable admin broadcasts for the Manager Bot
+"""
+
+import asyncio
+import logging
+import time
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden
+
+from database.async_queries import AsyncDatabaseQueries
+from services.message_dispatcher import PRIORITY_LOW
+
+logger = logging.getLogger(__name__)
+
+# Recipient segments understood by DatabaseQueries.get_broadcast_targets
+SEGMENTS = ('all', 'active', 'expiring')
+
+
+def format_progress(job: dict) -> str:
+    """Progress text shown to the admin for a broadcast row."""
+    done = job['sent_count'] + job['failed_count'] + job['blocked_count']
+    total = job['total_count'] or 0
+    percent = int(done * 100 / total) if total else 100
+    status_titles = {'running': "در حال ارسال", 'completed': "پایان یافت", 'cancelled': "لغو شد"}
+    return (
+        f"📣 پیام همگانی #{job['id']} ({job['segment']}) - {status_titles.get(job['status'], job['status'])}\n\n"
+        f"پیشرفت: {done} از {total} ({percent}٪)\n"
+        f"✅ ارسال‌شده: {job['sent_count']}\n"
+        f"⛔️ ربات را مسدود کرده‌اند: {job['blocked_count']}\n"
+        f"❌ خطا: {job['failed_count']}"
+    )
+
+
+class BroadcastRunner:
+    """Delivers persisted broadcast jobs one page of recipients at a time.
+
+    Each page (``chunk_size`` user ids after the job's ``last_user_id`` cursor) is
+    handed to the message dispatcher, and once it is delivered the counters, the
+    cursor and any users who blocked the bot are checkpointed in one transaction.
+    Memory use is bounded by one page, and a job interrupted by a restart resumes
+    from its last checkpoint (at most one page may be sent twice). Cancelling only
+    flips the job's status; the runner stops before the next page.
+    """
+
+    def __init__(self, dispatcher, chunk_size: int = 500, progress_interval: float = 5.0):
+        self.dispatcher = dispatcher
+        self.chunk_size = max(1, int(chunk_size))
+        self.progress_interval = progress_interval
+        self._tasks = {}  # broadcast_id -> asyncio.Task
+
+    def is_running(self, broadcast_id: int) -> bool:
+        task = self._tasks.get(broadcast_id)
+        return task is not None and not task.done()
+
+    def start(self, broadcast_id: int, send_bot, progress_bot=None) -> bool:
+        """Start delivering *broadcast_id* in the background. Returns False if it is already running."""
+        if self.is_running(broadcast_id):
+            return False
+        task = asyncio.get_running_loop().create_task(
+            self.run(broadcast_id, send_bot, progress_bot), name=f"broadcast-{broadcast_id}"
+        )
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+        return True
+
+    async def run(self, broadcast_id: int, send_bot, progress_bot=None):
+        last_report = time.monotonic()
+        while True:
+            job = await AsyncDatabaseQueries.get_broadcast(broadcast_id)
+            if not job or job['status'] != 'running':
+                break
+
+            user_ids = await AsyncDatabaseQueries.get_broadcast_targets(
+                job['segment'], job['segment_arg'], job['last_user_id'], self.chunk_size
+            )
+            if not user_ids:
+                await AsyncDatabaseQueries.set_broadcast_status(broadcast_id, 'completed')
+                job = await AsyncDatabaseQueries.get_broadcast(broadcast_id)
+                logger.info(f"Broadcast {broadcast_id} completed: {job['sent_count']} sent, "
+                            f"{job['blocked_count']} blocked, {job['failed_count']} failed.")
+                await self._report(progress_bot, job)
+                break
+
+            futures = [
+                self.dispatcher.submit(send_bot, user_id, job['message_text'], priority=PRIORITY_LOW, parse_mode=ParseMode.HTML)
+                for user_id in user_ids
+            ]
+            results = await asyncio.gather(*futures, return_exceptions=True)
+
+            sent, failed, blocked = 0, 0, []
+            for user_id, result in zip(user_ids, results):
+                if isinstance(result, Forbidden):
+                    blocked.append(user_id)
+                elif isinstance(result, BaseException):
+                    failed += 1
+                    logger.debug(f"Broadcast {broadcast_id}: failed to send to {user_id}: {result}")
+                else:
+                    sent += 1
+
+            if not await AsyncDatabaseQueries.checkpoint_broadcast(broadcast_id, user_ids[-1], sent, failed, blocked):
+                # Leave the job running; it resumes from the previous checkpoint later
+                logger.error(f"Broadcast {broadcast_id}: could not checkpoint page ending at user {user_ids[-1]}; pausing.")
+                break
+
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                await self._report(progress_bot, await AsyncDatabaseQueries.get_broadcast(broadcast_id))
+
+    async def _report(self, progress_bot, job):
+        if progress_bot is None or not job or not job.get('progress_chat_id') or not job.get('progress_message_id'):
+            return
+        try:
+            await progress_bot.edit_message_text(
+                chat_id=job['progress_chat_id'],
+                message_id=job['progress_message_id'],
+                text=format_progress(job)
+            )
+        except BadRequest as e:
+            # "Message is not modified" and deleted progress messages are harmless
+            logger.debug(f"Could not update progress of broadcast {job['id']}: {e}")
+        except Exception as e:
+            logger.warning(f"Could not update progress of broadcast {job['id']}: {e}")
+
+    async def stop(self):
+        """Stop all running broadcasts; they resume from their last checkpoint on the next start."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
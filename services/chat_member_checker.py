@@ -0,0 +1,103 @@
+"""
+Concurrent, rate-limited get_chat_member lookups for the Manager Bot
+"""
+
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Result markers for users whose status could not be read
+NOT_FOUND = "not_found"
+ERROR = "error"
+
+
+class ChatMemberChecker:
+    """Looks up many chat members concurrently without tripping flood limits.
+
+    At most ``concurrency`` requests are in flight at once, and requests to the
+    same chat are spaced to ``per_chat_rate`` per second. A ``RetryAfter`` from
+    Telegram pauses every request to that chat for the requested time before the
+    call is retried (up to ``max_retries`` times).
+    """
+
+    def __init__(self, concurrency: int = 8, per_chat_rate: float = 20.0, max_retries: int = 3):
+        self.concurrency = max(1, int(concurrency))
+        self.min_interval = 1.0 / per_chat_rate if per_chat_rate > 0 else 0.0
+        self.max_retries = max(0, int(max_retries))
+        self._semaphore = None
+        self._next_slot = {}     # chat_id -> monotonic time of the next allowed request
+        self._chat_locks = {}
+
+    def _get_semaphore(self):
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _wait_for_slot(self, chat_id):
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(chat_id, 0.0))
+            self._next_slot[chat_id] = slot + self.min_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _pause_chat(self, chat_id, seconds: float):
+        resume_at = time.monotonic() + seconds
+        self._next_slot[chat_id] = max(self._next_slot.get(chat_id, 0.0), resume_at)
+
+    @staticmethod
+    def _retry_seconds(error: RetryAfter) -> float:
+        retry_after = error.retry_after
+        if isinstance(retry_after, timedelta):
+            return retry_after.total_seconds()
+        return float(retry_after)
+
+    async def call(self, rate_key, func, /, *args, **kwargs):
+        """Run one Bot API coroutine under the concurrency limit and the rate limit of *rate_key* (a chat id)."""
+        attempt = 0
+        while True:
+            async with self._get_semaphore():
+                await self._wait_for_slot(rate_key)
+                try:
+                    return await func(*args, **kwargs)
+                except RetryAfter as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self._retry_seconds(e)
+                    self._pause_chat(rate_key, delay)
+                    attempt += 1
+                    logger.warning(f"Flood limit on chat {rate_key}: retrying in {delay:.1f}s (attempt {attempt}/{self.max_retries}).")
+
+    async def get_status(self, bot, chat_id, user_id):
+        """Return the member status string, NOT_FOUND or ERROR."""
+        try:
+            member = await self.call(chat_id, bot.get_chat_member, chat_id=chat_id, user_id=user_id)
+            return member.status
+        except BadRequest as e:
+            message = str(e).lower()
+            if "chat not found" in message:
+                logger.error(f"Chat {chat_id} not found by bot while checking member {user_id}.")
+                return ERROR
+            if "not found" in message:
+                return NOT_FOUND
+            logger.error(f"Error checking member {user_id} in chat {chat_id} (BadRequest): {e}.")
+        except Forbidden as e:
+            logger.error(f"Forbidden to get chat member {user_id} for chat {chat_id}: {e}.")
+        except RetryAfter as e:
+            logger.error(f"Giving up on member {user_id} in chat {chat_id} after repeated flood limits: {e}.")
+        except Exception as e:
+            logger.error(f"Unexpected error checking member {user_id} in chat {chat_id}: {e}", exc_info=True)
+        return ERROR
+
+    async def get_statuses(self, bot, chat_id, user_ids) -> dict:
+        """Look up every user in *user_ids* concurrently. Returns {user_id: status}."""
+        user_ids = list(user_ids)
+        statuses = await asyncio.gather(*(self.get_status(bot, chat_id, uid) for uid in user_ids))
+        return dict(zip(user_ids, statuses))
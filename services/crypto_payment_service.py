@@ -1,26 +1,36 @@
 # services/crypto_payment_service.py
 
+import asyncio
+import json
 import logging
 import time
 import requests
 from datetime import datetime, timedelta
+from decimal import Decimal
+
+import httpx
 
 import config
+from database.async_queries import AsyncDatabaseQueries
 
 logger = logging.getLogger(__name__)
 
 # Constants for TronGrid API
 # USDT on TRON typically has 6 decimal places
 USDT_DECIMALS = 6 
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Upper bound on how long a TRON transfer takes to show up as confirmed on TronGrid
+CONFIRMATION_LAG_SECONDS = 120
 
 class CryptoPaymentService:
     @staticmethod
     def get_final_usdt_payment_amount(base_usdt_amount_rounded_to_3_decimals: float) -> float:
         """
-        Returns the final USDT amount to be paid by the user.
+        Returns the base USDT amount to be paid by the user.
         This is typically the base USDT amount for the plan, already converted from Rial 
         and rounded up to 3 decimal places.
-        No unique offset is added here as per the new requirement.
+        The per-request unique micro-USDT offset is added when the request is stored
+        (DatabaseQueries.create_crypto_payment_request), so this value is not yet final.
         The amount is returned rounded to USDT_DECIMALS (e.g., 6) for consistency, 
         but the value itself will effectively be the 3-decimal rounded input.
         Example: input 0.061 -> output 0.061000 (if USDT_DECIMALS is 6)
@@ -37,34 +47,300 @@ class CryptoPaymentService:
         logger.info(f"Final USDT payment amount determined: {final_amount} from base: {base_usdt_amount_rounded_to_3_decimals}")
         return final_amount
 
+class UsdtTransferWatcher:
+    """Watches incoming USDT-TRC20 transfers to our wallet through TronGrid.
+
+    Each ``poll_once()`` reads only transfers newer than a cursor persisted in
+    sync_watermarks: the block timestamp the current query started from, the
+    TronGrid page ``fingerprint`` to resume from, and the ids of transfers already
+    seen at the newest block timestamp (``min_timestamp`` is inclusive). Every
+    transfer is matched by exact amount against pending crypto_payments requests
+    that were open at its block time; a match is marked paid and ``on_paid`` is
+    awaited with the request row and the transfer, e.g. to activate the plan.
+
+    Pending requests are expired only after the transfers have been matched and the
+    cursor has caught up, and only once ``expiry_grace`` seconds have passed since
+    their expires_at, so a payment made in time but seen late (confirmation lag,
+    poll interval, downtime) still pays its request.
+
+    Paid requests that are still not activated ``activation_retry_after`` seconds
+    later (failed or interrupted activation) are handed to ``on_paid`` again, with
+    ``{'transaction_id': ..., 'retry': True}`` in place of the transfer.
+
+    A transfer that more than one open request could have paid is not matched:
+    those requests are moved to 'needs_review' and ``on_review`` is awaited with
+    them and the transfer, so an admin can assign the payment by hand.
+
+    If recording a match fails in the database, the poll stops before that transfer
+    without moving the cursor past it, so the next poll processes it again.
+    """
+
+    CURSOR_NAME = "trongrid_usdt_transfers"
+
+    def __init__(self, wallet_address: str, contract_address: str, api_key: str = None,
+                 base_url: str = "https://api.trongrid.io", page_size: int = 200, max_pages: int = 20,
+                 timeout: float = 10, lookback_minutes: int = 30, transport=None, on_paid=None,
+                 activation_retry_after: float = 300, on_review=None, expiry_grace: float = CONFIRMATION_LAG_SECONDS):
+        self.wallet_address = wallet_address
+        self.contract_address = contract_address
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.page_size = max(1, min(int(page_size), 200))
+        self.max_pages = max(1, int(max_pages))
+        self.timeout = timeout
+        self.lookback_minutes = lookback_minutes
+        self.on_paid = on_paid
+        self.on_review = on_review
+        self.activation_retry_after = activation_retry_after
+        self.expiry_grace = expiry_grace
+        self._transport = transport
+        self._client = None
+        self._client_loop = None
+        self._lock = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # The client's connection pool belongs to the running event loop
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            headers = {"TRON-PRO-API-KEY": self.api_key} if self.api_key else {}
+            self._client = httpx.AsyncClient(
+                headers=headers,
+                timeout=httpx.Timeout(self.timeout, connect=5),
+                limits=httpx.Limits(max_connections=2, max_keepalive_connections=1),
+                transport=self._transport,
+            )
+            self._client_loop = loop
+            self._lock = asyncio.Lock()
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
+
+    async def fetch_transfers(self, min_timestamp: int, fingerprint: str = None):
+        """One page of incoming transfers at or after *min_timestamp* (ms), oldest first.
+
+        Returns (transfers, next_fingerprint); next_fingerprint is None on the last page.
+        """
+        params = {
+            'only_to': 'true',
+            'only_confirmed': 'true',
+            'contract_address': self.contract_address,
+            'order_by': 'block_timestamp,asc',
+            'limit': self.page_size,
+            'min_timestamp': int(min_timestamp),
+        }
+        if fingerprint:
+            params['fingerprint'] = fingerprint
+        response = await self._get_client().get(
+            f"{self.base_url}/v1/accounts/{self.wallet_address}/transactions/trc20", params=params
+        )
+        response.raise_for_status()
+        data = response.json()
+        if not data.get('success', True):
+            raise ValueError(f"TronGrid request failed: {data}")
+        return data.get('data') or [], (data.get('meta') or {}).get('fingerprint')
+
+    def _initial_cursor(self) -> dict:
+        start = int((time.time() - self.lookback_minutes * 60) * 1000)
+        return {'min_timestamp': start, 'fingerprint': None, 'last_timestamp': start, 'seen': []}
+
+    async def _load_cursor(self) -> dict:
+        raw = await AsyncDatabaseQueries.get_sync_watermark(self.CURSOR_NAME)
+        if raw:
+            try:
+                return json.loads(raw)
+            except (ValueError, TypeError):
+                logger.error(f"Ignoring unreadable TronGrid cursor: {raw!r}")
+        return self._initial_cursor()
+
+    async def poll_once(self) -> dict:
+        """Process transfers since the cursor. Returns counts of what was seen."""
+        summary = {'pages': 0, 'transfers': 0, 'matched': 0, 'unmatched': 0, 'needs_review': 0, 'failed': 0, 'expired': 0, 'retried': 0}
+        self._get_client()
+        if self._lock.locked():
+            return summary  # previous poll still running
+        async with self._lock:
+            caught_up = False
+            cursor = await self._load_cursor()
+            for _ in range(self.max_pages):
+                try:
+                    transfers, next_fingerprint = await self.fetch_transfers(cursor['min_timestamp'], cursor['fingerprint'])
+                except (httpx.HTTPError, ValueError) as e:
+                    logger.error(f"Error fetching USDT transfers from TronGrid: {e}")
+                    break
+                summary['pages'] += 1
+
+                failed = False
+                for transfer in transfers:
+                    block_timestamp = int(transfer['block_timestamp'])
+                    transaction_id = transfer['transaction_id']
+                    if block_timestamp < cursor['last_timestamp'] or (
+                            block_timestamp == cursor['last_timestamp'] and transaction_id in cursor['seen']):
+                        continue
+                    summary['transfers'] += 1
+                    result = await self._process_transfer(transfer)
+                    summary[result] += 1
+                    if result == 'failed':
+                        failed = True
+                        break
+                    if block_timestamp > cursor['last_timestamp']:
+                        cursor['last_timestamp'], cursor['seen'] = block_timestamp, [transaction_id]
+                    else:
+                        cursor['seen'].append(transaction_id)
+                if failed:
+                    # Keep this page's fingerprint: the failed transfer is read again next poll
+                    logger.error(f"Stopping USDT transfer watch at transaction {transaction_id}; it is retried next poll.")
+                    await AsyncDatabaseQueries.set_sync_watermark(self.CURSOR_NAME, json.dumps(cursor))
+                    break
+
+                cursor['fingerprint'] = next_fingerprint
+                if not next_fingerprint:
+                    cursor['min_timestamp'] = cursor['last_timestamp']
+                await AsyncDatabaseQueries.set_sync_watermark(self.CURSOR_NAME, json.dumps(cursor))
+                if not next_fingerprint:
+                    caught_up = True
+                    break
+            if caught_up:
+                # Expire only once every transfer up to now has had its chance to match
+                expire_before = datetime.now() - timedelta(seconds=self.expiry_grace)
+                summary['expired'] = await AsyncDatabaseQueries.expire_crypto_payments(expire_before.strftime(DATE_FORMAT))
+            summary['retried'] = await self._retry_unactivated()
+            if summary['transfers'] or summary['expired'] or summary['retried']:
+                logger.info(f"USDT transfer watch: {summary}")
+            return summary
+
+    async def _retry_unactivated(self) -> int:
+        if not self.on_paid:
+            return 0
+        updated_before = (datetime.now() - timedelta(seconds=self.activation_retry_after)).strftime(DATE_FORMAT)
+        payments = await AsyncDatabaseQueries.get_unactivated_crypto_payments(updated_before)
+        for payment in payments:
+            logger.warning(f"Retrying activation of paid crypto payment {payment['payment_id']}.")
+            try:
+                await self.on_paid(payment, {'transaction_id': payment['transaction_id'], 'retry': True})
+            except Exception as e:
+                logger.error(f"Error retrying paid crypto payment {payment['payment_id']}: {e}", exc_info=True)
+        return len(payments)
+
+    async def _process_transfer(self, transfer: dict) -> str:
+        """Match one transfer. Returns the summary key: 'matched', 'unmatched', 'needs_review' or 'failed'."""
+        token = transfer.get('token_info') or {}
+        if transfer.get('to') != self.wallet_address or token.get('address', self.contract_address) != self.contract_address:
+            return 'unmatched'
+        decimals = int(token.get('decimals', USDT_DECIMALS))
+        amount = Decimal(str(transfer['value'])) / (Decimal(10) ** decimals)
+        paid_at = datetime.fromtimestamp(int(transfer['block_timestamp']) / 1000).strftime(DATE_FORMAT)
+
+        candidates = await AsyncDatabaseQueries.find_pending_crypto_payments(float(amount), paid_at)
+        if not candidates:
+            logger.info(f"USDT transfer {transfer['transaction_id']} of {amount} matches no pending request.")
+            return 'unmatched'
+        if len(candidates) > 1:
+            return await self._send_to_review(candidates, transfer, amount)
+        request = candidates[0]
+        paid = await AsyncDatabaseQueries.mark_crypto_payment_paid(request['payment_id'], transfer['transaction_id'], float(amount))
+        if paid is None:
+            return 'failed'
+        if not paid:
+            return 'unmatched'
+        logger.info(f"Crypto payment {request['payment_id']} paid by transaction {transfer['transaction_id']} ({amount} USDT).")
+        if self.on_paid:
+            try:
+                await self.on_paid(request, transfer)
+            except Exception as e:
+                logger.error(f"Error handling paid crypto payment {request['payment_id']}: {e}", exc_info=True)
+        return 'matched'
+
+    async def _send_to_review(self, candidates: list, transfer: dict, amount: Decimal) -> str:
+        payment_ids = [request['payment_id'] for request in candidates]
+        logger.warning(f"USDT transfer {transfer['transaction_id']} of {amount} matches {len(candidates)} pending requests "
+                       f"({', '.join(payment_ids)}); sending them to manual review.")
+        if await AsyncDatabaseQueries.mark_crypto_payments_for_review(payment_ids, float(amount)) is None:
+            return 'failed'
+        if self.on_review:
+            try:
+                await self.on_review(candidates, transfer)
+            except Exception as e:
+                logger.error(f"Error reporting crypto payments {payment_ids} for review: {e}", exc_info=True)
+        return 'needs_review'
+
+
+async def activate_crypto_payment(payment: dict):
+    """Activate or extend the plan a paid crypto request was for. Returns the subscription id or None.
+
+    The request is recorded as a payments row whose id goes to add_subscription, so
+    a retried activation never extends the plan twice. On failure the request stays
+    paid but not activated, and the watcher retries it later.
+    """
+    subscription_id = None
+    plan = await AsyncDatabaseQueries.get_plan_by_id(payment.get('plan_id')) if payment.get('plan_id') else None
+    if not plan:
+        logger.error(f"Crypto payment {payment['payment_id']} was paid but its plan ({payment.get('plan_id')}) was not found.")
+    else:
+        linked_payment_id = await AsyncDatabaseQueries.link_crypto_payment_record(payment['payment_id'])
+        if not linked_payment_id:
+            logger.error(f"Could not record a payment row for paid crypto payment {payment['payment_id']}.")
+        else:
+            subscription_id = await AsyncDatabaseQueries.add_subscription(
+                user_id=payment['user_id'],
+                plan_id=plan['id'],
+                payment_id=linked_payment_id,
+                plan_duration_days=plan['days'],
+                amount_paid=payment['rial_amount'],
+                payment_method='crypto'
+            )
+    await AsyncDatabaseQueries.record_crypto_payment_activation(payment['payment_id'], subscription_id)
+    return subscription_id
+
+
+async def find_usdt_payment(unique_expected_amount: float, search_start_time: datetime, watcher: "UsdtTransferWatcher" = None):
+    """First incoming transfer of exactly *unique_expected_amount* USDT since *search_start_time*, or None."""
+    watcher = watcher or usdt_transfer_watcher
+    expected = round(Decimal(str(unique_expected_amount)) * 10 ** USDT_DECIMALS)
+    fingerprint = None
+    for _ in range(watcher.max_pages):
+        transfers, fingerprint = await watcher.fetch_transfers(int(search_start_time.timestamp() * 1000), fingerprint)
+        for transfer in transfers:
+            decimals = int((transfer.get('token_info') or {}).get('decimals', USDT_DECIMALS))
+            if Decimal(str(transfer['value'])) * Decimal(10) ** (USDT_DECIMALS - decimals) == expected:
+                return transfer
+        if not fingerprint:
+            break
+    return None
+
+
+usdt_transfer_watcher = UsdtTransferWatcher(
+    wallet_address=config.CRYPTO_WALLET_ADDRESS,
+    contract_address=config.USDT_TRC20_CONTRACT_ADDRESS,
+    api_key=config.TRONGRID_API_KEY if config.TRONGRID_API_KEY != config._KEY_NOT_SET_PLACEHOLDER else None,
+    base_url=getattr(config, 'TRONGRID_API_URL', "https://api.trongrid.io"),
+    page_size=getattr(config, 'CRYPTO_WATCH_PAGE_SIZE', 200),
+    lookback_minutes=config.CRYPTO_PAYMENT_TIMEOUT_MINUTES,
+    expiry_grace=getattr(config, 'CRYPTO_WATCH_INTERVAL', 0) + CONFIRMATION_LAG_SECONDS,
+)
+
 # Example usage (for testing purposes, normally called from bot handlers)
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     logger.info("Testing crypto_payment_service...")
 
-    # Test exchange rate
-    rate = CryptoPaymentService.get_usdt_to_rial_exchange_rate()
-    logger.info(f"Current USDT to RIAL (placeholder): {rate}")
-
-    # Test unique amount calculation
-    test_rial_amount = 2500000 # 2,500,000 Rials
-    test_payment_id = 123
-    unique_usdt = CryptoPaymentService.calculate_unique_usdt_amount(test_rial_amount, test_payment_id)
-    logger.info(f"For {test_rial_amount} RIAL and payment ID {test_payment_id}, unique USDT amount: {unique_usdt}")
-
-    # Test finding a payment (this will likely not find anything without a real transaction)
-    # Set a search start time, e.g., 30 minutes ago
-    # search_from = datetime.now() - timedelta(minutes=30)
-    # found_tx = find_usdt_payment(unique_expected_amount=unique_usdt, search_start_time=search_from)
-    
-    # if found_tx:
-    #     logger.info(f"Found test transaction: {found_tx}")
-    # else:
-    #     logger.info("No matching test transaction found (as expected without a real payment).")
-    
-    # To test find_usdt_payment effectively, you would need to:
-    # 1. Ensure your .env has correct CRYPTO_WALLET_ADDRESS, TRONGRID_API_KEY, USDT_TRC20_CONTRACT_ADDRESS.
-    # 2. Manually send a USDT (TRC20) transaction to your CRYPTO_WALLET_ADDRESS with the exact 'unique_usdt' amount.
-    # 3. Run this script shortly after the transaction is broadcast.
-    logger.info("To test find_usdt_payment, uncomment the section and make a real test transaction.")
+    test_usdt_amount = CryptoPaymentService.get_final_usdt_payment_amount(12.345)
+    logger.info(f"Final USDT amount for a 12.345 USDT plan: {test_usdt_amount}")
+
+    # Looks for a real transfer of exactly test_usdt_amount to CRYPTO_WALLET_ADDRESS in the last 30 minutes.
+    # Needs CRYPTO_WALLET_ADDRESS, TRONGRID_API_KEY and USDT_TRC20_CONTRACT_ADDRESS in .env.
+    async def _search():
+        try:
+            return await find_usdt_payment(test_usdt_amount, datetime.now() - timedelta(minutes=30))
+        finally:
+            await usdt_transfer_watcher.close()
+
+    found_tx = asyncio.run(_search())
+    if found_tx:
+        logger.info(f"Found test transaction: {found_tx}")
+    else:
+        logger.info("No matching test transaction found (as expected without a real payment).")
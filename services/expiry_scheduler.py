@@ -0,0 +1,80 @@
+"""
+Min-heap of upcoming subscription expiries for the Manager Bot
+"""
+
+import heapq
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class ExpiryScheduler:
+    """Tracks when each user's (latest) active subscription ends.
+
+    Entries are kept in a min-heap keyed by end date. Rescheduling a user (e.g.
+    after a renewal) just pushes a new entry; the superseded one is skipped when
+    it reaches the top, so updates are O(log n) without searching the heap.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []      # (end_datetime, user_id)
+        self._latest = {}    # user_id -> end_datetime currently scheduled
+
+    @staticmethod
+    def _parse(end_date):
+        if isinstance(end_date, datetime):
+            return end_date
+        try:
+            return datetime.strptime(str(end_date)[:19], DATE_FORMAT)
+        except ValueError:
+            logger.warning(f"ExpiryScheduler: could not parse end_date '{end_date}'.")
+            return None
+
+    def schedule(self, user_id, end_date) -> bool:
+        """Schedule (or reschedule) *user_id* to expire at *end_date*."""
+        end_dt = self._parse(end_date)
+        if end_dt is None:
+            return False
+        with self._lock:
+            if self._latest.get(user_id) == end_dt:
+                return False
+            self._latest[user_id] = end_dt
+            heapq.heappush(self._heap, (end_dt, user_id))
+        return True
+
+    def cancel(self, user_id):
+        with self._lock:
+            self._latest.pop(user_id, None)
+
+    def _drop_superseded(self):
+        while self._heap and self._latest.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        """Datetime of the earliest scheduled expiry, or None."""
+        with self._lock:
+            self._drop_superseded()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime = None) -> list:
+        """Remove and return the users whose subscription has ended by *now*."""
+        now = now or datetime.now()
+        due = []
+        with self._lock:
+            while True:
+                self._drop_superseded()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, user_id = heapq.heappop(self._heap)
+                del self._latest[user_id]
+                due.append(user_id)
+        return due
+
+    def __len__(self):
+        with self._lock:
+            return len(self._latest)
@@ -0,0 +1,45 @@
+"""
+Per-pass subscriber snapshot shared by all channels during membership validation
+"""
+
+import logging
+from datetime import datetime
+
+from database.async_queries import AsyncDatabaseQueries
+
+logger = logging.getLogger(__name__)
+
+
+class MembershipSnapshot:
+    """Everything a validation pass needs from the database, read once.
+
+    ``load()`` marks lapsed subscriptions inactive (once per pass), then reads the
+    active subscriber ids and the kick feed. Every channel is validated against the
+    same snapshot, so K channels cost one set of queries instead of K.
+    """
+
+    def __init__(self, started_at: str, watermark, active_user_ids: set, non_active_records: list):
+        self.started_at = started_at
+        self.watermark = watermark
+        self.active_user_ids = active_user_ids
+        self.non_active_records = non_active_records
+
+    @classmethod
+    async def load(cls, watermark_name: str):
+        started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        watermark = await AsyncDatabaseQueries.get_sync_watermark(watermark_name)
+        await AsyncDatabaseQueries.mark_expired_active_subscriptions()
+
+        active = await AsyncDatabaseQueries.get_all_active_subscribers()
+        active_user_ids = {row['user_id'] for row in active}
+
+        # Only subscriptions that became non-active since the last successful pass are
+        # re-checked; the very first pass (no watermark yet) walks the full history.
+        if watermark:
+            records = await AsyncDatabaseQueries.get_newly_inactive_subscription_users(watermark)
+        else:
+            records = await AsyncDatabaseQueries.get_users_with_non_active_subscription_records()
+        snapshot = cls(started_at, watermark, active_user_ids, records or [])
+        logger.info(f"Membership snapshot: {len(active_user_ids)} active subscriber(s), "
+                    f"{len(snapshot.non_active_records)} non-active record(s) since {watermark or 'the beginning'}.")
+        return snapshot
@@ -0,0 +1,289 @@
+"""
+Rate-limited outbound message dispatcher shared by the Main and Manager bots
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Lower value = sent first
+PRIORITY_HIGH = 0      # error reports, admin alerts
+PRIORITY_NORMAL = 1    # user-facing notifications
+PRIORITY_LOW = 2       # bulk runs (reminders, broadcasts)
+
+
+class TokenBucket:
+    """Classic token bucket; ``reserve()`` takes one token and returns how long to wait for it.
+
+    Tokens may go negative, which turns the bucket into a queue of reservations:
+    the n-th caller past the burst waits n / rate seconds.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float = None) -> float:
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def penalize(self, seconds: float, now: float = None):
+        """Make the next reservation wait at least *seconds* (used for RetryAfter)."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def wait_time(self, now: float = None) -> float:
+        """How long until a token is available, without taking it."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def is_idle(self, now: float) -> bool:
+        return self.rate <= 0 or self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class _Job:
+    __slots__ = ('bot', 'chat_id', 'func', 'kwargs', 'future', 'attempt', 'enqueued_at')
+
+    def __init__(self, bot, chat_id, func, kwargs, future):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.func = func
+        self.kwargs = kwargs
+        self.future = future
+        self.attempt = 0
+        self.enqueued_at = time.monotonic()
+
+
+class MessageDispatcher:
+    """Sends Bot API messages through one priority queue and a pool of workers.
+
+    Every send takes a token from the bot's global bucket (``global_rate`` messages
+    per second) and from the target chat's bucket (``per_chat_rate``). A
+    ``RetryAfter`` penalizes both buckets by the requested time and re-queues the
+    message (up to ``max_retries`` times). Any other error is raised to the caller,
+    so ``send_message()`` behaves like ``bot.send_message()`` with pacing.
+
+    Only the global bucket makes a worker wait. A message whose chat bucket is
+    not ready is set aside and re-queued when it is, so one busy or flood-limited
+    chat never holds the workers the other chats need.
+    """
+
+    def __init__(self, global_rate: float = 30.0, per_chat_rate: float = 1.0, workers: int = 8, max_retries: int = 3):
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.workers = max(1, int(workers))
+        self.max_retries = max(0, int(max_retries))
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+        self._seq = itertools.count()
+        self._global_buckets = {}   # bot key -> TokenBucket
+        self._chat_buckets = {}     # (bot key, chat_id) -> TokenBucket
+        self._deferred = {}         # job -> (priority, TimerHandle) waiting for its chat bucket
+        self._stats = {
+            'submitted': 0,
+            'sent': 0,
+            'failed': 0,
+            'retried': 0,
+            'deferred': 0,
+            'max_depth': 0,
+            'total_latency': 0.0,
+        }
+
+    @staticmethod
+    def _bot_key(bot):
+        # Telegram's global limit applies per bot token
+        return getattr(bot, 'token', None) or id(bot)
+
+    def _ensure_started(self):
+        # Queue and workers are bound to the running loop and created lazily
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.PriorityQueue()
+            self._tasks = []
+            self._deferred = {}
+        if not self._tasks:
+            self._tasks = [loop.create_task(self._worker(), name=f"message-dispatcher-{i}") for i in range(self.workers)]
+            logger.info(f"Message dispatcher started with {self.workers} worker(s).")
+
+    def submit(self, bot, chat_id, text, priority: int = PRIORITY_NORMAL, **kwargs) -> asyncio.Future:
+        """Queue a send_message call and return a future resolving to the sent Message."""
+        return self.submit_call(bot, chat_id, bot.send_message, priority=priority, chat_id=chat_id, text=text, **kwargs)
+
+    def submit_call(self, bot, rate_key, func, /, priority: int = PRIORITY_NORMAL, **kwargs) -> asyncio.Future:
+        """Queue any Bot API method that sends into the chat *rate_key* (e.g. bot.copy_message)."""
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._enqueue(priority, _Job(bot, rate_key, func, kwargs, future))
+        self._stats['submitted'] += 1
+        return future
+
+    async def send_message(self, bot, chat_id, text, priority: int = PRIORITY_NORMAL, **kwargs):
+        """Send a message through the dispatcher and wait for the result."""
+        return await self.submit(bot, chat_id, text, priority=priority, **kwargs)
+
+    def _enqueue(self, priority, job):
+        self._queue.put_nowait((priority, next(self._seq), job))
+        self._stats['max_depth'] = max(self._stats['max_depth'], self._queue.qsize())
+
+    def _defer(self, priority, job, delay: float):
+        """Re-queue *job* after *delay* seconds without holding a worker."""
+        handle = self._loop.call_later(delay, self._undefer, job)
+        self._deferred[job] = (priority, handle)
+        self._stats['deferred'] += 1
+
+    def _undefer(self, job):
+        entry = self._deferred.pop(job, None)
+        if entry is not None:
+            self._enqueue(entry[0], job)
+
+    def _chat_bucket(self, job, now: float) -> TokenBucket:
+        key = (self._bot_key(job.bot), job.chat_id)
+        chat_bucket = self._chat_buckets.get(key)
+        if chat_bucket is None:
+            if len(self._chat_buckets) > 10000:
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.is_idle(now)}
+            chat_bucket = self._chat_buckets[key] = TokenBucket(self.per_chat_rate)
+        return chat_bucket
+
+    def _reserve(self, job) -> float:
+        """Take the job's tokens. Returns how long to wait for the global one (the chat one must be ready)."""
+        now = time.monotonic()
+        bot_key = self._bot_key(job.bot)
+        global_bucket = self._global_buckets.get(bot_key)
+        if global_bucket is None:
+            global_bucket = self._global_buckets[bot_key] = TokenBucket(self.global_rate, self.global_rate)
+        self._chat_bucket(job, now).reserve(now)
+        return global_bucket.reserve(now)
+
+    def _penalize(self, job, seconds: float):
+        bot_key = self._bot_key(job.bot)
+        for bucket in (self._global_buckets.get(bot_key), self._chat_buckets.get((bot_key, job.chat_id))):
+            if bucket is not None:
+                bucket.penalize(seconds)
+
+    @staticmethod
+    def _retry_seconds(error: RetryAfter) -> float:
+        retry_after = error.retry_after
+        if isinstance(retry_after, timedelta):
+            return retry_after.total_seconds()
+        return float(retry_after)
+
+    async def _worker(self):
+        while True:
+            priority, _, job = await self._queue.get()
+            try:
+                if job.future.cancelled():
+                    continue
+                chat_wait = self._chat_bucket(job, time.monotonic()).wait_time()
+                if chat_wait > 0:
+                    self._defer(priority, job, chat_wait)
+                    continue
+                delay = self._reserve(job)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    result = await job.func(**job.kwargs)
+                except RetryAfter as e:
+                    if job.attempt >= self.max_retries:
+                        self._fail(job, e)
+                        continue
+                    seconds = self._retry_seconds(e)
+                    self._penalize(job, seconds)
+                    job.attempt += 1
+                    self._stats['retried'] += 1
+                    logger.warning(f"Flood limit sending to chat {job.chat_id}: retrying in {seconds:.1f}s "
+                                   f"(attempt {job.attempt}/{self.max_retries}).")
+                    self._enqueue(priority, job)
+                    continue
+                except Exception as e:
+                    self._fail(job, e)
+                    continue
+                self._stats['sent'] += 1
+                self._stats['total_latency'] += time.monotonic() - job.enqueued_at
+                if not job.future.done():
+                    job.future.set_result(result)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            finally:
+                self._queue.task_done()
+
+    async def _drain(self):
+        # Deferred jobs are outside the queue until their chat bucket is ready
+        while True:
+            await self._queue.join()
+            if not self._deferred:
+                return
+            await asyncio.sleep(0.05)
+
+    def _fail(self, job, error):
+        self._stats['failed'] += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    async def stop(self, timeout: float = 10.0):
+        """Wait up to *timeout* seconds for queued messages, then stop the workers."""
+        if not self._tasks or self._loop is not asyncio.get_running_loop():
+            self._tasks = []
+            return
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Message dispatcher stopped with {self._queue.qsize() + len(self._deferred)} "
+                           f"message(s) still queued.")
+        deferred, self._deferred = self._deferred, {}
+        for job, (_, handle) in deferred.items():
+            handle.cancel()
+            if not job.future.done():
+                job.future.cancel()
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while not self._queue.empty():
+            _, _, job = self._queue.get_nowait()
+            self._queue.task_done()
+            if not job.future.done():
+                job.future.cancel()
+        logger.info(f"Message dispatcher stopped. Stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats['depth'] = (self._queue.qsize() if self._queue is not None else 0) + len(self._deferred)
+        stats['avg_latency'] = round(stats.pop('total_latency') / stats['sent'], 3) if stats['sent'] else 0.0
+        return stats
+
+
+message_dispatcher = MessageDispatcher(
+    global_rate=getattr(config, 'MESSAGE_DISPATCH_GLOBAL_RATE', 30),
+    per_chat_rate=getattr(config, 'MESSAGE_DISPATCH_PER_CHAT_RATE', 1),
+    workers=getattr(config, 'MESSAGE_DISPATCH_WORKERS', 8),
+    max_retries=getattr(config, 'MESSAGE_DISPATCH_MAX_RETRIES', 3),
+)
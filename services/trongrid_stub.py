@@ -0,0 +1,70 @@
+"""
+In-memory stand-in for the TronGrid TRC-20 transfers API, for tests and local runs
+"""
+
+import itertools
+import threading
+
+import httpx
+
+USDT_TRC20_DECIMALS = 6
+
+
+class StubTronGrid:
+    """Serves ``GET /v1/accounts/{address}/transactions/trc20`` like TronGrid.
+
+    ``add_transfer()`` records a transfer; ``transport`` is an httpx transport that
+    answers with TronGrid's JSON shape and honours ``only_to``, ``contract_address``,
+    ``min_timestamp``, ``order_by=block_timestamp,asc``, ``limit`` and ``fingerprint``
+    paging. ``requests`` keeps the query parameters of every call.
+    """
+
+    def __init__(self, contract_address: str = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"):
+        self.contract_address = contract_address
+        self.requests = []
+        self._transfers = []
+        self._lock = threading.Lock()
+        self._tx_counter = itertools.count(1)
+        self.transport = httpx.MockTransport(self._handle)
+
+    def add_transfer(self, to_address: str, amount_usdt, block_timestamp: int, from_address: str = "TSenderStub",
+                     contract_address: str = None, transaction_id: str = None) -> str:
+        """Record a confirmed transfer of *amount_usdt* at *block_timestamp* (ms). Returns its transaction id."""
+        transaction_id = transaction_id or f"{next(self._tx_counter):064x}"
+        with self._lock:
+            self._transfers.append({
+                'transaction_id': transaction_id,
+                'token_info': {'symbol': 'USDT', 'address': contract_address or self.contract_address,
+                               'decimals': USDT_TRC20_DECIMALS, 'name': 'Tether USD'},
+                'block_timestamp': block_timestamp,
+                'from': from_address,
+                'to': to_address,
+                'type': 'Transfer',
+                'value': str(round(float(amount_usdt) * 10 ** USDT_TRC20_DECIMALS)),
+            })
+        return transaction_id
+
+    def _handle(self, request: httpx.Request) -> httpx.Response:
+        parts = request.url.path.strip("/").split("/")
+        if len(parts) != 5 or parts[:2] != ["v1", "accounts"] or parts[3:] != ["transactions", "trc20"]:
+            return httpx.Response(404, json={'success': False, 'error': 'not found'})
+        address = parts[2]
+        params = request.url.params
+        self.requests.append(dict(params))
+
+        limit = min(int(params.get('limit', 20)), 200)
+        min_timestamp = int(params.get('min_timestamp', 0))
+        offset = int(params.get('fingerprint') or 0)
+        with self._lock:
+            matching = [
+                t for t in self._transfers
+                if t['block_timestamp'] >= min_timestamp
+                and (t['to'] == address or (params.get('only_to') != 'true' and t['from'] == address))
+                and (not params.get('contract_address') or t['token_info']['address'] == params['contract_address'])
+            ]
+        matching.sort(key=lambda t: (t['block_timestamp'], t['transaction_id']))
+        page = matching[offset:offset + limit]
+        meta = {'page_size': len(page)}
+        if offset + limit < len(matching):
+            meta['fingerprint'] = str(offset + limit)
+        return httpx.Response(200, json={'data': page, 'success': True, 'meta': meta})
@@ -0,0 +1,168 @@
+"""
+Background verification of Zarinpal payments left in pending_verification
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from database.async_queries import AsyncDatabaseQueries
+from utils.constants.all_constants import ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_ALREADY_VERIFIED_STATUS
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+async def activate_zarinpal_payment(payment_id: int, user_id: int, plan_id: int, amount, ref_id=None):
+    """Apply a completed Zarinpal payment to the user's subscription. Returns the subscription id or None.
+
+    add_subscription applies a payment_id at most once, so every path that sees the
+    payment completed calls this; a payment left without a subscription is retried by
+    the reconciler.
+    """
+    plan = await AsyncDatabaseQueries.get_plan_by_id(plan_id)
+    if not plan:
+        logger.error(f"Payment {payment_id} verified (RefID {ref_id}) but plan {plan_id} was not found; subscription not activated.")
+        return None
+    subscription_id = await AsyncDatabaseQueries.add_subscription(
+        user_id=user_id,
+        plan_id=plan_id,
+        payment_id=payment_id,
+        plan_duration_days=plan['days'],
+        amount_paid=amount,
+        payment_method='zarinpal'
+    )
+    if not subscription_id:
+        logger.error(f"Payment {payment_id} verified (RefID {ref_id}) but the subscription could not be activated.")
+    return subscription_id
+
+
+async def complete_verified_payment(payment_id: int, user_id: int, plan_id: int, amount, ref_id):
+    """Mark a gateway-verified payment completed and make sure its subscription is activated.
+
+    Returns (claimed, subscription_id). ``claimed`` is False when another path
+    (the user's deep link or an earlier reconciler run) already completed the
+    payment; the activation is still run, and returns the subscription that path
+    activated without extending it again. It is None if the claim could not be
+    recorded (database error); the payment stays pending and nothing is activated.
+    """
+    claimed = await AsyncDatabaseQueries.claim_payment_completion(payment_id, str(ref_id) if ref_id else None)
+    if claimed is None:
+        return None, None
+    subscription_id = await activate_zarinpal_payment(payment_id, user_id, plan_id, amount, ref_id)
+    return claimed, subscription_id
+
+
+class ZarinpalReconciler:
+    """Verifies aged pending_verification Zarinpal payments in batches.
+
+    Payments untouched for ``min_age`` seconds are verified concurrently through
+    the gateway adapter (its pool bounds the concurrency). Verified ones are
+    completed with ``complete_verified_payment`` and ``on_activated`` is awaited
+    for each newly activated payment (e.g. to notify the user). Unpaid ones are
+    re-checked after another ``min_age`` and expire after ``max_age`` seconds.
+    Gateway outages leave payments untouched for the next run.
+
+    Completed payments still without a subscription ``min_age`` seconds after their
+    last attempt (plan missing, activation failed or interrupted) are activated again.
+    """
+
+    def __init__(self, gateway, batch_size: int = 50, min_age: float = 300, max_age: float = 3600, on_activated=None):
+        self.gateway = gateway
+        self.batch_size = max(1, int(batch_size))
+        self.min_age = min_age
+        self.max_age = max_age
+        self.on_activated = on_activated
+        self._lock = asyncio.Lock()
+
+    async def run_once(self) -> dict:
+        """Reconcile one batch. Returns counts per outcome."""
+        summary = {'checked': 0, 'activated': 0, 'already_completed': 0, 'pending': 0, 'expired': 0, 'unavailable': 0,
+                   'retried': 0}
+        if self._lock.locked():
+            return summary  # previous run still in progress
+        async with self._lock:
+            now = datetime.now()
+            older_than = (now - timedelta(seconds=self.min_age)).strftime(DATE_FORMAT)
+            payments = await AsyncDatabaseQueries.get_stale_pending_zarinpal_payments(older_than, self.batch_size)
+            if payments:
+                outcomes = await asyncio.gather(*(self._reconcile(payment, now) for payment in payments))
+                for outcome in outcomes:
+                    summary[outcome] += 1
+                summary['checked'] = len(payments)
+
+                still_pending = [p['payment_id'] for p, outcome in zip(payments, outcomes) if outcome == 'pending']
+                # Back off: re-checked only after another min_age
+                await AsyncDatabaseQueries.touch_payments(still_pending)
+
+            summary['retried'] = await self._retry_unactivated(older_than)
+            if summary['checked'] or summary['retried']:
+                logger.info(f"Zarinpal reconciliation: {summary}")
+            return summary
+
+    async def _retry_unactivated(self, older_than: str) -> int:
+        payments = await AsyncDatabaseQueries.get_unactivated_zarinpal_payments(older_than, self.batch_size)
+        failed = []
+        for payment in payments:
+            payment_id = payment['payment_id']
+            logger.warning(f"Retrying activation of completed Zarinpal payment {payment_id}.")
+            try:
+                subscription_id = await activate_zarinpal_payment(
+                    payment_id, payment['user_id'], payment['plan_id'], payment['amount'], payment.get('gateway_ref_id')
+                )
+                if not subscription_id:
+                    failed.append(payment_id)
+                elif self.on_activated:
+                    await self.on_activated(payment, payment.get('gateway_ref_id'), subscription_id)
+            except Exception as e:
+                logger.error(f"Error retrying activation of Zarinpal payment {payment_id}: {e}", exc_info=True)
+                failed.append(payment_id)
+        # Back off: retried again only after another min_age
+        await AsyncDatabaseQueries.touch_payments(failed)
+        return len(payments)
+
+    @staticmethod
+    def _parse_payment_date(value):
+        if not value:
+            return None
+        try:
+            return datetime.strptime(str(value)[:19].replace('T', ' '), DATE_FORMAT)
+        except ValueError:
+            return None
+
+    async def _reconcile(self, payment: dict, now: datetime) -> str:
+        payment_id = payment['payment_id']
+        try:
+            result = await self.gateway.verify_payment(amount=int(payment['amount']), authority=payment['transaction_id'])
+            if self.gateway.is_transient(result):
+                return 'unavailable'
+
+            if result.get('status') in (ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_ALREADY_VERIFIED_STATUS):
+                claimed, subscription_id = await complete_verified_payment(
+                    payment_id, payment['user_id'], payment['plan_id'], payment['amount'], result.get('ref_id')
+                )
+                if claimed is None:
+                    return 'unavailable'    # database error; retried on the next run
+                if not claimed:
+                    return 'already_completed'
+                logger.info(f"Reconciler completed Zarinpal payment {payment_id} (RefID {result.get('ref_id')}).")
+                if self.on_activated:
+                    await self.on_activated(payment, result.get('ref_id'), subscription_id)
+                return 'activated'
+
+            # Not paid (yet): give the user until max_age before giving up
+            created = self._parse_payment_date(payment.get('payment_date'))
+            if created is None:
+                # Age unknown, and touching it would keep it pending forever
+                logger.warning(f"Zarinpal payment {payment_id} has no usable payment_date "
+                               f"({payment.get('payment_date')!r}); expiring it as unpaid.")
+            elif (now - created).total_seconds() < self.max_age:
+                return 'pending'
+            if not await AsyncDatabaseQueries.expire_pending_payment(payment_id):
+                return 'already_completed'  # settled by another path since it was read
+            logger.info(f"Zarinpal payment {payment_id} expired unpaid (gateway status {result.get('status')}).")
+            return 'expired'
+        except Exception as e:
+            logger.error(f"Error reconciling Zarinpal payment {payment_id}: {e}", exc_info=True)
+            return 'pending'
@@ -1,8 +1,19 @@
+import asyncio
+import functools
 import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
 from zarinpal.client import ZarinpalClient 
-import logging
+import config
 from config import ZARINPAL_MERCHANT_ID, ZARINPAL_CALLBACK_URL
-from utils.constants.all_constants import ZARINPAL_REQUEST_SUCCESS_STATUS, ZARINPAL_VERIFY_SUCCESS_STATUS
+from services.circuit_breaker import CircuitBreaker
+from services.zarinpal_stub import StubZarinpalService
+from utils.constants.all_constants import (
+    ZARINPAL_REQUEST_SUCCESS_STATUS, ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_ALREADY_VERIFIED_STATUS
+)
 
 
 logger = logging.getLogger(__name__)
@@ -133,3 +144,164 @@ class ZarinpalPaymentService:
         except Exception as e:
             logger.exception(f"Exception during Zarinpal payment verification: {e}")
             return {'status': -100, 'error_message': str(e)}
+
+
+class AsyncZarinpalGateway:
+    """Awaitable adapter over ZarinpalPaymentService.
+
+    The blocking SDK calls run on a bounded thread pool, each with a deadline of
+    ``timeout`` seconds, so a slow gateway never blocks the event loop. Timeouts
+    and unexpected exceptions count as failures for a circuit breaker; while it is
+    open, calls fail fast with ``GATEWAY_UNAVAILABLE_STATUS``. Results keep the
+    ZarinpalPaymentService dict format. Latency per operation is kept in ``stats()``.
+
+    Verification is single-flight per (authority, amount): concurrent callers share
+    one in-flight gateway call, and successful results are cached (up to
+    ``verified_cache_size`` entries) and replayed with status 101, so double taps
+    and repeated deep links cost no extra gateway traffic.
+    """
+
+    GATEWAY_UNAVAILABLE_STATUS = -102
+    GATEWAY_TIMEOUT_STATUS = -103
+    # Results that say nothing about the payment itself; the call may be retried later
+    TRANSIENT_STATUSES = (-100, GATEWAY_UNAVAILABLE_STATUS, GATEWAY_TIMEOUT_STATUS)
+
+    def __init__(self, workers: int = 4, timeout: float = 15, breaker: CircuitBreaker = None,
+                 service=ZarinpalPaymentService, latency_samples: int = 500, verified_cache_size: int = 1024):
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker("zarinpal")
+        self.service = service
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._latencies = {}    # operation -> deque of seconds
+        self._latency_samples = latency_samples
+        self._counters = {'calls': 0, 'failures': 0, 'timeouts': 0, 'short_circuited': 0,
+                          'verify_coalesced': 0, 'verify_cache_hits': 0}
+        self._verify_inflight = {}          # (authority, amount) -> asyncio.Task
+        self._verified = OrderedDict()      # (authority, amount) -> successful result, LRU
+        self._verified_cache_size = max(0, int(verified_cache_size))
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="zarinpal")
+            return self._executor
+
+    def _record_latency(self, operation: str, seconds: float):
+        self._latencies.setdefault(operation, deque(maxlen=self._latency_samples)).append(seconds)
+
+    async def _call(self, operation: str, func, **kwargs) -> dict:
+        if not self.breaker.allow():
+            self._counters['short_circuited'] += 1
+            logger.warning(f"Zarinpal {operation} skipped: gateway circuit is open.")
+            return {'status': self.GATEWAY_UNAVAILABLE_STATUS, 'error_message': 'Zarinpal gateway is temporarily unavailable.'}
+
+        self._counters['calls'] += 1
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        # Every exit records an outcome, otherwise a half-open trial would keep the circuit blocked
+        try:
+            result = await asyncio.wait_for(
+                loop.run_in_executor(self._get_executor(), functools.partial(func, **kwargs)), self.timeout
+            )
+            if not isinstance(result, dict):
+                raise TypeError(f"unexpected result type {type(result).__name__}")
+        except asyncio.TimeoutError:
+            self._record_latency(operation, time.monotonic() - started)
+            self._counters['timeouts'] += 1
+            self._counters['failures'] += 1
+            self.breaker.record_failure()
+            logger.error(f"Zarinpal {operation} timed out after {self.timeout}s.")
+            return {'status': self.GATEWAY_TIMEOUT_STATUS, 'error_message': f'Zarinpal did not answer within {self.timeout} seconds.'}
+        except Exception as e:
+            self._record_latency(operation, time.monotonic() - started)
+            self._counters['failures'] += 1
+            self.breaker.record_failure()
+            logger.exception(f"Zarinpal {operation} failed: {e}")
+            return {'status': -100, 'error_message': str(e)}
+        except BaseException:
+            # Cancelled by the caller or at shutdown: no answer, so the call counts as failed
+            self._counters['failures'] += 1
+            self.breaker.record_failure()
+            raise
+
+        self._record_latency(operation, time.monotonic() - started)
+        if result.get('status') == -100:
+            self._counters['failures'] += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return result
+
+    async def create_payment_request(self, amount: int, description: str, callback_url: str, user_email: str = None, user_mobile: str = None) -> dict:
+        return await self._call(
+            'request', self.service.create_payment_request,
+            amount=amount, description=description, callback_url=callback_url, user_email=user_email, user_mobile=user_mobile
+        )
+
+    async def verify_payment(self, amount: int, authority: str) -> dict:
+        key = (authority, int(amount))
+        cached = self._verified.get(key)
+        if cached is not None:
+            self._verified.move_to_end(key)
+            self._counters['verify_cache_hits'] += 1
+            return {**cached, 'status': ZARINPAL_ALREADY_VERIFIED_STATUS}
+
+        task = self._verify_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._verify_once(key))
+            self._verify_inflight[key] = task
+            task.add_done_callback(lambda _, key=key: self._verify_inflight.pop(key, None))
+        else:
+            self._counters['verify_coalesced'] += 1
+        # A cancelled caller must not cancel the call the others are waiting on
+        return dict(await asyncio.shield(task))
+
+    async def _verify_once(self, key) -> dict:
+        authority, amount = key
+        result = await self._call('verify', self.service.verify_payment, amount=amount, authority=authority)
+        if self._verified_cache_size and result.get('status') in (ZARINPAL_VERIFY_SUCCESS_STATUS, ZARINPAL_ALREADY_VERIFIED_STATUS):
+            self._verified[key] = dict(result)
+            while len(self._verified) > self._verified_cache_size:
+                self._verified.popitem(last=False)
+        return result
+
+    @classmethod
+    def is_transient(cls, result: dict) -> bool:
+        """True if *result* is a gateway outage (timeout, open circuit, exception) rather than an answer."""
+        return not result or result.get('status') in cls.TRANSIENT_STATUSES
+
+    def stats(self) -> dict:
+        stats = dict(self._counters)
+        stats['circuit'] = self.breaker.state
+        for operation, samples in self._latencies.items():
+            ordered = sorted(samples)
+            stats[f'{operation}_latency'] = {
+                'count': len(ordered),
+                'avg': round(sum(ordered) / len(ordered), 3),
+                'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+                'max': round(ordered[-1], 3),
+            }
+        return stats
+
+    def shutdown(self, wait: bool = False):
+        """Stop the worker pool; calls still running in it are abandoned. A new pool is created on demand."""
+        with self._executor_lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            logger.info(f"Zarinpal gateway pool shut down. Stats: {self.stats()}")
+
+
+zarinpal_gateway = AsyncZarinpalGateway(
+    workers=getattr(config, 'ZARINPAL_WORKERS', 4),
+    timeout=getattr(config, 'ZARINPAL_TIMEOUT', 15),
+    breaker=CircuitBreaker(
+        "zarinpal",
+        failure_threshold=getattr(config, 'ZARINPAL_BREAKER_THRESHOLD', 5),
+        reset_timeout=getattr(config, 'ZARINPAL_BREAKER_RESET', 60),
+    ),
+    service=StubZarinpalService if getattr(config, 'ZARINPAL_USE_STUB', False) else ZarinpalPaymentService,
+)
@@ -0,0 +1,64 @@
+"""
+In-memory stand-in for the Zarinpal gateway, for tests and local runs
+"""
+
+import itertools
+import logging
+import threading
+
+from utils.constants.all_constants import ZARINPAL_REQUEST_SUCCESS_STATUS, ZARINPAL_VERIFY_SUCCESS_STATUS
+
+logger = logging.getLogger(__name__)
+
+
+class StubZarinpalService:
+    """Drop-in replacement for ZarinpalPaymentService that never leaves the process.
+
+    Payment requests get sequential authorities; ``mark_paid()`` simulates the user
+    paying at the gateway. ``verify_payment`` answers like Zarinpal: 100 on the
+    first successful verification, 101 afterwards, -51 for unpaid requests, -50 for
+    an amount mismatch and -54 for unknown authorities. ``verify_calls`` counts
+    round trips so tests can assert how often the gateway was hit.
+    """
+
+    _lock = threading.Lock()
+    _counter = itertools.count(1)
+    _payments = {}      # authority -> {'amount': int, 'paid': bool, 'verified': bool, 'ref_id': int}
+    verify_calls = 0
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._payments = {}
+            cls.verify_calls = 0
+
+    @classmethod
+    def create_payment_request(cls, amount: int, description: str, callback_url: str, user_email: str = None, user_mobile: str = None) -> dict:
+        with cls._lock:
+            number = next(cls._counter)
+            authority = f"S{number:035d}"
+            cls._payments[authority] = {'amount': amount, 'paid': False, 'verified': False, 'ref_id': 900000 + number}
+        logger.info(f"Stub Zarinpal payment request created: {authority} ({amount} Rials).")
+        return {'status': ZARINPAL_REQUEST_SUCCESS_STATUS, 'authority': authority,
+                'payment_url': f"https://stub.zarinpal.local/pg/StartPay/{authority}"}
+
+    @classmethod
+    def mark_paid(cls, authority: str):
+        with cls._lock:
+            cls._payments[authority]['paid'] = True
+
+    @classmethod
+    def verify_payment(cls, amount: int, authority: str) -> dict:
+        with cls._lock:
+            cls.verify_calls += 1
+            payment = cls._payments.get(authority)
+            if payment is None:
+                return {'status': -54, 'error_message': 'Invalid authority.'}
+            if not payment['paid']:
+                return {'status': -51, 'error_message': 'Payment was not completed.'}
+            if payment['amount'] != amount:
+                return {'status': -50, 'error_message': 'Amount does not match.'}
+            if payment['verified']:
+                return {'status': 101, 'ref_id': payment['ref_id']}
+            payment['verified'] = True
+            return {'status': ZARINPAL_VERIFY_SUCCESS_STATUS, 'ref_id': payment['ref_id']}
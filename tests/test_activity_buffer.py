@@ -0,0 +1,52 @@
+"""
+تست بافر ثبت آخرین فعالیت کاربران
+"""
+
+import config
+from database.activity_buffer import LastActivityBuffer
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+
+
+def _last_activity(user_id):
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("SELECT last_activity FROM users WHERE user_id = ?", (user_id,))
+        return db.fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_touches_are_coalesced_and_flushed_in_one_batch(tmp_path, monkeypatch):
+    """چند ثبت فعالیت برای یک کاربر باید به یک به‌روزرسانی با آخرین زمان تبدیل شود"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "activity.db"))
+    assert Database.init_database()
+    assert Database.add_user(1) and Database.add_user(2)
+
+    buffer = LastActivityBuffer(max_pending=100)
+    buffer.touch(1, "2030-01-01 10:00:00")
+    buffer.touch(1, "2030-01-01 10:05:00")
+    buffer.touch(2, "2030-01-01 11:00:00")
+    assert buffer.pending_count() == 2
+    assert _last_activity(1) != "2030-01-01 10:05:00"
+
+    assert buffer.flush() == 2
+    assert buffer.pending_count() == 0
+    assert _last_activity(1) == "2030-01-01 10:05:00"
+    assert _last_activity(2) == "2030-01-01 11:00:00"
+    DBConnection.close_pool()
+
+
+def test_buffer_flushes_when_full(tmp_path, monkeypatch):
+    """با رسیدن به سقف بافر، نوشتن بلافاصله انجام می‌شود"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "activity.db"))
+    assert Database.init_database()
+    assert Database.add_user(1) and Database.add_user(2)
+
+    buffer = LastActivityBuffer(max_pending=2)
+    buffer.touch(1, "2030-01-01 10:00:00")
+    buffer.touch(2, "2030-01-01 10:00:00")
+    assert buffer.pending_count() == 0
+    assert _last_activity(2) == "2030-01-01 10:00:00"
+    DBConnection.close_pool()
@@ -0,0 +1,51 @@
+"""
+تست نویسنده دسته‌ای لاگ فعالیت کاربران
+"""
+
+import config
+from database.activity_log_writer import ActivityLogWriter
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+
+
+def _log_count():
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("SELECT COUNT(*) FROM user_activity_logs")
+        return db.fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_queued_logs_are_written_on_stop(tmp_path, monkeypatch):
+    """لاگ‌های صف‌شده باید هنگام توقف نوشته شوند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "logs.db"))
+    assert Database.init_database()
+
+    writer = ActivityLogWriter(max_queue=100, batch_size=10)
+    for i in range(25):
+        assert writer.enqueue(telegram_id=1000 + i, action_type="test_action", details="{}")
+    writer.stop()
+
+    stats = writer.stats()
+    assert _log_count() == 25
+    assert stats['written'] == 25
+    assert stats['failed'] == 0
+    assert stats['depth'] == 0
+    DBConnection.close_pool()
+
+
+def test_full_queue_falls_back_to_synchronous_write(tmp_path, monkeypatch):
+    """در صورت پر بودن صف، لاگ به‌صورت همگام نوشته می‌شود و از دست نمی‌رود"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "logs.db"))
+    assert Database.init_database()
+
+    writer = ActivityLogWriter(max_queue=1, batch_size=10)
+    monkeypatch.setattr(writer, "start", lambda: None)  # keep the queue from draining
+    assert writer.enqueue(telegram_id=1, action_type="queued")
+    assert writer.enqueue(telegram_id=2, action_type="overflow")
+
+    assert writer.stats()['sync_fallback'] == 1
+    assert _log_count() == 1
+    DBConnection.close_pool()
@@ -0,0 +1,107 @@
+"""
+تست پیام همگانی صفحه‌بندی‌شده و قابل ازسرگیری
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from telegram.error import Forbidden
+
+import config
+from database.async_queries import AsyncDatabaseQueries
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+from services.broadcast_service import BroadcastRunner
+from services.message_dispatcher import MessageDispatcher
+
+FMT = "%Y-%m-%d %H:%M:%S"
+
+
+class FakeBot:
+    token = "fake"
+
+    def __init__(self, blocked=()):
+        self.sent = []
+        self.blocked = set(blocked)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.blocked:
+            raise Forbidden("bot was blocked by the user")
+        self.sent.append(chat_id)
+
+
+def _seed_users(user_ids, active_until=None):
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.executemany("INSERT INTO users (user_id, last_activity) VALUES (?, '2020-01-01 00:00:00')", [(u,) for u in user_ids])
+        if active_until:
+            db.executemany(
+                "INSERT INTO subscriptions (user_id, plan_id, start_date, end_date, status) VALUES (?, 1, '2020-01-01 00:00:00', ?, 'active')",
+                [(u, end.strftime(FMT)) for u, end in active_until.items()]
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_targets_are_paged_by_user_id_and_segmented(tmp_path, monkeypatch):
+    """گیرندگان به ترتیب user_id صفحه‌بندی شوند و بخش‌های فعال/در حال انقضا درست فیلتر شوند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "broadcast.db"))
+    assert Database.init_database()
+    now = datetime.now()
+    _seed_users(range(1, 8), active_until={2: now + timedelta(days=30), 3: now + timedelta(days=3), 4: now - timedelta(days=1)})
+
+    assert Database.count_broadcast_targets('all') == 7
+    assert Database.get_broadcast_targets('all', None, 0, 3) == [1, 2, 3]
+    assert Database.get_broadcast_targets('all', None, 3, 3) == [4, 5, 6]
+    assert Database.get_broadcast_targets('active') == [2, 3]
+    assert Database.get_broadcast_targets('active', 2) == []
+    assert Database.get_broadcast_targets('expiring', 7) == [3]
+    DBConnection.close_pool()
+
+
+def test_broadcast_runs_to_completion_and_records_blocked_users(tmp_path, monkeypatch):
+    """پیام همگانی تا انتها ارسال شود، کاربران مسدودکننده ثبت شوند و در ارسال بعدی حذف شوند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "broadcast.db"))
+    assert Database.init_database()
+    _seed_users(range(1, 11))
+    bot = FakeBot(blocked={4, 9})
+    runner = BroadcastRunner(MessageDispatcher(global_rate=0, per_chat_rate=0, workers=4), chunk_size=3, progress_interval=0)
+
+    broadcast_id = Database.create_broadcast(1, 'all', None, "<b>hello</b>", Database.count_broadcast_targets('all'))
+
+    async def run():
+        await runner.run(broadcast_id, bot)
+        await runner.dispatcher.stop()
+
+    asyncio.run(run())
+    job = Database.get_broadcast(broadcast_id)
+    assert job['status'] == 'completed'
+    assert (job['sent_count'], job['blocked_count'], job['failed_count']) == (8, 2, 0)
+    assert job['last_user_id'] == 10
+    assert sorted(bot.sent) == [1, 2, 3, 5, 6, 7, 8, 10]
+    assert Database.count_broadcast_targets('all') == 8
+
+    AsyncDatabaseQueries.shutdown()
+    DBConnection.close_pool()
+
+
+def test_checkpoint_is_not_recorded_when_the_batch_fails(tmp_path, monkeypatch):
+    """اگر ثبت کاربران مسدودکننده شکست بخورد، نقطه ازسرگیری و شمارنده‌ها جلو نروند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "broken.db"))
+    assert Database.init_database()
+    broadcast_id = Database.create_broadcast(1, 'all', None, "hello", 3)
+    assert broadcast_id
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("DROP TABLE bot_blocked_users")
+        db.commit()
+    finally:
+        db.close()
+
+    assert Database.checkpoint_broadcast(broadcast_id, 3, 2, 1, blocked_user_ids=[3]) is False
+    job = Database.get_broadcast(broadcast_id)
+    assert (job['last_user_id'] or 0, job['sent_count'], job['blocked_count']) == (0, 0, 0)
+    DBConnection.close_pool()
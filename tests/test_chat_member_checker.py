@@ -0,0 +1,52 @@
+"""
+تست بررسی هم‌زمان وضعیت اعضای کانال
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest, RetryAfter
+
+from services.chat_member_checker import ChatMemberChecker, NOT_FOUND
+
+
+class FakeBot:
+    def __init__(self, flood_once_for=None):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self.flood_once_for = flood_once_for
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            if user_id == self.flood_once_for:
+                self.flood_once_for = None
+                raise RetryAfter(0)
+            if user_id < 0:
+                raise BadRequest("User not found")
+            return SimpleNamespace(status="member" if user_id % 2 else "left")
+        finally:
+            self.in_flight -= 1
+
+
+def test_statuses_are_fetched_concurrently_within_limit():
+    """تعداد درخواست‌های هم‌زمان نباید از سقف تعیین‌شده بیشتر شود"""
+    bot = FakeBot()
+    checker = ChatMemberChecker(concurrency=3, per_chat_rate=0)
+    statuses = asyncio.run(checker.get_statuses(bot, -100, range(1, 21)))
+    assert len(statuses) == 20
+    assert statuses[1] == "member" and statuses[2] == "left"
+    assert 1 < bot.max_in_flight <= 3
+
+
+def test_retry_after_is_retried_and_not_found_reported():
+    """در صورت RetryAfter درخواست دوباره ارسال شود و کاربر ناموجود مشخص شود"""
+    bot = FakeBot(flood_once_for=5)
+    checker = ChatMemberChecker(concurrency=2, per_chat_rate=0, max_retries=2)
+    statuses = asyncio.run(checker.get_statuses(bot, -100, [5, -1]))
+    assert statuses == {5: "member", -1: NOT_FOUND}
+    assert bot.calls == 3
@@ -0,0 +1,115 @@
+"""
+تست نمایه درون‌حافظه‌ای درخواست‌های معلق پرداخت تتر بر اساس مبلغ
+"""
+
+from datetime import datetime, timedelta
+
+import config
+from database.crypto_request_index import pending_crypto_requests, to_micro_usdt
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+
+FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def _pending_ids(usdt_amount, paid_at):
+    return [row['payment_id'] for row in pending_crypto_requests.candidates(usdt_amount, paid_at)]
+
+
+def test_index_tracks_create_pay_expire_and_rebuild(tmp_path, monkeypatch):
+    """نمایه با ایجاد، پرداخت و انقضا به‌روز بماند و پس از بازسازی از پایگاه داده همان نتیجه را بدهد"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "crypto_index.db"))
+    assert Database.init_database()
+    assert Database.rebuild_pending_crypto_index()
+    now = datetime.now()
+    in_a_minute = (now + timedelta(minutes=1)).strftime(FMT)
+
+    assert to_micro_usdt(12.345) == 12345000 and to_micro_usdt("0.0000005") == 1
+    older = Database.create_crypto_payment_request(5, 100000, 12.345, "TWallet", plan_id=1)
+    newer = Database.create_crypto_payment_request(6, 100000, 12.345, "TWallet", plan_id=1)
+    assert Database.create_crypto_payment_request(7, 50000, 3.1, "TWallet", expires_at=now + timedelta(seconds=30), plan_id=1)
+
+    assert _pending_ids(12.345, now.strftime(FMT)) == [older]
+    assert _pending_ids(12.345001, now.strftime(FMT)) == [newer]  # unique offset
+    assert _pending_ids(12.3451, now.strftime(FMT)) == []
+    assert _pending_ids(3.1, in_a_minute) == []        # closed by then
+
+    assert Database.mark_crypto_payment_paid(older, "tx1", 12.345)
+    assert not Database.mark_crypto_payment_paid(older, "tx1", 12.345)
+    assert _pending_ids(12.345, now.strftime(FMT)) == []
+
+    assert Database.update_crypto_payment_request_with_amount(newer, 12.5)
+    assert _pending_ids(12.345001, now.strftime(FMT)) == []
+    assert _pending_ids(12.5, now.strftime(FMT)) == [newer]
+
+    assert Database.expire_crypto_payments(in_a_minute) == 1
+    assert pending_crypto_requests.stats() == {'pending': 1, 'amounts': 1, 'built': True}
+
+    # A restart rebuilds the same view from crypto_payments
+    assert Database.rebuild_pending_crypto_index()
+    assert pending_crypto_requests.stats()['pending'] == 1
+    assert [row['user_id'] for row in pending_crypto_requests.candidates(12.5, now.strftime(FMT))] == [6]
+    assert _pending_ids(3.1, now.strftime(FMT)) == []    # expired, not reloaded
+
+    # A request whose window passed while the bot was down is still pending and must stay matchable
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute(
+            """INSERT INTO crypto_payments (user_id, payment_id, rial_amount, usdt_amount_requested, wallet_address,
+                                            status, created_at, expires_at, plan_id)
+               VALUES (9, 'lapsed', 50000, 4.2, 'TWallet', 'pending', ?, ?, 1)""",
+            ((now - timedelta(minutes=40)).strftime(FMT), (now - timedelta(minutes=5)).strftime(FMT))
+        )
+        db.commit()
+    finally:
+        db.close()
+    assert Database.rebuild_pending_crypto_index()
+    assert _pending_ids(4.2, (now - timedelta(minutes=10)).strftime(FMT)) == ['lapsed']
+    DBConnection.close_pool()
+
+
+def test_requests_get_unique_amounts_and_are_indexed_once_priced(tmp_path, monkeypatch):
+    """درخواست‌های هم‌مبلغ مبلغ یکتا بگیرند و درخواست بدون مبلغ تا قیمت‌گذاری در نمایه نباشد"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "crypto_unique.db"))
+    assert Database.init_database()
+    assert Database.rebuild_pending_crypto_index()
+    now = datetime.now().strftime(FMT)
+
+    first = Database.create_crypto_payment_request(5, 100000, 10, "TWallet", plan_id=1)
+    second = Database.create_crypto_payment_request(6, 100000, 10, "TWallet", plan_id=1)
+    unpriced = Database.create_crypto_payment_request(7, 100000, None, "TWallet", plan_id=1)
+    amounts = [Database.get_crypto_payment_request(p)['usdt_amount_requested'] for p in (first, second, unpriced)]
+    assert amounts == [10.0, 10.000001, 0]
+    assert pending_crypto_requests.stats()['pending'] == 2
+
+    assert Database.update_crypto_payment_request_with_amount(unpriced, 10)
+    assert Database.get_crypto_payment_request(unpriced)['usdt_amount_requested'] == 10.000002
+    assert _pending_ids(10.000002, now) == [unpriced]
+
+    # A paid request frees its amount for new requests
+    assert Database.mark_crypto_payment_paid(first, "tx1", 10)
+    again = Database.create_crypto_payment_request(8, 100000, 10, "TWallet", plan_id=1)
+    assert Database.get_crypto_payment_request(again)['usdt_amount_requested'] == 10.0
+    DBConnection.close_pool()
+
+
+def test_failed_expiry_keeps_requests_indexed(tmp_path, monkeypatch):
+    """اگر منقضی‌کردن در پایگاه داده شکست بخورد، درخواست‌ها در نمایه بمانند تا واریزشان گم نشود"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "crypto_expire.db"))
+    assert Database.init_database()
+    assert Database.rebuild_pending_crypto_index()
+    request = Database.create_crypto_payment_request(5, 100000, 9.5, "TWallet",
+                                                     expires_at=datetime.now() - timedelta(minutes=1), plan_id=1)
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("CREATE TRIGGER block_expiry BEFORE UPDATE ON crypto_payments BEGIN SELECT RAISE(ABORT, 'locked'); END")
+        db.commit()
+    finally:
+        db.close()
+
+    assert Database.expire_crypto_payments(datetime.now().strftime(FMT)) == 0
+    assert pending_crypto_requests.stats()['pending'] == 1
+    assert Database.get_crypto_payment_request(request)['status'] == 'pending'
+    DBConnection.close_pool()
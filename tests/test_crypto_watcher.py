@@ -0,0 +1,305 @@
+"""
+تست پایشگر واریزهای USDT-TRC20 با نشانگر افزایشی روی شبیه‌ساز TronGrid
+"""
+
+import asyncio
+import json
+import time
+
+import config
+from database.async_queries import AsyncDatabaseQueries
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+from services.crypto_payment_service import UsdtTransferWatcher, activate_crypto_payment
+from services.trongrid_stub import StubTronGrid
+
+WALLET = "TWalletUnderTest"
+CONTRACT = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
+
+
+def test_watcher_matches_transfers_incrementally_and_activates(tmp_path, monkeypatch):
+    """واریز با مبلغ دقیق درخواست را پرداخت‌شده و اشتراک را فعال کند و اجرای بعدی فقط واریزهای جدید را بخواند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "crypto_watch.db"))
+    assert Database.init_database()
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("INSERT INTO users (user_id, full_name) VALUES (5, 'Ali')")
+        db.execute("INSERT INTO plans (id, name, price, days) VALUES (1, 'Monthly', 100000, 30)")
+        db.commit()
+    finally:
+        db.close()
+
+    assert Database.rebuild_pending_crypto_index()
+    first_request = Database.create_crypto_payment_request(5, 100000, 12.345, WALLET, plan_id=1)
+    second_request = Database.create_crypto_payment_request(5, 100000, 7.5, WALLET, plan_id=1)
+    assert first_request and second_request
+
+    now_ms = int(time.time() * 1000) + 1000
+    chain = StubTronGrid(contract_address=CONTRACT)
+    paid_tx = chain.add_transfer(WALLET, 12.345, now_ms)
+    chain.add_transfer(WALLET, 1.0, now_ms)                                  # matches nothing
+    chain.add_transfer(WALLET, 7.5, now_ms + 1, contract_address="TFakeToken")  # other token
+
+    activated = []
+
+    async def on_paid(payment, transfer):
+        activated.append((payment['payment_id'], transfer['transaction_id'],
+                          await activate_crypto_payment(payment)))
+
+    watcher = UsdtTransferWatcher(WALLET, CONTRACT, api_key="key", base_url="https://trongrid.test",
+                                  page_size=1, transport=chain.transport, on_paid=on_paid)
+
+    async def run():
+        first = await watcher.poll_once()
+        requests_after_first = len(chain.requests)
+        later_tx = chain.add_transfer(WALLET, 7.5, now_ms + 5000)
+        second = await watcher.poll_once()
+        await watcher.close()
+        return first, requests_after_first, later_tx, second
+
+    try:
+        first, requests_after_first, later_tx, second = asyncio.run(run())
+    finally:
+        AsyncDatabaseQueries.shutdown()
+
+    assert (first['transfers'], first['matched'], first['unmatched']) == (2, 1, 1)
+    assert first['pages'] == 2                       # page_size=1 follows the fingerprint
+    assert chain.requests[1]['fingerprint'] == "1"
+    assert (second['transfers'], second['matched']) == (1, 1)   # already-seen transfers are skipped
+    assert all(r['contract_address'] == CONTRACT and r['only_to'] == 'true' for r in chain.requests)
+    assert int(chain.requests[requests_after_first]['min_timestamp']) == now_ms
+
+    assert [(payment_id, tx) for payment_id, tx, _ in activated] == [(first_request, paid_tx), (second_request, later_tx)]
+    assert all(subscription_id for _, _, subscription_id in activated)
+
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("SELECT payment_id, status, transaction_id, usdt_amount_received FROM crypto_payments ORDER BY id")
+        rows = [tuple(row) for row in db.fetchall()]
+    finally:
+        db.close()
+    assert rows == [(first_request, 'paid', paid_tx, 12.345), (second_request, 'paid', later_tx, 7.5)]
+
+    # Each paid request is recorded as a completed rial payment that its subscription applied once
+    assert db.connect()
+    try:
+        db.execute(
+            """SELECT c.subscription_id, p.amount, p.payment_method, p.status, p.gateway_ref_id, s.subscription_id AS applied
+               FROM crypto_payments c JOIN payments p ON p.payment_id = c.linked_payment_id
+               JOIN subscription_payments s ON s.payment_id = p.payment_id ORDER BY c.id"""
+        )
+        linked = [tuple(row) for row in db.fetchall()]
+    finally:
+        db.close()
+    assert [row[1:5] for row in linked] == [(100000, 'crypto', 'completed', paid_tx), (100000, 'crypto', 'completed', later_tx)]
+    assert all(row[0] and row[0] == row[5] for row in linked)
+
+    cursor = json.loads(Database.get_sync_watermark(UsdtTransferWatcher.CURSOR_NAME))
+    assert cursor['fingerprint'] is None
+    assert cursor['min_timestamp'] == cursor['last_timestamp'] == now_ms + 5000
+    assert cursor['seen'] == [later_tx]
+    DBConnection.close_pool()
+
+
+def test_failed_activation_is_retried_without_extending_twice(tmp_path, monkeypatch):
+    """فعال‌سازی ناموفق پرداخت تأییدشده در دور بعد دوباره انجام شود و تکرار آن اشتراک را دو بار تمدید نکند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "crypto_retry.db"))
+    assert Database.init_database()
+    Database.invalidate_plan_cache()
+    assert Database.rebuild_pending_crypto_index()
+    request = Database.create_crypto_payment_request(5, 100000, 12.345, WALLET, plan_id=1)   # plan 1 missing yet
+    chain = StubTronGrid(contract_address=CONTRACT)
+    tx = chain.add_transfer(WALLET, 12.345, int(time.time() * 1000) + 1000)
+    attempts = []
+
+    async def on_paid(payment, transfer):
+        attempts.append((transfer.get('retry', False), await activate_crypto_payment(payment)))
+
+    watcher = UsdtTransferWatcher(WALLET, CONTRACT, base_url="https://trongrid.test", transport=chain.transport,
+                                  on_paid=on_paid, activation_retry_after=0)
+
+    async def run():
+        first = await watcher.poll_once()           # paid, activation fails, retried in the same poll
+        db = DBConnection()
+        assert db.connect()
+        try:
+            db.execute("INSERT INTO plans (id, name, price, days) VALUES (1, 'Monthly', 100000, 30)")
+            db.commit()
+        finally:
+            db.close()
+        Database.invalidate_plan_cache()
+        second = await watcher.poll_once()          # retried successfully
+        third = await watcher.poll_once()           # nothing left to retry
+        subscription_id = attempts[-1][1]
+        replay = await activate_crypto_payment(Database.get_crypto_payment_request(request))
+        await watcher.close()
+        return first, second, third, subscription_id, replay
+
+    try:
+        first, second, third, subscription_id, replay = asyncio.run(run())
+    finally:
+        AsyncDatabaseQueries.shutdown()
+
+    assert (first['matched'], first['retried'], second['retried'], third['retried']) == (1, 1, 1, 0)
+    assert [retry for retry, _ in attempts] == [False, True, True]
+    assert attempts[0][1] is None and attempts[1][1] is None and subscription_id
+    assert replay == subscription_id
+    stored = Database.get_crypto_payment_request(request)
+    assert (stored['status'], stored['transaction_id'], stored['subscription_id']) == ('paid', tx, subscription_id)
+    subscription = Database.get_subscription(subscription_id)
+    assert subscription['amount_paid'] == 100000 and subscription['payment_method'] == 'crypto'
+    DBConnection.close_pool()
+
+
+def test_transfer_matching_several_requests_goes_to_review(tmp_path, monkeypatch):
+    """واریزی که با دو درخواست هم‌مبلغ جور است به هیچ‌کدام نسبت داده نشود و هر دو برای بررسی دستی علامت بخورند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "crypto_review.db"))
+    assert Database.init_database()
+    db = DBConnection()
+    assert db.connect()
+    try:
+        # Requests stored before amounts were made unique can share an amount
+        for payment_id, user_id in (("req-a", 5), ("req-b", 6)):
+            db.execute(
+                """INSERT INTO crypto_payments (user_id, payment_id, rial_amount, usdt_amount_requested, wallet_address,
+                                                status, created_at, expires_at, plan_id)
+                   VALUES (?, ?, 100000, 12.345, ?, 'pending', datetime('now', 'localtime', '-1 minute'),
+                           datetime('now', 'localtime', '+30 minutes'), 1)""",
+                (user_id, payment_id, WALLET)
+            )
+        db.commit()
+    finally:
+        db.close()
+    assert Database.rebuild_pending_crypto_index()
+    paid_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    assert len(Database.find_pending_crypto_payments(12.345, paid_at)) == 2
+
+    chain = StubTronGrid(contract_address=CONTRACT)
+    tx = chain.add_transfer(WALLET, 12.345, int(time.time() * 1000))
+    paid, reviewed = [], []
+
+    async def on_paid(payment, transfer):
+        paid.append(payment['payment_id'])
+
+    async def on_review(payments, transfer):
+        reviewed.append(([p['payment_id'] for p in payments], transfer['transaction_id']))
+
+    watcher = UsdtTransferWatcher(WALLET, CONTRACT, base_url="https://trongrid.test", transport=chain.transport,
+                                  on_paid=on_paid, on_review=on_review)
+
+    async def run():
+        summary = await watcher.poll_once()
+        await watcher.close()
+        return summary
+
+    try:
+        summary = asyncio.run(run())
+    finally:
+        AsyncDatabaseQueries.shutdown()
+
+    assert (summary['matched'], summary['needs_review']) == (0, 1)
+    assert paid == [] and reviewed == [(["req-a", "req-b"], tx)]
+    statuses = [Database.get_crypto_payment_request(p)['status'] for p in ("req-a", "req-b")]
+    assert statuses == ['needs_review', 'needs_review']
+    assert Database.find_pending_crypto_payments(12.345, paid_at) == []
+    DBConnection.close_pool()
+
+
+def test_transfer_paid_before_expiry_but_seen_after_it_still_matches(tmp_path, monkeypatch):
+    """واریزی که پیش از انقضای درخواست انجام شده ولی پس از آن دیده می‌شود درخواست را پرداخت کند و فقط درخواست‌های گذشته از مهلت منقضی شوند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "crypto_late.db"))
+    assert Database.init_database()
+    db = DBConnection()
+    assert db.connect()
+    try:
+        for payment_id, amount, created, expires in (("late-paid", 12.345, '-40 minutes', '-5 minutes'),
+                                                     ("unpaid", 7.5, '-40 minutes', '-5 minutes'),
+                                                     ("in-grace", 3.1, '-40 minutes', '-30 seconds')):
+            db.execute(
+                """INSERT INTO crypto_payments (user_id, payment_id, rial_amount, usdt_amount_requested, wallet_address,
+                                                status, created_at, expires_at, plan_id)
+                   VALUES (5, ?, 100000, ?, ?, 'pending', datetime('now', 'localtime', ?),
+                           datetime('now', 'localtime', ?), 1)""",
+                (payment_id, amount, WALLET, created, expires)
+            )
+        db.commit()
+    finally:
+        db.close()
+    assert Database.rebuild_pending_crypto_index()   # e.g. after the bot was down
+
+    chain = StubTronGrid(contract_address=CONTRACT)
+    tx = chain.add_transfer(WALLET, 12.345, int((time.time() - 10 * 60) * 1000))
+    paid = []
+
+    async def on_paid(payment, transfer):
+        paid.append((payment['payment_id'], transfer['transaction_id']))
+
+    watcher = UsdtTransferWatcher(WALLET, CONTRACT, base_url="https://trongrid.test", transport=chain.transport,
+                                  on_paid=on_paid, expiry_grace=60)
+
+    async def run():
+        summary = await watcher.poll_once()
+        await watcher.close()
+        return summary
+
+    try:
+        summary = asyncio.run(run())
+    finally:
+        AsyncDatabaseQueries.shutdown()
+
+    assert (summary['matched'], summary['unmatched'], summary['expired']) == (1, 0, 1)
+    assert paid == [("late-paid", tx)]
+    statuses = [Database.get_crypto_payment_request(p)['status'] for p in ("late-paid", "unpaid", "in-grace")]
+    assert statuses == ['paid', 'expired', 'pending']
+    DBConnection.close_pool()
+
+
+def test_failed_payment_write_is_retried_next_poll(tmp_path, monkeypatch):
+    """اگر ثبت پرداخت در پایگاه داده شکست بخورد، نشانگر از آن واریز عبور نکند و دور بعد دوباره بررسی شود"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "crypto_db_error.db"))
+    assert Database.init_database()
+    assert Database.rebuild_pending_crypto_index()
+    request = Database.create_crypto_payment_request(5, 100000, 12.345, WALLET, plan_id=1)
+    now_ms = int(time.time() * 1000) + 1000
+    chain = StubTronGrid(contract_address=CONTRACT)
+    chain.add_transfer(WALLET, 1.0, now_ms)                 # matches nothing, processed once
+    tx = chain.add_transfer(WALLET, 12.345, now_ms + 1)
+    paid = []
+
+    async def on_paid(payment, transfer):
+        paid.append((payment['payment_id'], transfer['transaction_id']))
+
+    def set_write_block(blocked):
+        db = DBConnection()
+        assert db.connect()
+        try:
+            db.execute("CREATE TRIGGER block_paid BEFORE UPDATE ON crypto_payments BEGIN SELECT RAISE(ABORT, 'locked'); END"
+                       if blocked else "DROP TRIGGER block_paid")
+            db.commit()
+        finally:
+            db.close()
+
+    watcher = UsdtTransferWatcher(WALLET, CONTRACT, base_url="https://trongrid.test", transport=chain.transport,
+                                  on_paid=on_paid)
+
+    async def run():
+        set_write_block(True)
+        first = await watcher.poll_once()
+        set_write_block(False)
+        second = await watcher.poll_once()
+        await watcher.close()
+        return first, second
+
+    try:
+        first, second = asyncio.run(run())
+    finally:
+        AsyncDatabaseQueries.shutdown()
+
+    assert (first['unmatched'], first['failed'], first['matched']) == (1, 1, 0)
+    assert (second['transfers'], second['matched'], second['failed']) == (1, 1, 0)
+    assert paid == [(request, tx)]
+    assert Database.get_crypto_payment_request(request)['status'] == 'paid'
+    assert json.loads(Database.get_sync_watermark(UsdtTransferWatcher.CURSOR_NAME))['seen'] == [tx]
+    DBConnection.close_pool()
@@ -0,0 +1,109 @@
+"""
+تست استخر اتصال‌های پایگاه داده
+"""
+
+from database.pool import SQLiteConnectionPool
+
+
+def test_pool_reuses_released_connection(tmp_path):
+    """اتصال آزادشده باید دوباره استفاده شود"""
+    pool = SQLiteConnectionPool(str(tmp_path / "pool.db"), size=2)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    pool.close_all()
+
+
+def test_pool_overflow_and_rollback(tmp_path):
+    """در صورت پر بودن استخر، اتصال موقت ساخته می‌شود و تراکنش باز هنگام آزادسازی برگشت می‌خورد"""
+    pool = SQLiteConnectionPool(str(tmp_path / "pool.db"), size=1)
+    first = pool.acquire()
+    first.execute("CREATE TABLE t (x INTEGER)")
+    first.commit()
+    overflow = pool.acquire()
+    assert overflow is not first
+    assert pool.stats()['overflow_in_use'] == 1
+    pool.release(overflow)
+    assert pool.stats()['overflow_in_use'] == 0
+
+    first.execute("INSERT INTO t VALUES (1)")
+    pool.release(first)
+    conn = pool.acquire()
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    pool.release(conn)
+
+
+def test_overflow_is_capped_and_waits_for_a_returned_connection(tmp_path):
+    """پس از پر شدن سقف اتصال‌های اضافه، درخواست تا زمان مهلت منتظر بماند و با آزاد شدن اتصال ادامه دهد"""
+    import sqlite3
+    import threading
+
+    import pytest
+
+    pool = SQLiteConnectionPool(str(tmp_path / "pool.db"), size=1, max_overflow=1, timeout=0.2)
+    first = pool.acquire()
+    overflow = pool.acquire()
+    with pytest.raises(sqlite3.OperationalError):
+        pool.acquire()
+
+    pool.timeout = 5
+    threading.Timer(0.1, pool.release, (first,)).start()
+    assert pool.acquire() is first          # handed over once released
+    pool.release(overflow)
+    pool.release(first)
+    assert pool.stats() == {'size': 1, 'idle': 1, 'in_use': 0, 'overflow_in_use': 0}
+    pool.close_all()
+
+
+def test_close_all_closes_idle_and_late_released(tmp_path):
+    """بستن استخر اتصال‌های بیکار و اتصال‌هایی که بعداً آزاد می‌شوند را می‌بندد"""
+    pool = SQLiteConnectionPool(str(tmp_path / "pool.db"), size=2)
+    busy = pool.acquire()
+    idle = pool.acquire()
+    pool.release(idle)
+    pool.close_all()
+    assert pool.stats()['idle'] == 0
+    pool.release(busy)
+    assert pool.stats()['idle'] == 0
+    assert pool.stats()['in_use'] == 0
+
+
+def test_pragmas_applied_to_new_connections(tmp_path):
+    """تنظیمات PRAGMA باید روی هر اتصال جدید اعمال شود"""
+    pool = SQLiteConnectionPool(
+        str(tmp_path / "pool.db"), size=1,
+        pragmas={'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 2500, 'temp_store': 'MEMORY'},
+    )
+    effective = pool.effective_pragmas()
+    assert effective['journal_mode'] == 'wal'
+    assert effective['synchronous'] == 1
+    assert effective['busy_timeout'] == 2500
+    assert effective['temp_store'] == 2
+    pool.close_all()
+
+
+def test_unclosed_database_returns_its_slot(tmp_path, monkeypatch):
+    """نمونه Database که بدون close رها شود اتصالش را به استخر برگرداند و اتصال‌های ناشناخته نادیده گرفته شوند"""
+    import sqlite3
+
+    import config
+    from database.models import Database
+
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "leak.db"))
+    pool = Database.get_pool()
+
+    def leaky_query():
+        db = Database()
+        assert db.connect()
+        db.execute("SELECT 1")
+        return db.fetchone()[0]     # returns without db.close()
+
+    for _ in range(pool.size + 2):
+        assert leaky_query() == 1
+    assert pool.stats()['in_use'] == 0 and pool.stats()['overflow_in_use'] == 0
+
+    stranger = sqlite3.connect(":memory:")
+    pool.release(stranger)          # not ours: ignored, stats untouched
+    assert pool.stats()['in_use'] == 0
+    stranger.close()
+    Database.close_pool()
@@ -0,0 +1,66 @@
+"""
+تست پرس‌وجوی یکجای یادآوری‌های انقضای اشتراک
+"""
+
+from datetime import datetime, timedelta
+
+import config
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+
+FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def _seed(rows, users):
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.executemany("INSERT INTO users (user_id, full_name) VALUES (?, ?)", users)
+        db.executemany(
+            "INSERT INTO subscriptions (user_id, plan_id, start_date, end_date, status) VALUES (?, 1, '2020-01-01 00:00:00', ?, 'active')",
+            [(user_id, end_date.strftime(FMT)) for user_id, end_date in rows]
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_pending_reminders_skip_users_already_notified_today(tmp_path, monkeypatch):
+    """فقط کاربرانی که امروز یادآوری نگرفته‌اند برگردانده شوند و ثبت گروهی آن‌ها را حذف کند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "reminders.db"))
+    assert Database.init_database()
+    now = datetime.now()
+    _seed(
+        [
+            (1, now + timedelta(days=3, hours=2)),   # due for a 3-day reminder
+            (1, now + timedelta(days=3, hours=3)),   # second row, same day count: one reminder
+            (2, now + timedelta(days=2, hours=2)),   # already reminded today
+            (3, now + timedelta(days=10)),           # outside the window
+            (4, now + timedelta(hours=5)),           # less than a day left
+        ],
+        [(1, "Ali"), (2, "Sara")],
+    )
+    assert Database.add_notification(2, "expiration_reminder_2", "Reminder sent for 2 days left.")
+
+    reminders = Database.get_pending_expiration_reminders()
+    assert reminders == [{'user_id': 1, 'days_left': 3, 'full_name': "Ali"}]
+
+    assert Database.add_notifications([(1, "expiration_reminder_3", "Reminder sent for 3 days left.")])
+    assert Database.get_pending_expiration_reminders() == []
+    DBConnection.close_pool()
+
+
+def test_add_notifications_reports_failure(tmp_path, monkeypatch):
+    """اگر ثبت دسته‌ای اعلان‌ها شکست بخورد، موفقیت گزارش نشود"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "broken.db"))
+    assert Database.init_database()
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("DROP TABLE notifications")
+        db.commit()
+    finally:
+        db.close()
+
+    assert Database.add_notifications([(1, "expiration_reminder_3", "Reminder")]) is False
+    DBConnection.close_pool()
@@ -0,0 +1,36 @@
+"""
+تست زمان‌بند انقضای اشتراک‌ها
+"""
+
+from datetime import datetime, timedelta
+
+from services.expiry_scheduler import ExpiryScheduler
+
+
+def test_pop_due_returns_only_expired_users_in_order():
+    """فقط کاربرانی که زمان انقضایشان رسیده برگردانده می‌شوند"""
+    now = datetime(2030, 1, 1, 12, 0, 0)
+    scheduler = ExpiryScheduler()
+    scheduler.schedule(1, "2030-01-01 11:00:00")
+    scheduler.schedule(2, now - timedelta(minutes=5))
+    scheduler.schedule(3, "2030-01-02 00:00:00")
+
+    assert scheduler.next_due() == datetime(2030, 1, 1, 11, 0, 0)
+    assert scheduler.pop_due(now) == [1, 2]
+    assert scheduler.pop_due(now) == []
+    assert scheduler.next_due() == datetime(2030, 1, 2, 0, 0, 0)
+    assert len(scheduler) == 1
+
+
+def test_reschedule_and_cancel_supersede_old_entries():
+    """تمدید اشتراک زمان قبلی را بی‌اثر می‌کند و لغو، کاربر را حذف می‌کند"""
+    now = datetime(2030, 1, 1, 12, 0, 0)
+    scheduler = ExpiryScheduler()
+    scheduler.schedule(1, "2030-01-01 11:00:00")
+    scheduler.schedule(1, "2030-02-01 11:00:00")  # renewed
+    scheduler.schedule(2, "2030-01-01 10:00:00")
+    scheduler.cancel(2)
+    assert not scheduler.schedule(3, "not a date")
+
+    assert scheduler.pop_due(now) == []
+    assert scheduler.next_due() == datetime(2030, 2, 1, 11, 0, 0)
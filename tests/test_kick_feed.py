@@ -0,0 +1,104 @@
+"""
+تست فید افزایشی کاربران منقضی‌شده و دفتر حذف اعضا
+"""
+
+from datetime import datetime, timedelta
+
+import config
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+
+FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def _add_subscription_row(user_id, end_date, status='active', updated_at=None):
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute(
+            "INSERT INTO subscriptions (user_id, plan_id, start_date, end_date, status, updated_at) VALUES (?, 1, ?, ?, ?, ?)",
+            (user_id, "2020-01-01 00:00:00", end_date.strftime(FMT), status, updated_at and updated_at.strftime(FMT))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_feed_only_returns_changes_since_watermark(tmp_path, monkeypatch):
+    """فقط اشتراک‌هایی که پس از واترمارک غیرفعال شده‌اند برگردانده می‌شوند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "feed.db"))
+    assert Database.init_database()
+    now = datetime.now()
+    watermark = (now - timedelta(hours=1)).strftime(FMT)
+
+    _add_subscription_row(1, now - timedelta(days=30), status='inactive', updated_at=now - timedelta(days=30))  # old history
+    _add_subscription_row(2, now - timedelta(minutes=10))                                                    # just lapsed
+    _add_subscription_row(3, now + timedelta(days=3), status='cancelled', updated_at=now - timedelta(minutes=5))
+    _add_subscription_row(4, now + timedelta(days=3))                                                        # still active
+
+    feed = {row['user_id']: row['status'] for row in Database.get_newly_inactive_subscription_users(watermark)}
+    assert feed == {2: 'inactive', 3: 'cancelled'}
+
+    assert Database.get_sync_watermark("test_feed") is None
+    assert Database.set_sync_watermark("test_feed", watermark)
+    assert Database.get_sync_watermark("test_feed") == watermark
+    DBConnection.close_pool()
+
+
+def test_removal_ledger_is_cleared_by_new_subscription(tmp_path, monkeypatch):
+    """ثبت اشتراک جدید، کاربر را از دفتر حذف‌شده‌ها پاک می‌کند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "feed.db"))
+    assert Database.init_database()
+    assert Database.add_user(7)
+    assert Database.record_membership_removals(-1001, [7, 8])
+    assert Database.record_membership_removals(-1002, [7])
+    assert Database.get_removed_member_ids(-1001) == {7, 8}
+
+    assert Database.add_subscription(7, 1, None, 30, 0, 'rial') is not None
+    assert Database.get_removed_member_ids(-1001) == {8}
+    assert Database.get_removed_member_ids(-1002) == set()
+    DBConnection.close_pool()
+
+
+def test_channel_roster_returns_only_fresh_rows(tmp_path, monkeypatch):
+    """فقط وضعیت‌های به‌روز از فهرست محلی اعضای کانال خوانده می‌شوند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "roster.db"))
+    assert Database.init_database()
+    assert Database.update_channel_roster(-1001, {1: 'member', 2: 'left'})
+    assert Database.update_channel_roster(-1001, {2: 'member'})
+    assert Database.update_channel_roster(-1002, {1: 'kicked'})
+
+    recent = (datetime.now() - timedelta(minutes=1)).strftime(FMT)
+    future = (datetime.now() + timedelta(minutes=1)).strftime(FMT)
+    assert Database.get_channel_roster(-1001, recent) == {1: 'member', 2: 'member'}
+    assert Database.get_channel_roster(-1002, recent) == {1: 'kicked'}
+    assert Database.get_channel_roster(-1001, future) == {}
+    DBConnection.close_pool()
+
+
+def test_batch_writes_report_failure(tmp_path, monkeypatch):
+    """اگر نوشتن دسته‌ای شکست بخورد، تابع موفقیت گزارش نکند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "broken.db"))
+    assert Database.init_database()
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("DROP TABLE membership_removals")
+        db.execute("DROP TABLE channel_roster")
+        db.commit()
+    finally:
+        db.close()
+
+    assert Database.record_membership_removals(-1001, [7]) is False
+    assert Database.clear_membership_removals(7) is False
+    assert Database.update_channel_roster(-1001, {7: 'member'}) is False
+
+    assert db.connect()
+    try:
+        db.execute("CREATE TRIGGER block_watermarks BEFORE INSERT ON sync_watermarks BEGIN SELECT RAISE(ABORT, 'locked'); END")
+        db.commit()
+    finally:
+        db.close()
+    assert Database.set_sync_watermark("kick_feed", "2024-01-01 00:00:00") is False
+    assert Database.get_sync_watermark("kick_feed") is None
+    DBConnection.close_pool()
@@ -0,0 +1,80 @@
+"""
+تست ایندکس درون‌حافظه‌ای کاربران مجاز
+"""
+
+from datetime import datetime, timedelta
+
+import config
+from database.member_index import AuthorizedMemberIndex
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+
+
+def _add_subscription_row(user_id, end_date, status='active'):
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute(
+            "INSERT INTO subscriptions (user_id, plan_id, start_date, end_date, status) VALUES (?, 1, ?, ?, ?)",
+            (user_id, "2020-01-01 00:00:00", end_date.strftime("%Y-%m-%d %H:%M:%S"), status)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_index_follows_subscriptions_bans_and_expiry(tmp_path, monkeypatch):
+    """ایندکس باید اشتراک فعال، انقضا و مسدودسازی را درست منعکس کند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "members.db"))
+    assert Database.init_database()
+    now = datetime.now()
+    _add_subscription_row(1, now + timedelta(days=10))
+    _add_subscription_row(2, now - timedelta(days=1))
+    _add_subscription_row(3, now + timedelta(days=10), status='cancelled')
+
+    index = AuthorizedMemberIndex(max_age=300)
+    assert index.is_authorized(1)
+    assert not index.is_authorized(2)
+    assert not index.is_authorized(3)
+    assert not index.is_authorized(4)
+
+    # Changes are only picked up for invalidated users (or on reconcile)
+    _add_subscription_row(4, now + timedelta(days=5))
+    assert not index.is_authorized(4)
+    index.invalidate_user(4)
+    assert index.is_authorized(4)
+
+    db = DBConnection()
+    assert db.connect()
+    db.execute("INSERT INTO banned_users (user_id, created_at) VALUES (1, '2020-01-01 00:00:00')")
+    db.commit()
+    db.close()
+    index.invalidate_user(1)
+    assert not index.is_authorized(1)
+
+    assert index.reconcile()
+    assert index.stats() == {'active': 2, 'banned': 1, 'dirty': 0}
+    DBConnection.close_pool()
+
+
+def test_failed_reads_keep_the_previous_index(tmp_path, monkeypatch):
+    """اگر خواندن از پایگاه داده شکست بخورد، ایندکس قبلی بماند و کاربر نامعتبرشده برای خواندن دوباره علامت‌دار بماند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "members_error.db"))
+    assert Database.init_database()
+    _add_subscription_row(1, datetime.now() + timedelta(days=10))
+    index = AuthorizedMemberIndex(max_age=300)
+    assert index.reconcile()
+
+    db = DBConnection()
+    assert db.connect()
+    db.execute("ALTER TABLE banned_users RENAME TO banned_users_moved")
+    db.commit()
+    db.close()
+
+    built_at = index._built_at
+    assert not index.reconcile()
+    assert index._built_at == built_at
+    index.invalidate_user(1)
+    assert index.is_authorized(1)               # previous entry still answers
+    assert index.stats() == {'active': 1, 'banned': 0, 'dirty': 1}
+    DBConnection.close_pool()
@@ -0,0 +1,89 @@
+"""
+تست کش کاتالوگ طرح‌ها
+"""
+
+import config
+from database.models import Database as DBConnection
+from database.plan_cache import PlanCatalogCache
+from database.queries import DatabaseQueries as Database
+
+
+def _add_plan(name, display_order=0):
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute(
+            "INSERT INTO plans (name, price, days, display_order) VALUES (?, ?, ?, ?)",
+            (name, 1000, 30, display_order)
+        )
+        db.commit()
+        return db.cursor.lastrowid
+    finally:
+        db.close()
+
+
+def test_catalog_is_loaded_once_and_reloaded_after_invalidate(tmp_path, monkeypatch):
+    """کاتالوگ یک بار بارگذاری می‌شود و پس از invalidate دوباره خوانده می‌شود"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "plans.db"))
+    assert Database.init_database()
+    first_id = _add_plan("basic", 1)
+    _add_plan("pro", 2)
+
+    cache = PlanCatalogCache(ttl=300)
+    loads = []
+    original_load = cache._load
+    monkeypatch.setattr(cache, "_load", lambda: loads.append(1) or original_load())
+
+    assert [p['name'] for p in cache.get_active_plans()] == ["basic", "pro"]
+    assert cache.get_plan(str(first_id))['name'] == "basic"
+    assert cache.get_plan(9999) is None
+    assert len(loads) == 1
+
+    _add_plan("vip", 3)
+    assert len(cache.get_active_plans()) == 2  # served from memory
+    cache.invalidate()
+    assert len(cache.get_active_plans()) == 3
+    assert len(loads) == 2
+    DBConnection.close_pool()
+
+
+def test_deactivate_plan_invalidates_shared_catalog(tmp_path, monkeypatch):
+    """غیرفعال کردن طرح باید بلافاصله در لیست طرح‌های فعال دیده شود"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "plans.db"))
+    assert Database.init_database()
+    Database.invalidate_plan_cache()
+    plan_id = _add_plan("basic")
+    Database.invalidate_plan_cache()
+
+    assert [p['id'] for p in Database.get_active_plans()] == [plan_id]
+    assert Database.deactivate_plan(plan_id)
+    assert Database.get_active_plans() == []
+    assert Database.get_plan(plan_id)['is_active'] == 0
+    DBConnection.close_pool()
+
+
+def test_failed_reload_keeps_previous_catalog(tmp_path, monkeypatch):
+    """اگر بارگذاری دوباره شکست بخورد کاتالوگ قبلی ارائه شود و خواندن بعدی دوباره تلاش کند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "plans_error.db"))
+    assert Database.init_database()
+    _add_plan("basic", 1)
+    cache = PlanCatalogCache(ttl=300)
+    assert [p['name'] for p in cache.get_active_plans()] == ["basic"]
+
+    db = DBConnection()
+    assert db.connect()
+    db.execute("ALTER TABLE plans RENAME TO plans_moved")
+    db.commit()
+    db.close()
+    cache.invalidate()
+    assert [p['name'] for p in cache.get_active_plans()] == ["basic"]
+    assert not cache._is_fresh()
+
+    db = DBConnection()
+    assert db.connect()
+    db.execute("ALTER TABLE plans_moved RENAME TO plans")
+    db.commit()
+    db.close()
+    _add_plan("pro", 2)
+    assert [p['name'] for p in cache.get_active_plans()] == ["basic", "pro"]
+    DBConnection.close_pool()
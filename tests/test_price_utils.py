@@ -0,0 +1,64 @@
+"""
+تست کش نرخ تتر نوبیتکس (stale-while-revalidate و single-flight)
+"""
+
+import asyncio
+
+import httpx
+
+from utils.price_utils import UsdtRateProvider
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _provider(prices, clock, requests):
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"status": "ok", "lastTradePrice": str(prices[len(requests) - 1])})
+
+    return UsdtRateProvider(url="https://nobitex.test/v3/orderbook/USDTIRT", ttl=60, max_stale=900,
+                            transport=httpx.MockTransport(handler), clock=clock)
+
+
+def test_concurrent_misses_share_one_request():
+    """درخواست‌های هم‌زمان در نبود کش فقط یک درخواست به نوبیتکس بفرستند"""
+    requests = []
+    provider = _provider([60000], FakeClock(), requests)
+
+    async def run():
+        rates = await asyncio.gather(*(provider.get_rate() for _ in range(10)))
+        await provider.close()
+        return rates
+
+    assert asyncio.run(run()) == [600000.0] * 10
+    assert len(requests) == 1
+
+
+def test_stale_rate_is_served_while_refreshing():
+    """نرخ قدیمی (ولی نه بیش از حد) فوراً برگردانده شود و به‌روزرسانی در پس‌زمینه انجام شود"""
+    requests = []
+    clock = FakeClock()
+    provider = _provider([60000, 61000], clock, requests)
+
+    async def run():
+        first = await provider.get_rate()
+        clock.now += 120                      # past the TTL, within max_stale
+        stale = await provider.get_rate(wait=False)
+        await provider.refresh()              # let the background refresh finish
+        fresh = await provider.get_rate(wait=False)
+        clock.now += 2000                     # too old to serve
+        expired = await provider.get_rate(wait=False)
+        await provider.close()
+        return first, stale, fresh, expired
+
+    first, stale, fresh, expired = asyncio.run(run())
+    assert (first, stale, fresh) == (600000.0, 600000.0, 610000.0)
+    assert expired is None
+    assert provider.age() == 2000
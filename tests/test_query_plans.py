@@ -0,0 +1,116 @@
+"""
+تست استفاده کوئری‌های پرتکرار از ایندکس (EXPLAIN QUERY PLAN)
+"""
+
+import pytest
+
+import config
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+from database.schema import USERS_TABLE
+
+
+@pytest.fixture
+def captured_queries(tmp_path, monkeypatch):
+    """پایگاه داده موقت می‌سازد و کوئری‌های اجراشده را ثبت می‌کند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "plans.db"))
+    assert Database.init_database()
+
+    captured = []
+    original_connect = DBConnection.connect
+
+    def recording_connect(self):
+        # Record at the cursor so queries run through db.cursor.execute() are seen too
+        connected = original_connect(self)
+        if connected and not isinstance(self.cursor, _RecordingCursor):
+            self.cursor = _RecordingCursor(self.cursor, captured)
+        return connected
+
+    monkeypatch.setattr(DBConnection, "connect", recording_connect)
+    yield captured
+    DBConnection.close_pool()
+
+
+class _RecordingCursor:
+    def __init__(self, cursor, captured):
+        self._cursor = cursor
+        self._captured = captured
+
+    def execute(self, query, params=()):
+        self._captured.append((query, params))
+        return self._cursor.execute(query, params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def _query_plan(query, params):
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        return " | ".join(row["detail"] for row in db.fetchall())
+    finally:
+        db.close()
+
+
+# (call, text identifying the query, index it must use, whether sorting in a temp b-tree is acceptable)
+HOT_QUERIES = [
+    (lambda: Database.get_user_active_subscription(1), "subscriptions", "idx_subscriptions_user_status_end", False),
+    (lambda: Database.get_payment_by_authority("A0001"), "payments", "idx_payments_transaction_method", False),
+    (lambda: Database.get_notifications(1, "expiry", "2024-01-01"), "notifications", "idx_notifications_user_type_sent", False),
+    (lambda: Database.get_ticket_messages(1), "ticket_messages", "idx_ticket_messages_ticket_timestamp", False),
+    (lambda: Database.get_stale_pending_zarinpal_payments("2024-01-01 00:00:00"),
+     "payment_method = 'zarinpal' AND status", "idx_payments_method_status_updated", True),
+    (lambda: Database.get_unactivated_zarinpal_payments("2024-01-01 00:00:00"),
+     "status = 'completed'", "idx_payments_method_status_updated", True),
+    (lambda: Database.create_crypto_payment_request(5, 100000, 12.345, "TWallet", plan_id=1),
+     "usdt_amount_requested >= ?", "idx_crypto_payments_status_amount_expires", False),
+    (lambda: Database.get_pending_expiration_reminders(), "NOT EXISTS", "idx_notifications_user_type_sent", True),
+]
+
+
+@pytest.mark.parametrize("call, marker, index, sorts", HOT_QUERIES)
+def test_hot_queries_use_index(captured_queries, call, marker, index, sorts):
+    """هر کوئری پرتکرار باید به جای اسکن کامل جدول از ایندکس مربوطه استفاده کند"""
+    call()
+    query, params = next((q, p) for q, p in captured_queries if marker in q)
+    plan = _query_plan(query, params)
+    assert index in plan, plan
+    assert sorts or "TEMP B-TREE" not in plan, plan
+
+
+def test_migrations_are_applied_once(tmp_path, monkeypatch):
+    """اجرای دوباره init_database نباید مهاجرت‌ها را تکرار کند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "migrations.db"))
+    assert Database.init_database()
+    assert Database.init_database()
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("SELECT version FROM schema_version")
+        versions = [row[0] for row in db.fetchall()]
+    finally:
+        db.close()
+        DBConnection.close_pool()
+    assert versions == sorted(set(versions))
+    assert versions[-1] >= 1
+
+
+def test_summary_columns_migration_on_existing_database(tmp_path, monkeypatch):
+    """مهاجرت ستون‌های خلاصه اشتراک روی پایگاه داده قدیمی که بخشی از ستون‌ها را دارد"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "legacy.db"))
+    db = DBConnection()
+    assert db.connect()
+    db.execute(USERS_TABLE)
+    db.execute("ALTER TABLE users ADD COLUMN total_subscription_days INTEGER DEFAULT 0")
+    db.commit()
+    db.close()
+
+    assert Database.init_database()
+    assert Database.add_user(42, username="legacy")
+    assert Database.update_user_subscription_summary(42, 30, "2030-01-01 00:00:00")
+    summary = Database.get_user_subscription_summary(42)
+    DBConnection.close_pool()
+    assert summary["total_subscription_days"] == 30
+    assert summary["subscription_expiration_date"] == "2030-01-01 00:00:00"
@@ -0,0 +1,105 @@
+"""
+تست اعمال یک‌باره هر پرداخت روی اشتراک
+"""
+
+from datetime import datetime
+
+import config
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+
+
+def test_payment_extends_subscription_only_once(tmp_path, monkeypatch):
+    """تکرار add_subscription برای یک پرداخت اشتراک را دوباره تمدید نکند، ولی پرداخت جدید تمدید کند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "sub_payments.db"))
+    assert Database.init_database()
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("INSERT INTO plans (id, name, price, days) VALUES (1, 'Monthly', 100000, 30)")
+        db.commit()
+    finally:
+        db.close()
+
+    first = Database.add_subscription(7, 1, 11, 30, 100000, 'zarinpal')
+    end_date = Database.get_subscription(first)['end_date']
+    assert first is not None
+
+    assert Database.add_subscription(7, 1, 11, 30, 100000, 'zarinpal') == first
+    assert Database.get_subscription(first)['end_date'] == end_date
+
+    assert Database.add_subscription(7, 1, 12, 30, 100000, 'zarinpal') == first
+    assert Database.get_subscription(first)['end_date'] > end_date
+
+    assert db.connect()
+    try:
+        db.execute("SELECT payment_id, subscription_id FROM subscription_payments ORDER BY payment_id")
+        assert [tuple(row) for row in db.fetchall()] == [(11, first), (12, first)]
+    finally:
+        db.close()
+    DBConnection.close_pool()
+
+
+def test_unfinished_claims_are_recovered(tmp_path, monkeypatch):
+    """ادعای ناتمام قدیمی دوباره فعال‌سازی شود، ادعای تازه در جریان بماند و فعال‌سازی ثبت‌شده تکرار نشود"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "sub_claims.db"))
+    assert Database.init_database()
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("INSERT INTO plans (id, name, price, days) VALUES (1, 'Monthly', 100000, 30)")
+        db.executemany(
+            "INSERT INTO subscription_payments (payment_id, user_id, applied_at) VALUES (?, ?, ?)",
+            [(21, 7, "2020-01-01 00:00:00"),                            # crashed long ago
+             (22, 8, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),     # still being activated
+             (23, 9, "2020-01-01 00:00:00")]                            # activated, never finished
+        )
+        db.execute(
+            "INSERT INTO subscriptions (id, user_id, plan_id, payment_id, start_date, end_date, status) "
+            "VALUES (50, 9, 1, 23, '2020-01-01 00:00:00', '2099-01-01 00:00:00', 'active')"
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    recovered = Database.add_subscription(7, 1, 21, 30, 100000, 'zarinpal')
+    assert recovered is not None
+    assert Database.add_subscription(8, 1, 22, 30, 100000, 'zarinpal') is None
+    assert Database.add_subscription(9, 1, 23, 30, 100000, 'zarinpal') == 50
+    assert Database.get_subscription(50)['end_date'] == '2099-01-01 00:00:00'
+
+    assert db.connect()
+    try:
+        db.execute("SELECT payment_id, subscription_id FROM subscription_payments ORDER BY payment_id")
+        assert [tuple(row) for row in db.fetchall()] == [(21, recovered), (22, None), (23, 50)]
+    finally:
+        db.close()
+    DBConnection.close_pool()
+
+
+def test_claim_payment_completion_reports_database_errors(tmp_path, monkeypatch):
+    """خطای پایگاه داده در ثبت تکمیل پرداخت با None از «قبلاً تکمیل شده» (False) جدا شود"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "claim_error.db"))
+    assert Database.init_database()
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute(
+            "INSERT INTO payments (payment_id, user_id, plan_id, amount, payment_method, status) "
+            "VALUES (1, 7, 1, 100000, 'zarinpal', 'pending_verification')"
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    assert Database.claim_payment_completion(1, "9") is True
+    assert Database.claim_payment_completion(1, "9") is False
+
+    assert db.connect()
+    try:
+        db.execute("DROP TABLE payments")
+        db.commit()
+    finally:
+        db.close()
+    assert Database.claim_payment_completion(1, "9") is None
+    DBConnection.close_pool()
@@ -0,0 +1,136 @@
+"""
+تست آداپتور ناهمگام زرین‌پال و قطع‌کننده مدار
+"""
+
+import asyncio
+import time
+
+from services.circuit_breaker import CircuitBreaker
+from services.zarinpal_service import AsyncZarinpalGateway
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SlowService:
+    delay = 0.0
+    calls = 0
+
+    @classmethod
+    def verify_payment(cls, amount, authority):
+        cls.calls += 1
+        time.sleep(cls.delay)
+        return {'status': 100, 'ref_id': 42}
+
+
+def test_circuit_breaker_opens_and_recovers_through_half_open():
+    """مدار پس از خطاهای متوالی باز شود، پس از مهلت یک درخواست آزمایشی بپذیرد و با موفقیت بسته شود"""
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    clock.now += 31
+    assert breaker.allow()          # the single half-open trial
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+
+def test_slow_gateway_times_out_then_fails_fast():
+    """تماس کند با مهلت زمانی قطع شود و پس از باز شدن مدار، تماس‌ها بدون انتظار رد شوند"""
+    SlowService.delay, SlowService.calls = 0.2, 0
+    gateway = AsyncZarinpalGateway(workers=2, timeout=0.05, service=SlowService,
+                                   breaker=CircuitBreaker("zarinpal-test", failure_threshold=1, reset_timeout=60))
+
+    async def run():
+        first = await gateway.verify_payment(amount=10000, authority="A1")
+        second = await gateway.verify_payment(amount=10000, authority="A2")
+        return first, second
+
+    first, second = asyncio.run(run())
+    gateway.shutdown(wait=True)
+    assert first['status'] == AsyncZarinpalGateway.GATEWAY_TIMEOUT_STATUS
+    assert second['status'] == AsyncZarinpalGateway.GATEWAY_UNAVAILABLE_STATUS
+    assert AsyncZarinpalGateway.is_transient(first) and AsyncZarinpalGateway.is_transient(second)
+    assert SlowService.calls == 1
+    stats = gateway.stats()
+    assert stats['timeouts'] == 1 and stats['short_circuited'] == 1
+    assert stats['verify_latency']['count'] == 1
+
+
+def test_successful_call_runs_off_the_event_loop():
+    """تماس موفق نتیجه سرویس را بدون تغییر برگرداند"""
+    SlowService.delay, SlowService.calls = 0.0, 0
+    gateway = AsyncZarinpalGateway(workers=1, timeout=5, service=SlowService)
+    result = asyncio.run(gateway.verify_payment(amount=10000, authority="A3"))
+    gateway.shutdown(wait=True)
+    assert result == {'status': 100, 'ref_id': 42}
+    assert not AsyncZarinpalGateway.is_transient(result)
+    assert gateway.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_concurrent_verifications_share_one_gateway_call():
+    """درخواست‌های هم‌زمان برای یک authority یک تماس مشترک داشته باشند و نتیجه موفق کش شود"""
+    SlowService.delay, SlowService.calls = 0.05, 0
+    gateway = AsyncZarinpalGateway(workers=4, timeout=5, service=SlowService)
+
+    async def run():
+        burst = await asyncio.gather(*(gateway.verify_payment(amount=10000, authority="A4") for _ in range(5)))
+        later = await gateway.verify_payment(amount=10000, authority="A4")
+        return burst, later
+
+    burst, later = asyncio.run(run())
+    gateway.shutdown(wait=True)
+    assert SlowService.calls == 1
+    assert all(result == {'status': 100, 'ref_id': 42} for result in burst)
+    assert later == {'status': 101, 'ref_id': 42}
+    stats = gateway.stats()
+    assert stats['verify_coalesced'] == 4 and stats['verify_cache_hits'] == 1
+
+
+class BrokenService:
+    @staticmethod
+    def verify_payment(amount, authority):
+        raise RuntimeError("sdk exploded")
+
+    @staticmethod
+    def create_payment_request(**kwargs):
+        time.sleep(0.2)
+        return {'status': 100, 'authority': 'A'}
+
+
+def test_failed_or_cancelled_trial_does_not_wedge_the_circuit():
+    """آزمایش نیمه‌باز که خطا بدهد یا لغو شود، مدار را برای همیشه مسدود نکند"""
+    clock = FakeClock()
+    breaker = CircuitBreaker("zarinpal-test", failure_threshold=1, reset_timeout=30, clock=clock)
+    gateway = AsyncZarinpalGateway(workers=2, timeout=5, service=BrokenService, breaker=breaker)
+
+    async def cancelled_request():
+        task = asyncio.ensure_future(gateway.create_payment_request(1000, "d", "https://cb"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    first = asyncio.run(gateway.verify_payment(amount=10000, authority="B1"))
+    assert first['status'] == -100 and breaker.state == CircuitBreaker.OPEN
+
+    clock.now += 31
+    trial = asyncio.run(gateway.verify_payment(amount=10000, authority="B2"))   # raising trial
+    assert trial['status'] == -100 and breaker.state == CircuitBreaker.OPEN
+
+    clock.now += 31
+    asyncio.run(cancelled_request())                                           # cancelled trial
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now += 31
+    assert breaker.allow()
+    gateway.shutdown(wait=True)
+    assert gateway.stats()['failures'] == 3
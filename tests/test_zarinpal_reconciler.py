@@ -0,0 +1,194 @@
+"""
+تست تطبیق پس‌زمینه پرداخت‌های زرین‌پال با درگاه شبیه‌سازی‌شده
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import config
+from database.async_queries import AsyncDatabaseQueries
+from database.models import Database as DBConnection
+from database.queries import DatabaseQueries as Database
+from services.zarinpal_reconciler import ZarinpalReconciler, complete_verified_payment
+from services.zarinpal_service import AsyncZarinpalGateway
+from services.zarinpal_stub import StubZarinpalService
+
+FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def _seed_payment(user_id, authority, amount, created, payment_date="from_created"):
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute(
+            """INSERT INTO payments (user_id, plan_id, amount, payment_method, transaction_id, status, payment_date, updated_at)
+               VALUES (?, 1, ?, 'zarinpal', ?, 'pending_verification', ?, ?)""",
+            (user_id, amount, authority, created.strftime(FMT) if payment_date == "from_created" else payment_date,
+             created.strftime(FMT))
+        )
+        db.commit()
+        return db.cursor.lastrowid
+    finally:
+        db.close()
+
+
+def _count_subscriptions():
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.execute("SELECT COUNT(*) AS n FROM subscriptions")
+        return db.fetchone()['n']
+    finally:
+        db.close()
+
+
+def test_reconciler_activates_paid_payments_once_and_backs_off_unpaid(tmp_path, monkeypatch):
+    """پرداخت تأییدشده یک بار تکمیل و فعال شود، اجرای دوم کاری نکند و پرداخت ناتمام تا پایان مهلت معلق بماند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "reconcile.db"))
+    assert Database.init_database()
+    StubZarinpalService.reset()
+    db = DBConnection()
+    assert db.connect()
+    try:
+        db.executemany("INSERT INTO users (user_id, full_name) VALUES (?, ?)", [(1, "Ali"), (2, "Sara"), (3, "Reza")])
+        db.execute("INSERT INTO plans (id, name, price, days) VALUES (1, 'Monthly', 100000, 30)")
+        db.commit()
+    finally:
+        db.close()
+
+    now = datetime.now()
+    paid = StubZarinpalService.create_payment_request(100000, "plan", "https://example.com/cb")['authority']
+    unpaid = StubZarinpalService.create_payment_request(100000, "plan", "https://example.com/cb")['authority']
+    abandoned = StubZarinpalService.create_payment_request(100000, "plan", "https://example.com/cb")['authority']
+    StubZarinpalService.mark_paid(paid)
+    paid_id = _seed_payment(1, paid, 100000, now - timedelta(minutes=10))
+    unpaid_id = _seed_payment(2, unpaid, 100000, now - timedelta(minutes=10))
+    abandoned_id = _seed_payment(3, abandoned, 100000, now - timedelta(hours=2))
+    _seed_payment(3, "fresh", 100000, now)  # too recent to be checked
+
+    notified = []
+
+    async def on_activated(payment, ref_id, subscription_id):
+        notified.append((payment['payment_id'], subscription_id))
+
+    gateway = AsyncZarinpalGateway(workers=2, timeout=5, service=StubZarinpalService)
+    reconciler = ZarinpalReconciler(gateway, batch_size=10, min_age=300, max_age=3600, on_activated=on_activated)
+
+    async def run():
+        first = await reconciler.run_once()
+        second = await reconciler.run_once()
+        # The user now returns through the deep link: the payment is already completed
+        claimed = await AsyncDatabaseQueries.claim_payment_completion(paid_id, "1")
+        return first, second, claimed
+
+    try:
+        first, second, claimed = asyncio.run(run())
+    finally:
+        gateway.shutdown(wait=True)
+        AsyncDatabaseQueries.shutdown()
+
+    assert first['checked'] == 3
+    assert (first['activated'], first['pending'], first['expired']) == (1, 1, 1)
+    assert second['checked'] == 0           # unpaid one was touched, so it waits another min_age
+    assert StubZarinpalService.verify_calls == 3
+    assert not claimed
+    assert len(notified) == 1 and notified[0][0] == paid_id and notified[0][1]
+    assert _count_subscriptions() == 1
+
+    assert Database.get_payment_by_id(paid_id)['status'] == 'completed'
+    assert Database.get_payment_by_id(paid_id)['gateway_ref_id']
+    unpaid_row = Database.get_payment_by_id(unpaid_id)
+    assert unpaid_row['status'] == 'pending_verification' and unpaid_row['updated_at']
+    assert Database.get_payment_by_id(abandoned_id)['status'] == 'expired'
+    DBConnection.close_pool()
+
+
+def test_reconciler_expires_undated_payments_without_overwriting_completed_ones(tmp_path, monkeypatch):
+    """پرداخت بدون تاریخ معتبر منقضی شود و انقضا پرداختی را که در این فاصله تکمیل شده بازنویسی نکند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "reconcile.db"))
+    assert Database.init_database()
+    StubZarinpalService.reset()
+    now = datetime.now()
+    missing = StubZarinpalService.create_payment_request(100000, "plan", "https://example.com/cb")['authority']
+    garbled = StubZarinpalService.create_payment_request(100000, "plan", "https://example.com/cb")['authority']
+    missing_id = _seed_payment(1, missing, 100000, now - timedelta(minutes=10), payment_date=None)
+    garbled_id = _seed_payment(2, garbled, 100000, now - timedelta(minutes=10), payment_date="yesterday")
+
+    gateway = AsyncZarinpalGateway(workers=2, timeout=5, service=StubZarinpalService)
+    reconciler = ZarinpalReconciler(gateway, batch_size=10, min_age=300, max_age=3600)
+    try:
+        summary = asyncio.run(reconciler.run_once())
+    finally:
+        gateway.shutdown(wait=True)
+        AsyncDatabaseQueries.shutdown()
+
+    assert (summary['checked'], summary['expired']) == (2, 2)
+    assert Database.get_payment_by_id(missing_id)['status'] == 'expired'
+    assert Database.get_payment_by_id(garbled_id)['status'] == 'expired'
+
+    completed_id = _seed_payment(3, "done", 100000, now - timedelta(hours=2))
+    assert Database.claim_payment_completion(completed_id, "7")
+    assert not Database.expire_pending_payment(completed_id)
+    assert Database.get_payment_by_id(completed_id)['status'] == 'completed'
+    DBConnection.close_pool()
+
+
+def test_completed_payment_without_subscription_is_activated_later(tmp_path, monkeypatch):
+    """پرداخت تکمیل‌شده‌ای که فعال‌سازی‌اش شکست خورده بعداً یک بار فعال شود و پرداخت‌های پیش از جدول subscription_payments دوباره اعمال نشوند"""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "reconcile_retry.db"))
+    assert Database.init_database()
+    Database.invalidate_plan_cache()
+    StubZarinpalService.reset()
+    now = datetime.now()
+    paid = StubZarinpalService.create_payment_request(100000, "plan", "https://example.com/cb")['authority']
+    StubZarinpalService.mark_paid(paid)
+    paid_id = _seed_payment(1, paid, 100000, now - timedelta(minutes=10))
+    legacy_id = _seed_payment(2, "legacy", 100000, now - timedelta(days=30))
+    db = DBConnection()
+    assert db.connect()
+    try:
+        # Completed before subscription_payments existed, so never recorded there
+        db.execute("UPDATE payments SET status = 'completed', updated_at = '2020-01-01 00:00:00' WHERE payment_id = ?", (legacy_id,))
+        db.commit()
+    finally:
+        db.close()
+
+    notified = []
+
+    async def on_activated(payment, ref_id, subscription_id):
+        notified.append((payment['payment_id'], subscription_id))
+
+    gateway = AsyncZarinpalGateway(workers=2, timeout=5, service=StubZarinpalService)
+    reconciler = ZarinpalReconciler(gateway, batch_size=10, min_age=0, max_age=3600, on_activated=on_activated)
+
+    async def run():
+        first = await reconciler.run_once()         # verified and completed, but plan 1 is missing
+        db = DBConnection()
+        assert db.connect()
+        try:
+            db.execute("INSERT INTO plans (id, name, price, days) VALUES (1, 'Monthly', 100000, 30)")
+            db.commit()
+        finally:
+            db.close()
+        Database.invalidate_plan_cache()
+        second = await reconciler.run_once()        # retried successfully
+        third = await reconciler.run_once()         # nothing left to retry
+        # A path that loses the claim gets the subscription the reconciler activated
+        late = await complete_verified_payment(paid_id, 1, 1, 100000, "1")
+        return first, second, third, late
+
+    try:
+        first, second, third, late = asyncio.run(run())
+    finally:
+        gateway.shutdown(wait=True)
+        AsyncDatabaseQueries.shutdown()
+
+    assert (first['activated'], first['retried']) == (1, 1)    # retried in the same run, still no plan
+    assert notified[0] == (paid_id, None)
+    assert (second['checked'], second['retried'], third['retried']) == (0, 1, 0)
+    subscription_id = notified[1][1]
+    assert notified[1][0] == paid_id and subscription_id and len(notified) == 2
+    assert late == (False, subscription_id)
+    assert _count_subscriptions() == 1
+    assert Database.get_subscription(subscription_id)['user_id'] == 1
+    DBConnection.close_pool()
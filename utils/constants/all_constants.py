@@ -151,6 +151,15 @@ ZARINPAL_PAYMENT_VERIFIED_SUCCESS_SUB_ACTIVATION_FAILED_MESSAGE_USER = "پردا
 ZARINPAL_PAYMENT_VERIFIED_SUCCESS_PLAN_NOT_FOUND_MESSAGE_USER = "پرداخت شما با موفقیت تأیید شد، اما اطلاعات پلن یافت نشد. لطفاً با پشتیبانی تماس بگیرید.\n(کد رهگیری: {ref_id})"
 ZARINPAL_PAYMENT_VERIFICATION_FAILED_MESSAGE_USER = "تأیید پرداخت با خطا مواجه شد. در صورت کسر وجه، مبلغ طی ۷۲ ساعت به حساب شما باز خواهد گشت.\nدر صورت عدم بازگشت وجه بعد از مدت زمان مذکور، لطفاً با پشتیبانی تماس بگیرید.\n(کد خطا: {error_code})"
 ZARINPAL_PAYMENT_CANCELLED_MESSAGE_USER = "پرداخت توسط شما لغو شد."
+ZARINPAL_PAYMENT_COMPLETION_DB_ERROR_MESSAGE_USER = "پرداخت شما در درگاه تأیید شد، اما ثبت آن در سیستم موقتاً ممکن نشد. پرداخت شما به‌صورت خودکار دوباره بررسی و اشتراک فعال خواهد شد؛ در صورت نیاز با پشتیبانی تماس بگیرید.\n(کد رهگیری: {ref_id})"
+ZARINPAL_GATEWAY_UNAVAILABLE_MESSAGE_USER = "درگاه زرین‌پال در حال حاضر پاسخ نمی‌دهد. پرداخت شما در انتظار تأیید باقی می‌ماند؛ لطفاً چند دقیقه دیگر دوباره برای تأیید اقدام کنید."
+CRYPTO_PAYMENT_CONFIRMED_MESSAGE_USER = "واریز {usdt_amount} USDT شما روی شبکه تأیید شد. اشتراک پلن '{plan_name}' برای شما فعال گردید.\n(شناسه تراکنش: {tx_id})"
+CRYPTO_PAYMENT_CONFIRMED_ACTIVATION_FAILED_MESSAGE_USER = "واریز {usdt_amount} USDT شما روی شبکه تأیید شد، اما در فعال‌سازی اشتراک خطایی رخ داد. لطفاً فوراً با پشتیبانی تماس بگیرید.\n(شناسه تراکنش: {tx_id})"
+CRYPTO_PAYMENT_NOT_SEEN_YET_MESSAGE_USER = "واریز {usdt_amount} USDT هنوز روی شبکه دیده نشده است. تأیید تراکنش ممکن است چند دقیقه طول بکشد؛ پس از تأیید، اشتراک شما خودکار فعال و به شما اطلاع داده می‌شود."
+CRYPTO_PAYMENT_ALREADY_ACTIVATED_MESSAGE_USER = "واریز شما تأیید و اشتراک شما فعال شده است.\n(شناسه تراکنش: {tx_id})"
+CRYPTO_PAYMENT_ACTIVATION_PENDING_MESSAGE_USER = "واریز شما روی شبکه تأیید شده و فعال‌سازی اشتراک در حال انجام است. پس از فعال‌سازی به شما اطلاع داده می‌شود.\n(شناسه تراکنش: {tx_id})"
+CRYPTO_PAYMENT_EXPIRED_MESSAGE_USER = "مهلت این درخواست پرداخت ({usdt_amount} USDT) به پایان رسیده است. اگر واریز انجام داده‌اید، لطفاً با پشتیبانی تماس بگیرید."
+CRYPTO_PAYMENT_NEEDS_REVIEW_MESSAGE_USER = "پرداخت شما نیاز به بررسی توسط پشتیبانی دارد. لطفاً با پشتیبانی تماس بگیرید."
 GENERAL_ERROR_MESSAGE_USER = "متاسفانه خطایی رخ داده است. لطفا دوباره تلاش کنید یا با پشتیبانی تماس بگیرید."
 
 SUBSCRIPTION_STATUS_NONE = """
@@ -1,62 +1,144 @@
-import requests
+import asyncio
 import math
 import time
 from typing import Optional
 
-from config import logger, NOBITEX_API_KEY, NOBITEX_API_BASE_URL
+import httpx
 
-# Cache variables for USDT→IRR rate to avoid hitting the API more than once per minute
-_cached_rate_irr: Optional[float] = None
-_cache_timestamp: float = 0.0
+import config
+from config import logger, NOBITEX_API_KEY, NOBITEX_API_BASE_URL
 
 NOBITEX_USDT_IRT_ORDERBOOK_URL = f"{NOBITEX_API_BASE_URL.rstrip('/')}/v3/orderbook/USDTIRT"
 
-async def get_usdt_to_irr_rate(force_refresh: bool = False) -> float | None:
-    """Return USDT→IRR rate.
 
-    The value is fetched from Nobitex and cached for up to 60 seconds to respect API
-    limits. If *force_refresh* is True, the cache is bypassed.
+class UsdtRateProvider:
+    """USDT→IRR rate from Nobitex with stale-while-revalidate caching.
+
+    A rate younger than ``ttl`` seconds is served as is; once it is older than
+    ``refresh_ahead`` (a fraction of ``ttl``) a background refresh is started. A
+    rate up to ``max_stale`` seconds old is still served while that refresh runs,
+    so callers never wait on Nobitex unless there is no usable rate at all.
+    Concurrent refreshes share one in-flight request (single-flight), and requests
+    go through one pooled ``httpx.AsyncClient``.
     """
 
-    global _cached_rate_irr, _cache_timestamp
-
-    now = time.time()
-    if not force_refresh and _cached_rate_irr is not None and (now - _cache_timestamp) < 60:
-        return _cached_rate_irr
-
-    try:
-        headers = {}
-        if NOBITEX_API_KEY:
-            headers["Authorization"] = f"Bearer {NOBITEX_API_KEY}"
-
-        response = requests.get(NOBITEX_USDT_IRT_ORDERBOOK_URL, timeout=10, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-
-        # Nobitex returns data["lastTradePrice"] in TOMAN when status == "ok"
-        if data.get("status") == "ok":
-            last_trade_price_toman_str = data.get("lastTradePrice") or data.get("lastTradePrice", data.get("lastTradePriceToman"))
-            if last_trade_price_toman_str:
-                last_trade_price_toman = float(last_trade_price_toman_str)
-                rate_irr = last_trade_price_toman * 10  # toman→rial
-                _cached_rate_irr = rate_irr
-                _cache_timestamp = now
-                logger.info(
-                    "Fetched USDT/IRT rate from Nobitex: %.0f toman (%.0f IRR).", last_trade_price_toman, rate_irr
-                )
-                return rate_irr
-            logger.error("Nobitex API response missing 'lastTradePrice'. Response: %s", data)
+    def __init__(self, url: str = NOBITEX_USDT_IRT_ORDERBOOK_URL, ttl: float = 60, max_stale: float = 900,
+                 refresh_ahead: float = 0.8, timeout: float = 10, transport=None, clock=time.monotonic):
+        self.url = url
+        self.ttl = ttl
+        self.max_stale = max(ttl, max_stale)
+        self.refresh_after = ttl * refresh_ahead
+        self.timeout = timeout
+        self._transport = transport
+        self._clock = clock
+        self._rate = None
+        self._fetched_at = None
+        self._inflight = None
+        self._client = None
+        self._client_loop = None
+
+    def age(self) -> Optional[float]:
+        """Seconds since the cached rate was fetched, or None if there is none."""
+        if self._fetched_at is None:
             return None
-        logger.error("Nobitex API request failed. Response: %s", data)
+        return self._clock() - self._fetched_at
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # The client's connection pool belongs to the running event loop
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            headers = {"Authorization": f"Bearer {NOBITEX_API_KEY}"} if NOBITEX_API_KEY else {}
+            self._client = httpx.AsyncClient(
+                headers=headers,
+                timeout=httpx.Timeout(self.timeout, connect=5),
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+                transport=self._transport,
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def _fetch(self) -> Optional[float]:
+        try:
+            response = await self._get_client().get(self.url)
+            response.raise_for_status()
+            data = response.json()
+
+            # Nobitex returns data["lastTradePrice"] in TOMAN when status == "ok"
+            if data.get("status") == "ok":
+                last_trade_price_toman_str = data.get("lastTradePrice") or data.get("lastTradePriceToman")
+                if last_trade_price_toman_str:
+                    last_trade_price_toman = float(last_trade_price_toman_str)
+                    rate_irr = last_trade_price_toman * 10  # toman→rial
+                    self._rate = rate_irr
+                    self._fetched_at = self._clock()
+                    logger.info(
+                        "Fetched USDT/IRT rate from Nobitex: %.0f toman (%.0f IRR).", last_trade_price_toman, rate_irr
+                    )
+                    return rate_irr
+                logger.error("Nobitex API response missing 'lastTradePrice'. Response: %s", data)
+                return None
+            logger.error("Nobitex API request failed. Response: %s", data)
+            return None
+        except httpx.HTTPError as e:
+            logger.error("Error fetching USDT price from Nobitex: %s", e)
+        except (ValueError, TypeError) as e:
+            logger.error("Error parsing Nobitex API response: %s", e)
+        except Exception as e:
+            logger.error("Unexpected error fetching USDT price: %s", e)
         return None
-    except requests.exceptions.RequestException as e:
-        logger.error("Error fetching USDT price from Nobitex: %s", e)
-    except (ValueError, TypeError) as e:
-        logger.error("Error parsing Nobitex API response: %s", e)
-    except Exception as e:
-        logger.error("Unexpected error fetching USDT price: %s", e)
-
-    return None
+
+    def refresh(self) -> asyncio.Task:
+        """Start a refresh unless one is already in flight; returns the shared task."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.get_running_loop().create_task(self._fetch(), name="usdt-rate-refresh")
+        return self._inflight
+
+    async def get_rate(self, force_refresh: bool = False, wait: bool = True) -> Optional[float]:
+        """Return the rate, or None if no usable rate is available.
+
+        With ``wait=False`` the call never waits on Nobitex: without a usable cached
+        rate it only starts a refresh and returns None.
+        """
+        if not force_refresh:
+            age = self.age()
+            if age is not None and age <= self.max_stale:
+                if age > self.refresh_after:
+                    self.refresh()
+                return self._rate
+            if not wait:
+                self.refresh()
+                return None
+        # shield: a cancelled caller must not cancel the request other callers share
+        return await asyncio.shield(self.refresh())
+
+    async def close(self):
+        if self._inflight is not None and not self._inflight.done():
+            self._inflight.cancel()
+        if self._client is not None and self._client_loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._client_loop = None
+
+
+usdt_rate_provider = UsdtRateProvider(
+    ttl=getattr(config, 'USDT_RATE_TTL', 60),
+    max_stale=getattr(config, 'USDT_RATE_MAX_STALE', 900),
+)
+
+
+async def get_usdt_to_irr_rate(force_refresh: bool = False, wait: bool = True) -> float | None:
+    """Return USDT→IRR rate.
+
+    Served from ``usdt_rate_provider`` (stale-while-revalidate, see UsdtRateProvider).
+    If *force_refresh* is True, the cache is bypassed. With *wait* False the call
+    never blocks on Nobitex and returns None when no usable rate is cached.
+    """
+    return await usdt_rate_provider.get_rate(force_refresh=force_refresh, wait=wait)
+
+
+def get_usdt_rate_age() -> float | None:
+    """Age in seconds of the cached USDT→IRR rate, or None if none has been fetched."""
+    return usdt_rate_provider.age()
 
 def convert_irr_to_usdt(irr_amount: float, usdt_rate: float) -> float | None:
     """Convert *irr_amount* (Rial) to USDT.
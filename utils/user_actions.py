@@ -1,5 +1,5 @@
 import json
-from database.queries import DatabaseQueries
+from database.activity_log_writer import activity_log_writer
 
 class UserAction:
     @staticmethod
@@ -7,6 +7,9 @@ class UserAction:
         """
         Logs a user action to the database.
 
+        The row is queued and inserted in a batch by the background activity log
+        writer, so callers (e.g. payment handlers) do not wait for the database.
+
         Args:
             telegram_id: The Telegram ID of the user.
             action_type: A string describing the type of action (e.g., 'crypto_payment_request').
@@ -15,7 +18,7 @@ class UserAction:
             user_db_id: Optional. The internal database ID (primary key) of the user from the 'users' table.
 
         Returns:
-            True if the log was successfully added, False otherwise.
+            True if the log was queued (or written), False otherwise.
         """
         details_json = None
         if details is not None:
@@ -34,7 +37,7 @@ class UserAction:
         #     if user_record and 'id' in user_record: # Check if 'id' is the PK column name
         #         user_db_id = user_record['id']
 
-        success = DatabaseQueries.add_user_activity_log(
+        success = activity_log_writer.enqueue(
             telegram_id=telegram_id,
             action_type=action_type,
             details=details_json,